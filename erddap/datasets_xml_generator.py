@@ -0,0 +1,375 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from sqlalchemy import Integer, BigInteger, SmallInteger, Float, Double, Boolean, DateTime
+
+class ErddapDatasetsXmlGenerator:
+    """
+    Builds the ERDDAP datasets.xml <dataset> entries directly from the SQLAlchemy
+    model metadata (EDDTableFromDatabase) and the parquet footers (EDDTableFromParquetFiles)
+    instead of running ERDDAP's GenerateDatasetsXml.sh, which starts a JVM and reads the data.
+    Database credentials are only ever read from the environment.
+    """
+
+    DWC_TERMS_CSV = Path(__file__).resolve().parents[1] / "align_schema" / "all_dwc_vertical.csv"
+    DWC_TERM_URL = "http://rs.tdwg.org/dwc/terms/"
+
+    TABLES = ["occurrence", "dna_derived", "mof"]
+    DATA_SOURCES = ["gbif", "obis"]
+
+    # Environment variables (same ones generate_erddap_datasets_from_postgres.sh reads from the .env)
+    ENV_DB_URL = "DATABASE_URL_ERDDAP" # jdbc:postgresql://host:port/database
+    ENV_DB_USER = "DB_USER"
+    ENV_DB_PASS = "DB_PASS"
+
+    DB_DRIVER = "org.postgresql.Driver"
+    DB_SCHEMA = "public"
+    RELOAD_EVERY_N_MINUTES = "10080" # 1 week
+
+    INSTITUTION = "NOAA PMEL"
+    INFO_URL = "https://www.pmel.noaa.gov/"
+    SUMMARY = "Integrated biological data from OBIS and GBIF. Right now there may be overlap and duplicates between the two data. Check data_source to see where the data originates from."
+    TITLE = "Integrated OBIS and GBIF data"
+
+    # source column name: (destinationName, units, ioos_category)
+    COORDINATE_VARIABLES = {
+        "latitude": ("latitude", "degrees_north", "Location"),
+        "decimalLatitude": ("latitude", "degrees_north", "Location"),
+        "longitude": ("longitude", "degrees_east", "Location"),
+        "decimalLongitude": ("longitude", "degrees_east", "Location"),
+        "time": ("time", "seconds since 1970-01-01T00:00:00Z", "Time"),
+        "depth": ("depth", "m", "Location")
+    }
+
+    # Known units for columns that aren't coordinates
+    COLUMN_UNITS = {
+        "minimumDepthInMeters": "m",
+        "maximumDepthInMeters": "m",
+        "minimumElevationInMeters": "m",
+        "maximumElevationInMeters": "m",
+        "coordinateUncertaintyInMeters": "m",
+        "distanceFromCentroidInMeters": "m",
+        "elevation": "m",
+        "elevationAccuracy": "m",
+        "depthAccuracy": "m",
+        "shoredistance": "m",
+        "bathymetry": "m",
+        "sst": "degree_C"
+    }
+
+    TAXONOMY_COLUMNS = {"kingdom", "phylum", "class", "order", "family", "genus", "species", "scientificName", "taxonRank", "vernacularName"}
+
+    SQLALCHEMY_DATA_TYPES = [ # checked in order so subclasses (BigInteger, Double) come first
+        (Boolean, "boolean"),
+        (BigInteger, "long"),
+        (SmallInteger, "short"),
+        (Integer, "int"),
+        (Double, "double"),
+        (Float, "double"),
+        (DateTime, "double") # ERDDAP reads database timestamps as epoch seconds
+    ]
+
+    GRID_DATASET_ID = "arctic_occurrence_grid"
+    GRID_VARIABLES = ["record_count", "species_richness"] # see export/polar_grid_exporter.py
+
+    def __init__(self, parquet_export_dir: str = None, output_file: str = None, max_workers: int = 9, grid_dir: str = None):
+        """
+        parquet_export_dir is the GeoParquet export directory written by export/main.py
+        (<table>/data_source=<source>/year=<year>/) and grid_dir the monthly NetCDF grid
+        directory written by export/grid_main.py. If not given only the database
+        datasets are generated.
+        """
+        self.parquet_export_dir = Path(parquet_export_dir) if parquet_export_dir else None
+        self.grid_dir = Path(grid_dir) if grid_dir else None
+        self.output_file = Path(output_file) if output_file else Path(__file__).resolve().parent / "output_xml" / "datasets_generated.xml"
+        self.max_workers = max_workers
+        self.dwc_terms = self.read_dwc_terms()
+
+    def read_dwc_terms(self) -> dict:
+        """
+        The Darwin Core terms as {lowercase term: term}
+        """
+        with open(self.DWC_TERMS_CSV) as f:
+            terms = [line.strip() for line in f if line.strip()]
+        return {term.lower(): term for term in terms}
+
+    def generate(self) -> Path:
+        """
+        Builds every dataset variant in parallel and writes them to the output file.
+        There are three per table: the database view and one parquet dataset per data source.
+        """
+        tasks = [(self.build_database_dataset, (table,)) for table in self.TABLES]
+        if self.parquet_export_dir is not None:
+            tasks.extend(
+                (self.build_parquet_dataset, (table, data_source))
+                for table in self.TABLES
+                for data_source in self.DATA_SOURCES
+            )
+        if self.grid_dir is not None:
+            tasks.append((self.build_grid_dataset, ()))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            datasets = list(executor.map(lambda task: task[0](*task[1]), tasks))
+
+        root = ET.Element("erddapDatasets")
+        for dataset in datasets:
+            if dataset is not None:
+                root.append(dataset)
+
+        ET.indent(root, space="    ")
+        self.output_file.parent.mkdir(parents=True, exist_ok=True)
+        ET.ElementTree(root).write(self.output_file, encoding="utf-8", xml_declaration=True)
+        print(f"Wrote {len(root)} datasets to {self.output_file}")
+
+        return self.output_file
+
+    @staticmethod
+    def database_dataset_id(table: str) -> str:
+        return f"arctic_{table}_db"
+
+    @staticmethod
+    def parquet_dataset_id(table: str, data_source: str) -> str:
+        return f"arctic_{table}_{data_source}_parquet"
+
+    def build_database_dataset(self, table: str) -> ET.Element:
+        """
+        EDDTableFromDatabase entry for the ERDDAP view of the table (see models/erddap_views.py)
+        """
+        from models.erddap_views import ERDDAP_VIEWS
+
+        view_name = f"erddap_{table}"
+        db_url, db_user, db_pass = self.get_db_credentials()
+
+        dataset = ET.Element("dataset", type="EDDTableFromDatabase", datasetID=self.database_dataset_id(table), active="true")
+        ET.SubElement(dataset, "sourceUrl").text = db_url
+        ET.SubElement(dataset, "driverName").text = self.DB_DRIVER
+        ET.SubElement(dataset, "connectionProperty", name="user").text = db_user
+        ET.SubElement(dataset, "connectionProperty", name="password").text = db_pass
+        ET.SubElement(dataset, "catalogName").text = db_url.rsplit("/", 1)[-1].split("?")[0]
+        ET.SubElement(dataset, "schemaName").text = self.DB_SCHEMA
+        ET.SubElement(dataset, "tableName").text = view_name
+        ET.SubElement(dataset, "columnNameQuotes").text = '"' # Columns are camelCase in Postgres
+        ET.SubElement(dataset, "orderBy").text = "time"
+        ET.SubElement(dataset, "sourceNeedsExpandedFP_EQ").text = "true"
+        ET.SubElement(dataset, "reloadEveryNMinutes").text = self.RELOAD_EVERY_N_MINUTES
+        dataset.append(self.build_global_attributes(table=table, source_url="(local database)"))
+
+        # The keys are the view's actual column names (a duplicated name gets relabeled, e.g. depth_1)
+        for column_name, column in ERDDAP_VIEWS[view_name].selected_columns.items():
+            data_type, units = self.sqlalchemy_to_erddap_type(column.type)
+            if data_type is not None:
+                dataset.append(self.build_data_variable(source_name=column_name, data_type=data_type, units=units))
+
+        self.check_destination_names(dataset=dataset)
+        return dataset
+
+    def build_parquet_dataset(self, table: str, data_source: str) -> ET.Element:
+        """
+        EDDTableFromParquetFiles entry for the exported GeoParquet partitions of the
+        table and data source. Only the footer of one file is read.
+        """
+        file_dir = self.parquet_export_dir / table / f"data_source={data_source}"
+        sample_file = next(file_dir.rglob("*.parquet"), None) if file_dir.exists() else None
+        if sample_file is None:
+            print(f"No parquet files found in {file_dir}, skipping {self.parquet_dataset_id(table, data_source)}")
+            return None
+
+        dataset = ET.Element("dataset", type="EDDTableFromParquetFiles", datasetID=self.parquet_dataset_id(table, data_source), active="true")
+        ET.SubElement(dataset, "reloadEveryNMinutes").text = self.RELOAD_EVERY_N_MINUTES
+        ET.SubElement(dataset, "updateEveryNMillis").text = "0"
+        ET.SubElement(dataset, "fileDir").text = f"{file_dir}/"
+        ET.SubElement(dataset, "fileNameRegex").text = r".*\.parquet"
+        ET.SubElement(dataset, "recursive").text = "true"
+        ET.SubElement(dataset, "pathRegex").text = ".*"
+        ET.SubElement(dataset, "metadataFrom").text = "last"
+        ET.SubElement(dataset, "standardizeWhat").text = "0"
+        ET.SubElement(dataset, "sortFilesBySourceNames").text = "time"
+        ET.SubElement(dataset, "fileTableInMemory").text = "false"
+        dataset.append(self.build_global_attributes(table=table, source_url="(local files)"))
+
+        for field in pq.read_schema(sample_file):
+            data_type, units = self.arrow_to_erddap_type(field.type)
+            if data_type is not None:
+                dataset.append(self.build_data_variable(source_name=field.name, data_type=data_type, units=units))
+
+        self.check_destination_names(dataset=dataset)
+        return dataset
+
+    def build_grid_dataset(self) -> ET.Element:
+        """
+        EDDGridFromNcFiles entry for the monthly polar stereographic occurrence grids.
+        The files carry their own CF metadata so only the axes and variables are listed.
+        """
+        if self.grid_dir is None or next(self.grid_dir.glob("*.nc"), None) is None:
+            print(f"No NetCDF files found in {self.grid_dir}, skipping {self.GRID_DATASET_ID}")
+            return None
+
+        dataset = ET.Element("dataset", type="EDDGridFromNcFiles", datasetID=self.GRID_DATASET_ID, active="true")
+        ET.SubElement(dataset, "reloadEveryNMinutes").text = self.RELOAD_EVERY_N_MINUTES
+        ET.SubElement(dataset, "updateEveryNMillis").text = "0"
+        ET.SubElement(dataset, "fileDir").text = f"{self.grid_dir}/"
+        ET.SubElement(dataset, "fileNameRegex").text = r"arctic_occurrence_grid_.*\.nc"
+        ET.SubElement(dataset, "recursive").text = "false"
+        ET.SubElement(dataset, "metadataFrom").text = "last"
+
+        add_attributes = ET.SubElement(dataset, "addAttributes")
+        for name, value in [
+            ("cdm_data_type", "Grid"),
+            ("infoUrl", self.INFO_URL),
+            ("license", "[standard]"),
+            ("summary", f"Monthly counts of occurrence records and distinct taxa on a polar stereographic grid. {self.SUMMARY}")
+        ]:
+            ET.SubElement(add_attributes, "att", name=name).text = value
+
+        for axis_name, units in (("time", "seconds since 1970-01-01T00:00:00Z"), ("y", "m"), ("x", "m")):
+            axis = ET.SubElement(dataset, "axisVariable")
+            ET.SubElement(axis, "sourceName").text = axis_name
+            ET.SubElement(axis, "destinationName").text = axis_name
+            axis_attributes = ET.SubElement(axis, "addAttributes")
+            ET.SubElement(axis_attributes, "att", name="ioos_category").text = "Time" if axis_name == "time" else "Location"
+            ET.SubElement(axis_attributes, "att", name="units").text = units
+
+        for variable_name in self.GRID_VARIABLES:
+            variable = ET.SubElement(dataset, "dataVariable")
+            ET.SubElement(variable, "sourceName").text = variable_name
+            ET.SubElement(variable, "destinationName").text = variable_name
+            ET.SubElement(variable, "dataType").text = "int"
+            variable_attributes = ET.SubElement(variable, "addAttributes")
+            ET.SubElement(variable_attributes, "att", name="ioos_category").text = "Biology"
+
+        return dataset
+
+    def check_destination_names(self, dataset: ET.Element):
+        """ERDDAP rejects a dataset with two dataVariables of the same destinationName"""
+        names = [variable.findtext("destinationName") for variable in dataset.iter("dataVariable")]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"{dataset.get('datasetID')} has duplicate destinationNames {duplicates}")
+
+    def get_db_credentials(self) -> tuple:
+        """
+        Reads the JDBC url, user and password from the environment
+        """
+        missing = [var for var in [self.ENV_DB_URL, self.ENV_DB_USER, self.ENV_DB_PASS] if not os.getenv(var)]
+        if missing:
+            raise ValueError(f"Environment variable(s) {missing} not set - please add them to the .env file")
+
+        return os.getenv(self.ENV_DB_URL), os.getenv(self.ENV_DB_USER), os.getenv(self.ENV_DB_PASS)
+
+    def build_global_attributes(self, table: str, source_url: str) -> ET.Element:
+        add_attributes = ET.Element("addAttributes")
+        for name, value in [
+            ("cdm_data_type", "Point"),
+            ("Conventions", "COARDS, CF-1.10, ACDD-1.3"),
+            ("creator_email", "pmel.info@noaa.gov"),
+            ("creator_name", self.INSTITUTION),
+            ("creator_type", "institution"),
+            ("creator_url", self.INFO_URL),
+            ("infoUrl", self.INFO_URL),
+            ("institution", self.INSTITUTION),
+            ("license", "[standard]"),
+            ("sourceUrl", source_url),
+            ("standard_name_vocabulary", "CF Standard Name Table v70"),
+            ("summary", self.SUMMARY),
+            ("title", f"{self.TITLE} - {table}")
+        ]:
+            ET.SubElement(add_attributes, "att", name=name).text = value
+
+        return add_attributes
+
+    def build_data_variable(self, source_name: str, data_type: str, units: str = None) -> ET.Element:
+        """
+        A <dataVariable> with the ERDDAP destination name, units, ioos_category
+        and a reference to the Darwin Core term if the column is one.
+        """
+        destination_name, coordinate_units, ioos_category = self.COORDINATE_VARIABLES.get(source_name, (None, None, None))
+        if destination_name is None:
+            destination_name = self.to_destination_name(source_name)
+            ioos_category = self.get_ioos_category(source_name)
+        units = units or coordinate_units or self.COLUMN_UNITS.get(source_name)
+
+        variable = ET.Element("dataVariable")
+        ET.SubElement(variable, "sourceName").text = source_name
+        ET.SubElement(variable, "destinationName").text = destination_name
+        ET.SubElement(variable, "dataType").text = data_type
+
+        add_attributes = ET.SubElement(variable, "addAttributes")
+        ET.SubElement(add_attributes, "att", name="ioos_category").text = ioos_category
+        ET.SubElement(add_attributes, "att", name="long_name").text = self.to_long_name(source_name)
+        if units:
+            ET.SubElement(add_attributes, "att", name="units").text = units
+        if destination_name in ("latitude", "longitude", "time", "depth"):
+            ET.SubElement(add_attributes, "att", name="standard_name").text = destination_name
+
+        dwc_term = self.dwc_terms.get(source_name.lower())
+        if dwc_term:
+            ET.SubElement(add_attributes, "att", name="references").text = f"{self.DWC_TERM_URL}{dwc_term}"
+
+        return variable
+
+    def sqlalchemy_to_erddap_type(self, column_type) -> tuple:
+        """
+        ERDDAP dataType (and units for timestamps) for a SQLAlchemy column type.
+        Returns (None, None) for types ERDDAP can't read (like geography).
+        """
+        for sqlalchemy_type, erddap_type in self.SQLALCHEMY_DATA_TYPES:
+            if isinstance(column_type, sqlalchemy_type):
+                units = "seconds since 1970-01-01T00:00:00Z" if isinstance(column_type, DateTime) else None
+                return erddap_type, units
+
+        python_type = None
+        try:
+            python_type = column_type.python_type
+        except NotImplementedError:
+            pass
+
+        return ("String", None) if python_type is str else (None, None)
+
+    def arrow_to_erddap_type(self, arrow_type: pa.DataType) -> tuple:
+        """
+        ERDDAP dataType (and units for timestamps) for a parquet column.
+        Returns (None, None) for binary and nested columns.
+        """
+        if pa.types.is_boolean(arrow_type):
+            return "boolean", None
+        if pa.types.is_int8(arrow_type):
+            return "byte", None
+        if pa.types.is_int16(arrow_type) or pa.types.is_uint8(arrow_type):
+            return "short", None
+        if pa.types.is_int32(arrow_type) or pa.types.is_uint16(arrow_type):
+            return "int", None
+        if pa.types.is_integer(arrow_type):
+            return "long", None
+        if pa.types.is_float32(arrow_type):
+            return "float", None
+        if pa.types.is_floating(arrow_type):
+            return "double", None
+        if pa.types.is_timestamp(arrow_type):
+            unit_names = {"s": "seconds", "ms": "milliseconds", "us": "microseconds", "ns": "nanoseconds"}
+            return "long", f"{unit_names[arrow_type.unit]} since 1970-01-01T00:00:00Z"
+        if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type) or pa.types.is_string_view(arrow_type):
+            return "String", None
+        if pa.types.is_dictionary(arrow_type):
+            return self.arrow_to_erddap_type(arrow_type.value_type)
+
+        return None, None
+
+    def to_destination_name(self, source_name: str) -> str:
+        """ERDDAP destination names must start with a letter"""
+        return source_name if source_name[:1].isalpha() else f"a{source_name}"
+
+    def to_long_name(self, source_name: str) -> str:
+        """decimalLatitude -> Decimal Latitude, occurrence_source_id -> Occurrence Source Id"""
+        words = re.sub(r"(?<=[a-z0-9])(?=[A-Z])", " ", source_name).replace("_", " ").split()
+        return " ".join(word[:1].upper() + word[1:] for word in words)
+
+    def get_ioos_category(self, source_name: str) -> str:
+        if source_name in self.TAXONOMY_COLUMNS:
+            return "Taxonomy"
+        if source_name.lower().endswith("id") or source_name.lower().endswith("key"):
+            return "Identifier"
+        return "Unknown"
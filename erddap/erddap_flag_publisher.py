@@ -0,0 +1,147 @@
+import hashlib
+import json
+import requests
+from datetime import datetime
+from pathlib import Path
+from erddap.datasets_xml_generator import ErddapDatasetsXmlGenerator
+
+class ErddapFlagPublisher:
+    """
+    Publishes a load manifest at the end of a successful ETL run and tells ERDDAP to
+    reload only the datasets whose underlying tables or parquet partitions changed since
+    the previous manifest. ERDDAP is told either by touching a file named after the
+    datasetID in its flag directory (<bigParentDirectory>/flag/) or by calling a flag URL.
+    """
+
+    MANIFEST_FILE_PREFIX = "load_manifest"
+    LATEST_MANIFEST_FILE = "load_manifest_latest.json"
+
+    def __init__(self, manifest_dir: str, flag_dir: str = None, flag_url: str = None, flag_keys: dict = None):
+        """
+        flag_url is a template like
+        http://localhost:8080/erddap/setDatasetFlag.txt?datasetID={dataset_id}&flagKey={flag_key}
+        where flag_keys is {datasetID: flagKey} (from ERDDAP's status page or a local stand-in).
+        """
+        self.manifest_dir = Path(manifest_dir)
+        self.flag_dir = Path(flag_dir) if flag_dir else None
+        self.flag_url = flag_url
+        self.flag_keys = flag_keys or {}
+
+    def publish(self, loaded_tables: dict, parquet_export_dir: str = None) -> list:
+        """
+        Writes the manifest for this run and flags the changed datasets.
+        loaded_tables is {table_name: [{"file": parquet_path, "rows": rows_loaded}, ...]}, any
+        other keys of a load (e.g. when it was loaded) go into the fingerprint too.
+        Returns the flagged datasetIDs.
+        """
+        manifest = self.build_manifest(loaded_tables=loaded_tables, parquet_export_dir=parquet_export_dir)
+        previous_manifest = self.read_previous_manifest()
+
+        changed_dataset_ids = self.get_changed_dataset_ids(manifest=manifest, previous_manifest=previous_manifest)
+        self.write_manifest(manifest=manifest)
+
+        if not changed_dataset_ids:
+            print("No ERDDAP datasets changed, nothing to reload.")
+            return []
+
+        for dataset_id in changed_dataset_ids:
+            self.flag_dataset(dataset_id=dataset_id)
+
+        return changed_dataset_ids
+
+    def build_manifest(self, loaded_tables: dict, parquet_export_dir: str = None) -> dict:
+        """
+        The manifest has a fingerprint per ERDDAP datasetID, built from the files that were
+        loaded into its table (path, size, modified time, rows) or the files in its parquet partitions.
+        """
+        datasets = {}
+
+        for table_name, loads in loaded_tables.items():
+            files = [{**self.describe_file(load["file"]), **{k: v for k, v in load.items() if k != "file"}} for load in loads]
+            datasets[ErddapDatasetsXmlGenerator.database_dataset_id(table_name)] = {
+                "table": table_name,
+                "files": files,
+                "fingerprint": self.fingerprint(files)
+            }
+
+        if parquet_export_dir is not None:
+            export_dir = Path(parquet_export_dir)
+            for table_name in ErddapDatasetsXmlGenerator.TABLES:
+                for data_source in ErddapDatasetsXmlGenerator.DATA_SOURCES:
+                    partition_dir = export_dir / table_name / f"data_source={data_source}"
+                    files = [self.describe_file(f) for f in sorted(partition_dir.rglob("*.parquet"))]
+                    if files:
+                        datasets[ErddapDatasetsXmlGenerator.parquet_dataset_id(table_name, data_source)] = {
+                            "table": table_name,
+                            "files": files,
+                            "fingerprint": self.fingerprint(files)
+                        }
+
+        return {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "datasets": datasets
+        }
+
+    def describe_file(self, file_path: str) -> dict:
+        stat = Path(file_path).stat()
+        return {"file": str(file_path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+    def fingerprint(self, files: list) -> str:
+        return hashlib.sha256(json.dumps(sorted(files, key=lambda f: f["file"]), sort_keys=True).encode()).hexdigest()
+
+    def read_previous_manifest(self) -> dict:
+        latest_file = self.manifest_dir / self.LATEST_MANIFEST_FILE
+        if not latest_file.exists():
+            return {"datasets": {}}
+
+        with open(latest_file) as f:
+            return json.load(f)
+
+    def get_changed_dataset_ids(self, manifest: dict, previous_manifest: dict) -> list:
+        """
+        datasetIDs that are new or whose fingerprint differs from the previous manifest
+        """
+        previous_datasets = previous_manifest.get("datasets", {})
+        return [
+            dataset_id for dataset_id, dataset in manifest["datasets"].items()
+            if previous_datasets.get(dataset_id, {}).get("fingerprint") != dataset["fingerprint"]
+        ]
+
+    def write_manifest(self, manifest: dict):
+        """
+        Writes a dated copy of the manifest and replaces the latest manifest
+        """
+        self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        date_str = datetime.now().strftime("%Y-%m-%d_%H%M%S")
+
+        with open(self.manifest_dir / f"{self.MANIFEST_FILE_PREFIX}_{date_str}.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Write then rename so a crashed run never leaves a half written latest manifest
+        tmp_file = self.manifest_dir / f"{self.LATEST_MANIFEST_FILE}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(manifest, f, indent=2)
+        tmp_file.replace(self.manifest_dir / self.LATEST_MANIFEST_FILE)
+
+    def flag_dataset(self, dataset_id: str):
+        """
+        Touches the ERDDAP flag file and/or calls the flag URL for the dataset
+        """
+        if self.flag_dir is not None:
+            self.flag_dir.mkdir(parents=True, exist_ok=True)
+            (self.flag_dir / dataset_id).touch()
+            print(f"Flagged {dataset_id} in {self.flag_dir}")
+
+        if self.flag_url is not None:
+            url = self.flag_url.format(dataset_id=dataset_id, flag_key=self.flag_keys.get(dataset_id, ""))
+            try:
+                response = requests.get(url, timeout=30)
+                if response.status_code == 200:
+                    print(f"Flagged {dataset_id} at {url}")
+                else:
+                    print(f"Error {response.status_code} flagging {dataset_id}: {response.text}")
+            except requests.RequestException as e:
+                print(f"Error flagging {dataset_id}: {e}")
+
+        if self.flag_dir is None and self.flag_url is None:
+            print(f"{dataset_id} changed but no ERDDAP flag directory or flag url is configured")
@@ -21,6 +21,8 @@ export JAVA_OPTS="-Xmx4G -Xms4G -Djava.awt.headless=true"
 
 
 # Directory containg the parquet data files
+# For the partitioned GeoParquet written by export/main.py point this at one
+# table directory (e.g. <output_dir>/mof) - files are under data_source=*/year=*/
 # Use ${1} to accept it as the first command-line argument. Default set
 export directory=${1:-/home/users/zalmanek/arctic_postgres/get_test_data/test_data}
 
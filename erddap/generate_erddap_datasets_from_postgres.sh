@@ -52,7 +52,9 @@ DB_CATALOG="arctic_toolkit_test"
 # 6. Schema Name
 DB_SCHEMA="public"
 # 7. Table Name (use .* for all tables)
-DB_TABLE="mof"
+# Use the ERDDAP views (erddap_occurrence, erddap_dna_derived, erddap_mof) - they
+# have indexed latitude, longitude, time (epoch seconds) and depth columns
+DB_TABLE="erddap_mof"
 # 8. OrderBy (e.g., "time")
 DB_ORDER=""
 # 9. ReloadEveryMinutes - 1 week = 10,080
@@ -0,0 +1,42 @@
+import argparse
+import time
+from dotenv import load_dotenv
+
+from erddap.datasets_xml_generator import ErddapDatasetsXmlGenerator
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Generate the ERDDAP datasets.xml entries for the database views and the exported GeoParquet files"
+    )
+    parser.add_argument(
+        '-p',
+        '--parquet_export_dir',
+        type=str,
+        default=None,
+        help="path to the GeoParquet export directory (written by export/main.py). Leave out to only generate the database datasets."
+    )
+    parser.add_argument(
+        '-g',
+        '--grid_dir',
+        type=str,
+        default=None,
+        help="path to the monthly NetCDF grid directory (written by export/grid_main.py) for an EDDGridFromNcFiles dataset"
+    )
+    parser.add_argument(
+        '-o',
+        '--output_file',
+        type=str,
+        default=None,
+        help="path to the output xml file. Defaults to erddap/output_xml/datasets_generated.xml"
+    )
+
+    args = parser.parse_args()
+
+    # DATABASE_URL_ERDDAP, DB_USER and DB_PASS come from the .env file
+    load_dotenv()
+
+    start_time = time.time()
+    generator = ErddapDatasetsXmlGenerator(parquet_export_dir=args.parquet_export_dir, output_file=args.output_file, grid_dir=args.grid_dir)
+    generator.generate()
+    print(f"Done in {time.time() - start_time:.1f} seconds. Copy the relevant dataset sections into ERDDAP's datasets.xml")
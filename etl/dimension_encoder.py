@@ -0,0 +1,57 @@
+import polars as pl
+from sqlalchemy import text
+from models import DIMENSION_COLUMNS, DIMENSION_TABLES, dimension_key_column
+
+class DimensionEncoder:
+    """
+    Replaces the high repetition categorical columns of a batch with the integer key of
+    their value in the dimension table (see models/dimensions.py). New values are added
+    to the dimension tables as they show up and every key is cached so each distinct
+    value only goes to the database once per load.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.key_cache = {} # (table, column): {value: key}
+
+    def encode(self, df: pl.DataFrame, table_name: str) -> pl.DataFrame:
+        """
+        Swaps each dimension column in df for its <column>_key column
+        """
+        for column_name in DIMENSION_COLUMNS.get(table_name, []):
+            if column_name not in df.columns:
+                continue
+
+            df = df.with_columns(pl.col(column_name).cast(pl.Utf8))
+            value_keys = self.get_keys(table_name=table_name, column_name=column_name, values=df[column_name].drop_nulls().unique().to_list())
+
+            mapping = pl.DataFrame(
+                {column_name: list(value_keys.keys()), dimension_key_column(column_name): list(value_keys.values())},
+                schema={column_name: pl.Utf8, dimension_key_column(column_name): pl.Int32}
+            )
+            df = df.join(mapping, on=column_name, how='left', maintain_order='left').drop(column_name)
+
+        return df
+
+    def get_keys(self, table_name: str, column_name: str, values: list) -> dict:
+        """
+        {value: key} for the values, inserting the ones the dimension table doesn't have yet
+        """
+        cache = self.key_cache.setdefault((table_name, column_name), {})
+        new_values = [v for v in values if v not in cache]
+
+        if new_values:
+            dimension_table = DIMENSION_TABLES[(table_name, column_name)].name
+            with self.engine.begin() as conn:
+                conn.execute(text(f"""
+                    INSERT INTO {dimension_table} (value)
+                    SELECT unnest(CAST(:values AS text[]))
+                    ON CONFLICT (value) DO NOTHING
+                """), {"values": new_values})
+                result = conn.execute(text(f"""
+                    SELECT value, key FROM {dimension_table}
+                    WHERE value = ANY(CAST(:values AS text[]))
+                """), {"values": new_values})
+                cache.update({value: key for value, key in result})
+
+        return {v: cache[v] for v in values}
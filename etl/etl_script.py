@@ -1,15 +1,35 @@
 from database import engine, Base
-from models import create_tables, DnaDerived, MeasurementOfFact, Occurrence
+from models import create_tables, build_mof_wide_table, MOF_WIDE_TABLE_NAME, DnaDerived, MeasurementOfFact, Occurrence, GbifDataset
 from dotenv import load_dotenv
 from align_schema.schema_aligner import DwcSchemaAligner
-from sqlalchemy import text
+from erddap.erddap_flag_publisher import ErddapFlagPublisher
+from etl.mof_pivoter import MofPivoter
+from etl.mof_units import normalize_mof_units
+from etl.dimension_encoder import DimensionEncoder
+from etl.polar_projection import polar_stereographic_exprs, POLAR_SRID
+from sqlalchemy import text, inspect
 import os
+import json
 import pyarrow.parquet as pq
 import polars as pl
 import io
 
 BATCH_SIZE = 100000
 
+# Wide per-occurrence measurement table (see etl/mof_pivoter.py)
+MOF_WIDE_TOP_N = int(os.getenv('MOF_WIDE_TOP_N', 25)) # number of measurementType/measurementUnit pairs to pivot
+MOF_WIDE_OUTPUT_DIR = os.getenv('MOF_WIDE_OUTPUT_DIR', os.path.join(DwcSchemaAligner.DATA_PARQUET_DIR, 'mof_wide'))
+
+# Load manifest and ERDDAP reload flags (see erddap/erddap_flag_publisher.py)
+LOAD_MANIFEST_DIR = os.getenv('LOAD_MANIFEST_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_manifests'))
+ERDDAP_FLAG_DIR = os.getenv('ERDDAP_FLAG_DIR') # <bigParentDirectory>/flag/
+ERDDAP_FLAG_URL = os.getenv('ERDDAP_FLAG_URL') # e.g. http://localhost:8080/erddap/setDatasetFlag.txt?datasetID={dataset_id}&flagKey={flag_key}
+ERDDAP_FLAG_KEYS = os.getenv('ERDDAP_FLAG_KEYS') # JSON {"<datasetID>": "<flagKey>"} for the {flag_key} of ERDDAP_FLAG_URL
+ERDDAP_PARQUET_EXPORT_DIR = os.getenv('ERDDAP_PARQUET_EXPORT_DIR') # GeoParquet export served by EDDTableFromParquetFiles
+
+# GBIF dataset metadata (gbif_datasets_<date>.parquet from gbif/parse/gbif_dataset_parser.py)
+GBIF_DATASET_PARQUET_FILE = os.getenv('GBIF_DATASET_PARQUET_FILE')
+
 schema_aligner = DwcSchemaAligner()
 column_rename_dict = schema_aligner.rename_col_map
 # Replace handwritten dictionary with this when changing to full database
@@ -52,6 +72,8 @@ INT_COLUMNS = ['aphiaid',
 
 # COLUMNS_TO_DROP = ['geometry'] # a binary column and I think added in because of my q
 
+dimension_encoder = DimensionEncoder(engine=engine)
+
 def create_the_tables(): 
     Base.metadata.drop_all(bind=engine)
     # print(Base.metadata.tables.keys())
@@ -59,6 +81,19 @@ def create_the_tables():
     create_tables()
     print("Tables created!")
 
+def delete_source_rows(table_names: list, data_source: str):
+    """
+    Deletes one data source's rows from the tables, in the order given (mof_wide and the
+    extensions before occurrence for the foreign keys), e.g. before gbif/parse/main.py reloads
+    some GBIF stages. Tables that don't exist yet are skipped. The other data sources' rows
+    and the rest of the database are left alone.
+    """
+    existing_tables = [table_name for table_name in table_names if inspect(engine).has_table(table_name)]
+    with engine.begin() as conn:
+        for table_name in existing_tables:
+            result = conn.execute(text(f"DELETE FROM {table_name} WHERE data_source = :data_source"), {"data_source": data_source})
+            print(f"Deleted {result.rowcount} {data_source} rows from {table_name}")
+
 def transorm_df(df: pl):
 
     # 1. Rename columns
@@ -75,17 +110,10 @@ def transorm_df(df: pl):
             pl.col(col).cast(pl.Int32).alias(col) for col in bool_columns
         ])
 
-    # 3. Handle nested data (List) and Binary data (for Obis's 'areas', 'missing', 'invalid', and 'flags' columns + 'geometry' column which is binary)
+    # 3. Serialize list columns (Obis's 'areas', 'missing', 'invalid', and 'flags') as Postgres array literals for the text[]/integer[] columns
     list_cols = [col for col, dtype in df.schema.items() if isinstance(dtype, (pl.List, pl.Array))]
     if list_cols:
-        print(f"    Converting list columns to JSON: {list_cols}")
-        df = df.with_columns([
-            pl.col(col)
-            .list.eval(pl.element().cast(pl.String)) # Cast inner elements to String
-            .list.join(", ")                         # Now join is safe
-            .alias(col) 
-            for col in list_cols
-        ])
+        df = df.with_columns([to_pg_array_literal(col=col, inner_dtype=df.schema[col].inner) for col in list_cols])
 
     # 4. Handle Binary data (Geometry)
     binary_cols = [col for col, dtype in df.schema.items() if isinstance(dtype, pl.Binary)]
@@ -126,12 +154,29 @@ def transorm_df(df: pl):
             pl.col(c).cast(pl.Int64, strict=False) for c in int_cols
         ])
 
-    # 9 add location column (for geospatial bounding box)
+    # 9 add location column (for geospatial bounding box) and its polar stereographic projection (for Arctic region/radius queries)
     if 'decimalLatitude' in df.columns and 'decimalLongitude' in df.columns:
         df = create_location_col(df=df)
+        df = create_location_polar_col(df=df)
+
+    # 10. Parse mof measurementValue to numeric and convert to the canonical unit (see etl/unit_conversions.csv)
+    if 'measurementValue' in df.columns:
+        df = normalize_mof_units(df=df)
 
     return df
 
+def to_pg_array_literal(col: str, inner_dtype) -> pl.Expr:
+    """
+    A list column as Postgres array literals for COPY, e.g. ["ON_LAND", "NO_DEPTH"] -> {"ON_LAND","NO_DEPTH"}
+    Strings are quoted (with backslashes and quotes escaped) and numbers are left bare
+    """
+    if inner_dtype.is_numeric():
+        elements = pl.element().cast(pl.String)
+    else:
+        elements = '"' + pl.element().cast(pl.String).str.replace_all('\\', '\\\\', literal=True).str.replace_all('"', '\\"', literal=True) + '"'
+
+    return ("{" + pl.col(col).list.eval(elements.fill_null("NULL")).list.join(",") + "}").alias(col)
+
 def split_dwc_event_date(df: pl.DataFrame) -> pl.DataFrame:
     """
     Splits a DarwinCore eventDate interval into start and end datetime columns.
@@ -185,26 +230,61 @@ def create_location_col(df: pl.DataFrame) -> pl.DataFrame:
     )
     return df
 
-def load_parquet_streaming(file_path, table_name):
+def create_location_polar_col(df: pl.DataFrame) -> pl.DataFrame:
+    """Creates the location_polar column (EPSG:3413 point) defined in the SQL alchemy model.
+    Projected here so the database doesn't have to ST_Transform every row.
+    Only northern hemisphere points are projected (the projection blows up at the south pole)
+    """
+    x, y = polar_stereographic_exprs(lon=pl.col('decimalLongitude'), lat=pl.col('decimalLatitude'))
+    df = df.with_columns(
+        pl.when(
+            pl.col('decimalLongitude').is_between(-180, 180) &
+            pl.col('decimalLatitude').is_between(0, 90)
+        )
+        .then(
+            pl.format(
+                f'SRID={POLAR_SRID};POINT({{}} {{}})',
+                x.round(3),
+                y.round(3)
+            )
+        )
+        .otherwise(None)
+        .alias('location_polar')
+    )
+    return df
+
+def load_parquet_streaming(file_path, table_name, abort_on_error=False):
     """
     Load a parquet file into PostgresSQL using Polars streaming
     Memory-efficient for very large files
     """
     print(f"\n  Loading: {file_path}")
+
+    # lazy-API for memory-efficient streaming
+    lazy_df = pl.scan_parquet(file_path)
+
+    return load_lazy_df_streaming(lazy_df=lazy_df, table_name=table_name, source_name=os.path.basename(file_path), abort_on_error=abort_on_error)
+
+def load_lazy_df_streaming(lazy_df, table_name, source_name, abort_on_error=False):
+    """
+    Load a lazy frame into PostgresSQL in batches, e.g. a GbifOccurrenceParser stage
+    handed straight to the ETL without writing it to parquet first (see gbif/parse/main.py).
+    Returns the rows loaded. A batch that fails is skipped and reported, or raises IOError
+    with abort_on_error (the batches before it stay loaded).
+    """
     print(f"    Target table: {table_name}")
 
-    # get total row count
-    row_count = pl.scan_parquet(file_path).select(pl.len()).collect().item()
-    print(f"    Total rows in file: {row_count}")
+    # Collected once (a parser plan would otherwise run again just to count the rows)
+    df = lazy_df.collect(engine="streaming")
+    row_count = df.height
+    print(f"    Total rows: {row_count}")
 
     total_loaded = 0
     batch_num = 0
-
-    # lazy-API for memory-efficient streaming
-    lazy_df = pl.scan_parquet(file_path)
+    failed_batches = 0
 
     # Process in batches
-    for batch_df in lazy_df.collect().iter_slices(BATCH_SIZE):
+    for batch_df in df.iter_slices(BATCH_SIZE):
         batch_num += 1
 
         # Apply transformations
@@ -213,6 +293,9 @@ def load_parquet_streaming(file_path, table_name):
 
         batch_df = transorm_df(batch_df)
 
+        # Swap the categorical columns for their dimension table keys
+        batch_df = dimension_encoder.encode(df=batch_df, table_name=table_name)
+
         # Get column names (after transformations)
         columns = batch_df.columns
         columns_str = ', '.join([f'"{c}"' for c in columns])
@@ -241,6 +324,10 @@ def load_parquet_streaming(file_path, table_name):
                 print(f"\n  X Error in batch {batch_num}: {e}")
                 print(f" Columns: {columns}")
                 print(f" Sample data:\n{batch_df.head(2)}")
+                if abort_on_error:
+                    raise IOError(f"Loading batch {batch_num} of {source_name} into {table_name} failed: {e}")
+                failed_batches += 1
+                continue
 
         total_loaded += len(batch_df)
 
@@ -248,9 +335,113 @@ def load_parquet_streaming(file_path, table_name):
         progress = (total_loaded / row_count) * 100
         print(f"    Progress: {total_loaded:,} / {row_count:,} rows ({progress:.1%})", end='\r')
 
-    print(f"\n  ✅ Loaded {total_loaded:,} rows from {os.path.basename(file_path)}")
+    if failed_batches:
+        print(f"\n  ⚠️ Loaded {total_loaded:,} of {row_count:,} rows from {source_name}, {failed_batches} batches failed")
+    else:
+        print(f"\n  ✅ Loaded {total_loaded:,} rows from {source_name}")
     return total_loaded
 
+def load_gbif_datasets(file_path):
+    """
+    Upserts the GBIF dataset metadata parquet into the gbif_dataset table (COPY into a
+    temp table, then INSERT ... ON CONFLICT) so a re-parsed download refreshes the
+    datasets that changed without reloading the occurrences
+    """
+    print(f"\n  Loading: {file_path}")
+    table_name = GbifDataset.__tablename__
+    df = pl.read_parquet(file_path).unique(subset=['datasetKey'], keep='last')
+
+    columns_str = ', '.join([f'"{c}"' for c in df.columns])
+    updates_str = ', '.join([f'"{c}" = EXCLUDED."{c}"' for c in df.columns if c != 'datasetKey'])
+
+    csv_buffer = io.StringIO()
+    df.write_csv(csv_buffer, include_header=False, null_value='\\N', separator='\t')
+    csv_buffer.seek(0)
+
+    with engine.begin() as conn:
+        raw_conn = conn.connection
+        cursor = raw_conn.cursor()
+
+        try:
+            cursor.execute(f"CREATE TEMP TABLE {table_name}_staging (LIKE {table_name}) ON COMMIT DROP")
+            cursor.copy_expert(
+                sql=f"COPY {table_name}_staging ({columns_str}) FROM STDIN WITH (FORMAT CSV, DELIMITER '\t', NULL '\\N')",
+                file=csv_buffer
+            )
+            cursor.execute(f"""
+                INSERT INTO {table_name} ({columns_str})
+                SELECT {columns_str} FROM {table_name}_staging
+                ON CONFLICT ("datasetKey") DO UPDATE SET {updates_str}
+            """)
+            raw_conn.commit()
+        except Exception as e:
+            raw_conn.rollback()
+            print(f"\n  X Error loading {table_name}: {e}")
+            return 0
+
+    print(f"  ✅ Upserted {df.height:,} datasets from {os.path.basename(file_path)}")
+    return df.height
+
+def pivot_and_load_mof_wide(mof_parquet_files: dict = None, abort_on_error=False):
+    """
+    Pivots the mof files into the wide per-occurrence measurement
+    table (parquet) and replaces the mof_wide table with it.
+    mof_parquet_files ({data_source: path}) replaces those data sources'
+    mof files, e.g. the GBIF mof reloaded by gbif/parse/main.py
+    """
+    mof_parquet_files = {
+        **{data_source: files['mof'] for data_source, files in parquet_file_dict.items() if 'mof' in files},
+        **(mof_parquet_files or {})
+    }
+
+    pivoter = MofPivoter(mof_parquet_files=mof_parquet_files, output_dir=MOF_WIDE_OUTPUT_DIR, top_n=MOF_WIDE_TOP_N)
+    mof_wide_file = pivoter.pivot()
+
+    # The pivoted columns can change, so the table is rebuilt rather than appended to
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {MOF_WIDE_TABLE_NAME}"))
+    mof_wide_table = build_mof_wide_table(value_columns=list(pivoter.column_map.keys()))
+    mof_wide_table.create(bind=engine)
+
+    return load_parquet_streaming(file_path=mof_wide_file, table_name=MOF_WIDE_TABLE_NAME, abort_on_error=abort_on_error)
+
+def analyze_tables():
+    """
+    Updates the planner statistics after loading so the ERDDAP views'
+    range predicates on time/latitude/longitude/depth use the indexes
+    instead of sequential scans
+    """
+    print("Analyzing tables")
+    with engine.begin() as conn:
+        for table_name in Base.metadata.tables.keys():
+            conn.execute(text(f"ANALYZE {table_name}"))
+
+def read_erddap_flag_keys() -> dict:
+    """ERDDAP_FLAG_KEYS as {datasetID: flagKey}, no keys if it isn't set or isn't a JSON object"""
+    if not ERDDAP_FLAG_KEYS:
+        return {}
+    try:
+        flag_keys = json.loads(ERDDAP_FLAG_KEYS)
+    except json.JSONDecodeError as e:
+        print(f"Error reading ERDDAP_FLAG_KEYS ({e}), flagging without flag keys")
+        return {}
+    if not isinstance(flag_keys, dict):
+        print('Error reading ERDDAP_FLAG_KEYS, expected a JSON object like {"<datasetID>": "<flagKey>"}, flagging without flag keys')
+        return {}
+    return flag_keys
+
+def publish_load_manifest(loaded_tables: dict):
+    """
+    Writes the load manifest for this run and has ERDDAP reload
+    only the datasets whose tables or parquet partitions changed
+    """
+    publisher = ErddapFlagPublisher(manifest_dir=LOAD_MANIFEST_DIR,
+                                    flag_dir=ERDDAP_FLAG_DIR,
+                                    flag_url=ERDDAP_FLAG_URL,
+                                    flag_keys=read_erddap_flag_keys())
+    flagged = publisher.publish(loaded_tables=loaded_tables, parquet_export_dir=ERDDAP_PARQUET_EXPORT_DIR)
+    print(f"ERDDAP datasets flagged for reload: {flagged}")
+
 def verify_data():
     """Verify data was loaded correctly"""
     print("Verifying data")
@@ -290,8 +481,11 @@ def verify_data():
             sample_result = conn.execute(text(f"SELECT * FROM {table} LIMIT 1"))
             sample = sample_result.fetchone()
 
+            size = conn.execute(text(f"SELECT pg_size_pretty(pg_total_relation_size('{table}'))")).scalar()
+
             print(f"    {table} ")
             print(f"    Rows: {count:,}")
+            print(f"    Size (with indexes): {size}")
             print(f"    Columns (first 10):")
             for col_name, col_type in columns_info:
                 print(f"        - {col_name}: {col_type}")
@@ -306,17 +500,35 @@ def main():
     create_the_tables()
 
     # 2. Fill tables
+    loaded_tables = {"occurrence": [], "dna_derived": [], "mof": []}
     for paths_to_pq_files in parquet_file_dict.values():
         for table_type, filepath in paths_to_pq_files.items():
             if table_type == 'occ':
-                load_parquet_streaming(file_path=filepath, table_name="occurrence")
+                table_name = "occurrence"
             elif table_type == "dna_derived":
-                load_parquet_streaming(file_path=filepath, table_name="dna_derived")
+                table_name = "dna_derived"
             elif table_type == "mof":
-                load_parquet_streaming(file_path=filepath, table_name="mof")
+                table_name = "mof"
+            else:
+                continue
+            rows_loaded = load_parquet_streaming(file_path=filepath, table_name=table_name)
+            loaded_tables[table_name].append({"file": filepath, "rows": rows_loaded})
 
-    # 3. Verify data
+    # The GBIF dataset metadata isn't an ERDDAP dataset so it stays out of the load manifest
+    if GBIF_DATASET_PARQUET_FILE:
+        load_gbif_datasets(file_path=GBIF_DATASET_PARQUET_FILE)
+
+    # 3. Pivot mof into the wide per-occurrence measurement table
+    pivot_and_load_mof_wide()
+
+    # 4. Update planner statistics (used by the ERDDAP views)
+    analyze_tables()
+
+    # 5. Verify data
     verify_data()
+
+    # 6. Publish the load manifest and flag the ERDDAP datasets that changed
+    publish_load_manifest(loaded_tables=loaded_tables)
     
 
 if __name__ == "__main__":
@@ -0,0 +1,144 @@
+import re
+import polars as pl
+from pathlib import Path
+from datetime import datetime
+
+class MofPivoter:
+    """
+    Pivots the tall measurement-or-fact (mof) parquet files into a wide table with
+    one row per occurrence, keyed by (data_source, occurrence_source_id), and one
+    numeric column per top N measurementType/measurementUnit pair. Everything runs
+    lazily on the streaming engine so the mof files never have to fit in memory.
+    """
+
+    DATA_SOURCE = "data_source"
+    OCCURRENCE_SOURCE_ID = "occurrence_source_id"
+    MEASUREMENT_TYPE = "measurementType"
+    MEASUREMENT_UNIT = "measurementUnit"
+    MEASUREMENT_VALUE = "measurementValue"
+
+    MAX_COLUMN_NAME_LENGTH = 63 # Postgres identifier limit
+
+    def __init__(self, mof_parquet_files: dict, output_dir: str, top_n: int = 25):
+        """
+        mof_parquet_files is {data_source: mof parquet path}, e.g. {gbif: path, obis: path}
+        """
+        self.mof_parquet_files = mof_parquet_files
+        self.output_dir = Path(output_dir)
+        self.top_n = top_n
+        self.column_map = {} # wide column name: (measurementType, measurementUnit)
+
+    def pivot(self) -> str:
+        """
+        Writes the wide mof parquet file and a csv describing its columns.
+        Returns the path to the parquet file.
+        """
+        mof_lf = self.scan_mof_files()
+
+        top_pairs = self.get_top_type_unit_pairs(mof_lf=mof_lf)
+        print(f"Pivoting the top {len(top_pairs)} measurementType/measurementUnit pairs")
+        self.column_map = self.create_column_names(pairs=top_pairs)
+
+        wide_lf = self.build_wide_lf(mof_lf=mof_lf)
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        today = datetime.now().strftime("%Y-%m-%d")
+        output_file = self.output_dir / f"arctic_mof_wide_{today}.parquet"
+        wide_lf.sink_parquet(
+            path=output_file,
+            compression="zstd",
+            compression_level=3,
+            statistics=True,
+            row_group_size=1_000_000
+        )
+
+        self.write_column_map(output_file=self.output_dir / f"arctic_mof_wide_columns_{today}.csv")
+        print(f"Wide mof table saved to {output_file}")
+
+        return str(output_file)
+
+    def scan_mof_files(self) -> pl.LazyFrame:
+        """
+        Lazily scans every mof file and selects the key, type, unit and value columns.
+        GBIF's mof columns are lowercase (measurementtype) so the columns are matched
+        case-insensitively.
+        """
+        lazy_frames = []
+        for data_source, parquet_path in self.mof_parquet_files.items():
+            lf = pl.scan_parquet(parquet_path)
+            columns = {c.lower(): c for c in lf.collect_schema().names()}
+
+            lf = lf.select([
+                pl.lit(data_source).alias(self.DATA_SOURCE),
+                pl.col(columns[self.OCCURRENCE_SOURCE_ID.lower()]).cast(pl.Utf8).alias(self.OCCURRENCE_SOURCE_ID),
+                pl.col(columns[self.MEASUREMENT_TYPE.lower()]).cast(pl.Utf8).str.strip_chars().alias(self.MEASUREMENT_TYPE),
+                pl.col(columns[self.MEASUREMENT_UNIT.lower()]).cast(pl.Utf8).str.strip_chars().fill_null("").alias(self.MEASUREMENT_UNIT),
+                pl.col(columns[self.MEASUREMENT_VALUE.lower()]).cast(pl.Utf8).str.strip_chars().cast(pl.Float64, strict=False).alias(self.MEASUREMENT_VALUE)
+            ])
+            lazy_frames.append(lf)
+
+        return pl.concat(lazy_frames, how="vertical")
+
+    def get_top_type_unit_pairs(self, mof_lf: pl.LazyFrame) -> list:
+        """
+        The top N measurementType/measurementUnit pairs by the number of numeric values
+        """
+        return (
+            mof_lf.filter(pl.col(self.MEASUREMENT_TYPE).is_not_null() & pl.col(self.MEASUREMENT_VALUE).is_not_null())
+            .group_by([self.MEASUREMENT_TYPE, self.MEASUREMENT_UNIT])
+            .agg(pl.len().alias("count"))
+            .sort("count", descending=True)
+            .head(self.top_n)
+            .collect(engine="streaming")
+            .select([self.MEASUREMENT_TYPE, self.MEASUREMENT_UNIT])
+            .rows()
+        )
+
+    def create_column_names(self, pairs: list) -> dict:
+        """
+        Postgres-safe column names for the type/unit pairs, e.g.
+        ("Temperature of the water body", "degrees Celsius") -> temperature_of_the_water_body_degrees_celsius
+        """
+        column_map = {}
+        for measurement_type, measurement_unit in pairs:
+            name = re.sub(r"[^0-9a-z]+", "_", f"{measurement_type} {measurement_unit}".lower()).strip("_")
+            name = name[:self.MAX_COLUMN_NAME_LENGTH - 4] or "measurement"
+
+            # Keep names unique after truncating
+            unique_name, suffix = name, 1
+            while unique_name in column_map or unique_name in (self.DATA_SOURCE, self.OCCURRENCE_SOURCE_ID):
+                suffix += 1
+                unique_name = f"{name}_{suffix}"
+
+            column_map[unique_name] = (measurement_type, measurement_unit)
+
+        return column_map
+
+    def build_wide_lf(self, mof_lf: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        One conditional aggregation per type/unit pair within a single group_by on the
+        occurrence key (a pivot that works on the streaming engine). Repeated measurements
+        of the same pair for an occurrence are averaged.
+        """
+        pair_filter = pl.lit(False)
+        aggregations = []
+        for column_name, (measurement_type, measurement_unit) in self.column_map.items():
+            pair_match = (pl.col(self.MEASUREMENT_TYPE) == measurement_type) & (pl.col(self.MEASUREMENT_UNIT) == measurement_unit)
+            pair_filter = pair_filter | pair_match
+            aggregations.append(pl.col(self.MEASUREMENT_VALUE).filter(pair_match).mean().alias(column_name))
+
+        return (
+            mof_lf.filter(pair_filter & pl.col(self.OCCURRENCE_SOURCE_ID).is_not_null())
+            .group_by([self.DATA_SOURCE, self.OCCURRENCE_SOURCE_ID])
+            .agg(aggregations)
+        )
+
+    def write_column_map(self, output_file: Path):
+        """
+        Saves which measurementType and measurementUnit each wide column holds
+        """
+        pl.DataFrame(
+            [(name, measurement_type, measurement_unit) for name, (measurement_type, measurement_unit) in self.column_map.items()],
+            schema=["column_name", self.MEASUREMENT_TYPE, self.MEASUREMENT_UNIT],
+            orient="row"
+        ).write_csv(output_file)
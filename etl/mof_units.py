@@ -0,0 +1,60 @@
+import os
+import polars as pl
+
+# Local unit conversion table: canonical value = measurementValue * scale + offset
+UNIT_CONVERSIONS_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'unit_conversions.csv')
+
+MEASUREMENT_VALUE = 'measurementValue'
+MEASUREMENT_UNIT = 'measurementUnit'
+NUMERIC_VALUE = 'measurementValueNumeric'
+CANONICAL_UNIT = 'measurementUnitCanonical'
+CANONICAL_VALUE = 'measurementValueCanonical'
+
+_UNIT_KEY = '_unit_key'
+
+def read_unit_conversions(csv_path: str = UNIT_CONVERSIONS_CSV) -> pl.DataFrame:
+    """Reads the unit conversion table keyed on the normalized unit string"""
+    return (
+        pl.read_csv(csv_path, schema_overrides={'unit': pl.String, 'canonical_unit': pl.String, 'scale': pl.Float64, 'offset': pl.Float64})
+        .with_columns(normalize_unit_expr(pl.col('unit')).alias(_UNIT_KEY))
+        .select([_UNIT_KEY, 'canonical_unit', 'scale', 'offset'])
+        .unique(subset=_UNIT_KEY, keep='first')
+    )
+
+def normalize_unit_expr(unit: pl.Expr) -> pl.Expr:
+    """Lowercase, trimmed and single spaced so 'Degrees  Celsius ' matches 'degrees celsius'"""
+    return unit.cast(pl.String).str.strip_chars().str.to_lowercase().str.replace_all(r'\s+', ' ')
+
+def parse_numeric_value_expr(value: pl.Expr) -> pl.Expr:
+    """
+    measurementValue as a float where possible (null otherwise).
+    Accepts a comma as the decimal separator when there is no dot.
+    """
+    value = value.cast(pl.String).str.strip_chars()
+    value = pl.when(value.str.contains(',') & ~value.str.contains(r'\.')).then(value.str.replace(',', '.')).otherwise(value)
+    return value.cast(pl.Float64, strict=False)
+
+UNIT_CONVERSIONS = read_unit_conversions()
+
+def normalize_mof_units(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Adds the numeric measurementValue and the value converted to the canonical unit of its
+    measurementUnit. Units that aren't in the conversion table keep their own unit as the
+    canonical unit (scale 1) so every numeric value has a canonical value.
+    """
+    if MEASUREMENT_VALUE not in df.columns:
+        return df
+
+    unit_col = pl.col(MEASUREMENT_UNIT) if MEASUREMENT_UNIT in df.columns else pl.lit(None, dtype=pl.String)
+
+    df = df.with_columns([
+        parse_numeric_value_expr(pl.col(MEASUREMENT_VALUE)).alias(NUMERIC_VALUE),
+        normalize_unit_expr(unit_col).alias(_UNIT_KEY)
+    ])
+
+    df = df.join(UNIT_CONVERSIONS, on=_UNIT_KEY, how='left', maintain_order='left')
+
+    return df.with_columns([
+        pl.col('canonical_unit').fill_null(unit_col.cast(pl.String).str.strip_chars()).alias(CANONICAL_UNIT),
+        (pl.col(NUMERIC_VALUE) * pl.col('scale').fill_null(1.0) + pl.col('offset').fill_null(0.0)).alias(CANONICAL_VALUE)
+    ]).drop([_UNIT_KEY, 'canonical_unit', 'scale', 'offset'])
@@ -0,0 +1,61 @@
+import math
+import numpy as np
+import polars as pl
+
+# EPSG:3413 - WGS 84 / NSIDC Sea Ice Polar Stereographic North
+# (latitude of true scale 70N, central meridian 45W, no false easting/northing)
+POLAR_SRID = 3413
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+ECCENTRICITY = math.sqrt(FLATTENING * (2 - FLATTENING))
+LATITUDE_OF_TRUE_SCALE = math.radians(70.0)
+CENTRAL_MERIDIAN = math.radians(-45.0)
+
+def _t(sin_lat, tan_quarter):
+    """Snyder (1987) eq. 15-9: tan(pi/4 - lat/2) / ((1 - e sin(lat)) / (1 + e sin(lat)))^(e/2)"""
+    return tan_quarter / ((1 - ECCENTRICITY * sin_lat) / (1 + ECCENTRICITY * sin_lat)) ** (ECCENTRICITY / 2)
+
+_SIN_TRUE_SCALE = math.sin(LATITUDE_OF_TRUE_SCALE)
+_T_TRUE_SCALE = _t(_SIN_TRUE_SCALE, math.tan(math.pi / 4 - LATITUDE_OF_TRUE_SCALE / 2))
+_M_TRUE_SCALE = math.cos(LATITUDE_OF_TRUE_SCALE) / math.sqrt(1 - ECCENTRICITY ** 2 * _SIN_TRUE_SCALE ** 2) # eq. 14-15
+
+def polar_stereographic_exprs(lon: pl.Expr, lat: pl.Expr) -> tuple:
+    """
+    (x, y) in meters in EPSG:3413 for longitude/latitude in degrees (WGS 84),
+    using the ellipsoidal north polar stereographic formulas (Snyder eq. 21-33 to 21-35)
+    """
+    lat_rad = lat.cast(pl.Float64).radians()
+    lon_delta = lon.cast(pl.Float64).radians() - CENTRAL_MERIDIAN
+
+    t = _t(lat_rad.sin(), (math.pi / 4 - lat_rad / 2).tan())
+    rho = SEMI_MAJOR_AXIS * _M_TRUE_SCALE * t / _T_TRUE_SCALE
+
+    return rho * lon_delta.sin(), -rho * lon_delta.cos()
+
+def polar_scale_factor(lat: float) -> float:
+    """EPSG:3413 scale factor at a latitude in degrees (1 at 70N, ~1.04 at 60N, ~0.97 at the pole)"""
+    lat_rad = math.radians(min(lat, 89.9999))
+    sin_lat = math.sin(lat_rad)
+    rho = SEMI_MAJOR_AXIS * _M_TRUE_SCALE * _t(sin_lat, math.tan(math.pi / 4 - lat_rad / 2)) / _T_TRUE_SCALE
+    return rho / (SEMI_MAJOR_AXIS * math.cos(lat_rad) / math.sqrt(1 - ECCENTRICITY ** 2 * sin_lat ** 2))
+
+def polar_stereographic_inverse(x: np.ndarray, y: np.ndarray) -> tuple:
+    """
+    (lon, lat) in degrees for EPSG:3413 x/y in meters (Snyder eq. 21-38, 20-16 and 7-9,
+    iterating for the latitude)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    rho = np.hypot(x, y)
+    t = rho * _T_TRUE_SCALE / (SEMI_MAJOR_AXIS * _M_TRUE_SCALE)
+
+    lat = np.pi / 2 - 2 * np.arctan(t)
+    for _ in range(6):
+        sin_lat = np.sin(lat)
+        lat = np.pi / 2 - 2 * np.arctan(t * ((1 - ECCENTRICITY * sin_lat) / (1 + ECCENTRICITY * sin_lat)) ** (ECCENTRICITY / 2))
+
+    lon = np.degrees(CENTRAL_MERIDIAN + np.arctan2(x, -y))
+    lon = (lon + 180) % 360 - 180
+
+    return lon, np.degrees(lat)
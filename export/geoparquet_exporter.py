@@ -0,0 +1,247 @@
+import json
+import numpy as np
+import polars as pl
+import pyarrow as pa
+import pyarrow.compute as pc
+from pathlib import Path
+from gbif_obis_data_download.parquet_layout.parquet_layout_policy import ParquetLayoutPolicy
+
+class GeoParquetExporter:
+    """
+    Exports the harmonized occurrence, dna_derived and mof tables as hive partitioned
+    GeoParquet (<table>/data_source=<source>/year=<year>/part-0.parquet) so ERDDAP's
+    EDDTableFromParquetFiles and DuckDB can skip files and row groups using the
+    per-file and per-row-group min/max statistics.
+    """
+
+    OCCURRENCES = "occ"
+    DNA_DERIVED = "dna_derived"
+    MOF = "mof"
+
+    # Output table directory names (match the Postgres table names)
+    TABLE_DIR_NAMES = {
+        OCCURRENCES: "occurrence",
+        DNA_DERIVED: "dna_derived",
+        MOF: "mof"
+    }
+
+    SOURCE_ID = "source_id"
+    OCCURRENCE_SOURCE_ID = "occurrence_source_id"
+    DATA_SOURCE = "data_source"
+    LATITUDE = "decimalLatitude"
+    LONGITUDE = "decimalLongitude"
+    EVENT_DATE = "eventDate"
+
+    # Columns added by the exporter
+    TIME = "time"
+    YEAR = "year"
+    SPATIAL_KEY = "spatial_key"
+    GEOMETRY = "geometry"
+
+    HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+    def __init__(self, parquet_file_dict: dict, output_dir: str, column_rename_dict: dict = None, parquet_layout: ParquetLayoutPolicy = None):
+        """
+        parquet_file_dict is shaped like {obis: {occ: path, dna_derived: path, mof: path}, gbif: {etc.}}
+        (the same shape as DwcSchemaAligner.parquet_files). column_rename_dict is the
+        DwcSchemaAligner.rename_col_map used to harmonize the column names. parquet_layout
+        has the spatial key and the writer settings (shared with the GBIF parser and OBIS
+        downloader).
+        """
+        self.parquet_file_dict = parquet_file_dict
+        self.output_dir = Path(output_dir)
+        self.column_rename_dict = column_rename_dict or {}
+        self.parquet_layout = parquet_layout or ParquetLayoutPolicy()
+
+    def export_all(self) -> list:
+        """
+        Exports every table for every data source. Returns the list of
+        written parquet files.
+        """
+        written_files = []
+
+        for data_source, table_files in self.parquet_file_dict.items():
+            occ_lf = self.prepare_occurrence_lf(parquet_path=table_files.get(self.OCCURRENCES), data_source=data_source)
+
+            written_files.extend(self.write_partitions(lf=occ_lf, table_type=self.OCCURRENCES, data_source=data_source))
+
+            # dna_derived and mof get their time, year and spatial key from the occurrence they belong to
+            occ_keys_lf = occ_lf.select([self.SOURCE_ID, self.TIME, self.YEAR, self.SPATIAL_KEY, self.LATITUDE, self.LONGITUDE])
+            for table_type in [self.DNA_DERIVED, self.MOF]:
+                ext_path = table_files.get(table_type)
+                if ext_path is None:
+                    continue
+                ext_lf = self.prepare_extension_lf(parquet_path=ext_path, occ_keys_lf=occ_keys_lf, data_source=data_source)
+                written_files.extend(self.write_partitions(lf=ext_lf, table_type=table_type, data_source=data_source))
+
+        print(f"Exported {len(written_files)} GeoParquet files to {self.output_dir}")
+        return written_files
+
+    def scan_harmonized(self, parquet_path: str) -> pl.LazyFrame:
+        """
+        Lazily scans a parquet file and renames the columns to the harmonized
+        Darwin Core names.
+        """
+        lf = pl.scan_parquet(parquet_path)
+        columns = lf.collect_schema().names()
+        rename_map = {k: v for k, v in self.column_rename_dict.items() if k in columns and v not in columns}
+        if rename_map:
+            lf = lf.rename(rename_map)
+
+        return lf
+
+    def prepare_occurrence_lf(self, parquet_path: str, data_source: str) -> pl.LazyFrame:
+        """
+        Adds the time, year and spatial key columns used for partitioning and sorting
+        to the occurrence lazy frame. The OBIS WKB geometry column is dropped and rebuilt
+        for both sources when writing.
+        """
+        lf = self.scan_harmonized(parquet_path=parquet_path)
+        columns = lf.collect_schema().names()
+
+        if self.GEOMETRY in columns:
+            lf = lf.drop(self.GEOMETRY)
+
+        if self.DATA_SOURCE not in columns:
+            lf = lf.with_columns(pl.lit(data_source).alias(self.DATA_SOURCE))
+
+        # Start of the DwC eventDate interval, falling back on the year column if eventDate cannot be parsed
+        time_expr = (
+            pl.col(self.EVENT_DATE).cast(pl.Utf8).str.split("/").list.first().str.to_datetime(strict=False, time_unit="ms")
+            if self.EVENT_DATE in columns else pl.lit(None, dtype=pl.Datetime("ms"))
+        )
+        year_expr = pl.col(self.TIME).dt.year().cast(pl.Int32)
+        if self.YEAR in columns:
+            year_expr = year_expr.fill_null(pl.col(self.YEAR).cast(pl.Int32, strict=False))
+
+        lf = lf.with_columns(time_expr.alias(self.TIME))
+        lf = lf.with_columns([
+            year_expr.alias(self.YEAR),
+            self.parquet_layout.spatial_key_expr(lat_col=self.LATITUDE, lon_col=self.LONGITUDE).alias(self.SPATIAL_KEY)
+        ])
+
+        return lf
+
+    def prepare_extension_lf(self, parquet_path: str, occ_keys_lf: pl.LazyFrame, data_source: str) -> pl.LazyFrame:
+        """
+        Joins the dna_derived or mof lazy frame to the occurrence keys so the extension
+        rows land in the same data_source/year partitions as their occurrence.
+        """
+        lf = self.scan_harmonized(parquet_path=parquet_path)
+        columns = lf.collect_schema().names()
+
+        if self.DATA_SOURCE not in columns:
+            lf = lf.with_columns(pl.lit(data_source).alias(self.DATA_SOURCE))
+
+        # Avoid clashing with extension columns of the same name (e.g. OBIS mof has no year, but be safe)
+        lf = lf.drop([c for c in [self.TIME, self.YEAR, self.SPATIAL_KEY, self.LATITUDE, self.LONGITUDE] if c in columns])
+
+        return lf.join(
+            occ_keys_lf,
+            left_on=self.OCCURRENCE_SOURCE_ID,
+            right_on=self.SOURCE_ID,
+            how="left"
+        )
+
+    def write_partitions(self, lf: pl.LazyFrame, table_type: str, data_source: str) -> list:
+        """
+        Writes one sorted GeoParquet file per year partition for the table and data source.
+        """
+        table_dir = self.output_dir / self.TABLE_DIR_NAMES[table_type] / f"{self.DATA_SOURCE}={data_source}"
+        print(f"Exporting {data_source} {self.TABLE_DIR_NAMES[table_type]} to {table_dir}")
+
+        # One streaming pass over the source into a sorted intermediate file (by year, then by
+        # month so each row group spans a narrow time range, then by the spatial key so the
+        # lat/lon stats of each row group are tight). Each year is then read back on its own,
+        # the year sort lets the row group stats skip the other years, so only one partition
+        # is ever in memory.
+        sorted_file = table_dir.parent / f".{self.DATA_SOURCE}={data_source}.sorted.parquet"
+        sorted_file.parent.mkdir(parents=True, exist_ok=True)
+        (
+            lf.sort([self.YEAR, pl.col(self.TIME).dt.month(), self.SPATIAL_KEY, self.TIME], nulls_last=True)
+            .sink_parquet(sorted_file, engine="streaming")
+        )
+
+        try:
+            sorted_lf = pl.scan_parquet(sorted_file)
+            years = sorted_lf.select(pl.col(self.YEAR).unique(maintain_order=True)).collect().get_column(self.YEAR).to_list()
+
+            written_files = []
+            for year in years:
+                year_filter = pl.col(self.YEAR).is_null() if year is None else pl.col(self.YEAR) == year
+                partition_df = sorted_lf.filter(year_filter).collect()
+                if partition_df.height == 0:
+                    continue
+
+                partition_name = self.HIVE_NULL_PARTITION if year is None else str(year)
+                output_file = table_dir / f"{self.YEAR}={partition_name}" / "part-0.parquet"
+                self.write_geoparquet(df=partition_df, output_file=output_file)
+                print(f"    {self.YEAR}={partition_name}: {partition_df.height:,} rows")
+                written_files.append(output_file)
+        finally:
+            sorted_file.unlink(missing_ok=True)
+
+        return written_files
+
+    def write_geoparquet(self, df: pl.DataFrame, output_file: Path):
+        """
+        Writes a data frame as a GeoParquet file with a WKB point geometry column using the
+        parquet layout's writer settings (statistics, page index, id bloom filters, etc.)
+        """
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+
+        table = df.to_arrow()
+        geometry = self.points_to_wkb(lat=df.get_column(self.LATITUDE), lon=df.get_column(self.LONGITUDE))
+        table = table.append_column(self.GEOMETRY, geometry)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"geo": json.dumps(self.geo_metadata(df=df)).encode("utf-8")
+        })
+
+        self.parquet_layout.write_table(table=table, output_file=output_file)
+
+    def points_to_wkb(self, lat: pl.Series, lon: pl.Series) -> pa.Array:
+        """
+        Vectorized WKB encoding of lon/lat points (little endian, 21 bytes per point).
+        Rows without coordinates get a null geometry.
+        """
+        wkb_point = np.dtype([("byte_order", "u1"), ("geom_type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+
+        points = np.empty(len(lat), dtype=wkb_point)
+        points["byte_order"] = 1
+        points["geom_type"] = 1
+        points["x"] = lon.cast(pl.Float64).fill_null(np.nan).to_numpy()
+        points["y"] = lat.cast(pl.Float64).fill_null(np.nan).to_numpy()
+
+        fixed = pa.FixedSizeBinaryArray.from_buffers(
+            pa.binary(wkb_point.itemsize),
+            len(points),
+            [None, pa.py_buffer(points.tobytes())]
+        )
+        valid = pa.array((lat.is_not_null() & lon.is_not_null()).to_numpy())
+
+        return pc.if_else(valid, fixed, pa.scalar(None, type=fixed.type)).cast(pa.binary())
+
+    def geo_metadata(self, df: pl.DataFrame) -> dict:
+        """
+        The GeoParquet 1.1 file metadata, including the bbox of the file.
+        """
+        bbox = df.select([
+            pl.col(self.LONGITUDE).cast(pl.Float64).min().alias("xmin"),
+            pl.col(self.LATITUDE).cast(pl.Float64).min().alias("ymin"),
+            pl.col(self.LONGITUDE).cast(pl.Float64).max().alias("xmax"),
+            pl.col(self.LATITUDE).cast(pl.Float64).max().alias("ymax")
+        ]).row(0)
+
+        column_meta = {
+            "encoding": "WKB",
+            "geometry_types": ["Point"]
+        }
+        if None not in bbox:
+            column_meta["bbox"] = list(bbox)
+
+        return {
+            "version": "1.1.0",
+            "primary_column": self.GEOMETRY,
+            "columns": {self.GEOMETRY: column_meta}
+        }
@@ -0,0 +1,48 @@
+import argparse
+import time
+from pathlib import Path
+from dotenv import load_dotenv
+
+from export.polar_grid_exporter import PolarGridExporter
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Grid occurrence record counts and species richness per month onto a polar stereographic grid (CF NetCDF for ERDDAP griddap)"
+    )
+    parser.add_argument(
+        '-i',
+        '--input_dir',
+        type=str,
+        default=None,
+        help="GeoParquet export directory (written by export/main.py). Leave out to read the occurrence table in DATABASE_URL instead."
+    )
+    parser.add_argument(
+        '-o',
+        '--output_dir',
+        type=str,
+        required=True,
+        help="directory the monthly NetCDF files (and the incremental state in grid_state/) are written to"
+    )
+    parser.add_argument(
+        '-c',
+        '--cell_size',
+        type=float,
+        default=25_000,
+        help="grid cell size in EPSG:3413 meters. Defaults to 25 km"
+    )
+
+    args = parser.parse_args()
+
+    start_time = time.time()
+    exporter = PolarGridExporter(output_dir=args.output_dir, cell_size=args.cell_size)
+
+    if args.input_dir is not None:
+        parquet_files = sorted(Path(args.input_dir).glob("occurrence/data_source=*/year=*/*.parquet"))
+        exporter.export_parquet(parquet_files=parquet_files)
+    else:
+        load_dotenv()
+        from database import engine
+        exporter.export_database(engine=engine)
+
+    print(f"Done in {time.time() - start_time:.1f} seconds")
@@ -0,0 +1,26 @@
+import argparse
+
+from align_schema.schema_aligner import DwcSchemaAligner
+from export.geoparquet_exporter import GeoParquetExporter
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Export the harmonized GBIF and OBIS tables as partitioned GeoParquet for ERDDAP"
+    )
+    parser.add_argument(
+        '-o',
+        '--output_dir',
+        type=str,
+        help="path to the directory the data_source/year partitioned GeoParquet files are written to."
+    )
+
+    args = parser.parse_args()
+
+    # Latest GBIF and OBIS parquet files and the column renames to harmonize them
+    schema_aligner = DwcSchemaAligner()
+
+    exporter = GeoParquetExporter(parquet_file_dict=schema_aligner.parquet_files,
+                                  output_dir=args.output_dir,
+                                  column_rename_dict=schema_aligner.rename_col_map)
+    exporter.export_all()
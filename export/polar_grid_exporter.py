@@ -0,0 +1,318 @@
+import hashlib
+import json
+import numpy as np
+import polars as pl
+import polars_hash as plh
+import pyarrow.parquet as pq
+from datetime import datetime, timezone
+from pathlib import Path
+from etl.polar_projection import POLAR_SRID, SEMI_MAJOR_AXIS, FLATTENING, polar_stereographic_exprs, polar_stereographic_inverse
+
+class PolarGridExporter:
+    """
+    Bins occurrences into monthly EPSG:3413 (polar stereographic north) grids of record
+    counts and species richness (distinct scientificName) and writes one CF NetCDF file per
+    month for ERDDAP's EDDGridFromNcFiles.
+
+    The occurrence partitions are read in record batches and binned with NumPy so nothing
+    has to fit in memory. Each partition's sparse per month/cell aggregates are kept in a
+    state directory, so later runs only re-bin the partitions that are new or changed and
+    only rewrite the months they touch.
+    """
+
+    LATITUDE = "decimalLatitude"
+    LONGITUDE = "decimalLongitude"
+    TIME = "time"
+    SCIENTIFIC_NAME = "scientificName"
+
+    STATE_FILE = "partitions.json"
+    FILE_PREFIX = "arctic_occurrence_grid"
+    DATABASE_PARTITION = "database:occurrence"
+
+    def __init__(self, output_dir: str, state_dir: str = None, cell_size: float = 25_000, min_latitude: float = 60.0, batch_size: int = 500_000):
+        """
+        cell_size is in EPSG:3413 meters. The grid is the square around the pole that covers
+        everything poleward of min_latitude.
+        """
+        self.output_dir = Path(output_dir)
+        self.state_dir = Path(state_dir) if state_dir else self.output_dir / "grid_state"
+        self.cell_size = cell_size
+        self.min_latitude = min_latitude
+        self.batch_size = batch_size
+
+        # Grid cell edges (x and y are symmetric about the pole)
+        half_width = self.projected_distance_from_pole(latitude=min_latitude)
+        self.n_cells = int(np.ceil(2 * half_width / cell_size))
+        self.grid_min = -self.n_cells * cell_size / 2
+        self.cell_centers = self.grid_min + (np.arange(self.n_cells) + 0.5) * cell_size
+
+    @staticmethod
+    def projected_distance_from_pole(latitude: float) -> float:
+        x, y = polar_stereographic_exprs(lon=pl.lit(-45.0), lat=pl.lit(latitude))
+        return abs(pl.select(y).item())
+
+    def export_parquet(self, parquet_files: list) -> list:
+        """
+        Grids the occurrence parquet files (e.g. the GeoParquet export's occurrence
+        data_source=*/year=* partitions). Returns the NetCDF files written.
+        """
+        state = self.read_state()
+        current_partitions = {str(Path(f)): self.describe_file(f) for f in parquet_files}
+
+        changed_months = set()
+        for partition, fingerprint in current_partitions.items():
+            previous = state.get(partition)
+            if previous is not None and previous["fingerprint"] == fingerprint:
+                continue
+
+            print(f"Binning {partition}")
+            changed_months.update(previous["months"] if previous else [])
+            months = self.bin_partition(partition=partition, batches=self.iter_parquet_batches(parquet_file=partition))
+            state[partition] = {"fingerprint": fingerprint, "months": months}
+            changed_months.update(months)
+
+        for partition in [p for p in state if p not in current_partitions and p != self.DATABASE_PARTITION]:
+            print(f"Removing {partition} (no longer in the input)")
+            changed_months.update(state.pop(partition)["months"])
+            self.partition_state_file(partition=partition).unlink(missing_ok=True)
+
+        self.write_state(state=state)
+        return self.write_months(months=sorted(changed_months))
+
+    def export_database(self, engine) -> list:
+        """
+        Grids the occurrence table. The whole table is one partition so it's always re-binned.
+        """
+        query = f"""
+            SELECT "{self.LATITUDE}", "{self.LONGITUDE}", "startEventDate" AS {self.TIME}, "{self.SCIENTIFIC_NAME}"
+            FROM occurrence
+            WHERE "{self.LATITUDE}" >= {self.min_latitude} AND "startEventDate" IS NOT NULL
+        """
+        state = self.read_state()
+        previous = state.get(self.DATABASE_PARTITION)
+
+        with engine.connect() as conn:
+            batches = pl.read_database(query=query, connection=conn, iter_batches=True, batch_size=self.batch_size)
+            months = self.bin_partition(partition=self.DATABASE_PARTITION, batches=batches)
+
+        state[self.DATABASE_PARTITION] = {"fingerprint": datetime.now().isoformat(timespec="seconds"), "months": months}
+        self.write_state(state=state)
+
+        return self.write_months(months=sorted(set(months) | set(previous["months"] if previous else [])))
+
+    def iter_parquet_batches(self, parquet_file: str):
+        parquet = pq.ParquetFile(parquet_file)
+        columns = [c for c in (self.LATITUDE, self.LONGITUDE, self.TIME, self.SCIENTIFIC_NAME) if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=self.batch_size, columns=columns):
+            yield pl.from_arrow(batch)
+
+    def bin_batch(self, df: pl.DataFrame) -> tuple:
+        """
+        (flat month/cell index, taxon hash, has taxon) per occurrence inside the grid. The
+        flat index is month * n_cells^2 + row * n_cells + column where month counts from 1970-01.
+        """
+        x, y = polar_stereographic_exprs(lon=pl.col(self.LONGITUDE), lat=pl.col(self.LATITUDE))
+        time_col = pl.col(self.TIME).cast(pl.Datetime("ms"))
+        taxon = plh.col(self.SCIENTIFIC_NAME).nchash.xxhash64() if self.SCIENTIFIC_NAME in df.columns else pl.lit(None, dtype=pl.UInt64)
+
+        df = df.filter(
+            pl.col(self.LATITUDE).is_between(self.min_latitude, 90) & pl.col(self.LONGITUDE).is_between(-180, 180) & time_col.is_not_null()
+        ).select([
+            x.alias("x"),
+            y.alias("y"),
+            ((time_col.dt.year() - 1970) * 12 + time_col.dt.month() - 1).cast(pl.Int64).alias("month"),
+            taxon.fill_null(0).alias("taxon"),
+            taxon.is_not_null().alias("has_taxon")
+        ])
+
+        column = np.floor((df["x"].to_numpy() - self.grid_min) / self.cell_size).astype(np.int64)
+        row = np.floor((df["y"].to_numpy() - self.grid_min) / self.cell_size).astype(np.int64)
+        inside = (column >= 0) & (column < self.n_cells) & (row >= 0) & (row < self.n_cells)
+
+        index = df["month"].to_numpy()[inside] * self.n_cells ** 2 + row[inside] * self.n_cells + column[inside]
+        return index, df["taxon"].to_numpy()[inside], df["has_taxon"].to_numpy()[inside]
+
+    def bin_partition(self, partition: str, batches) -> list:
+        """
+        Bins every batch, keeps the sparse aggregates (sorted by the flat index) as the
+        partition's state and returns the months it covers
+        """
+        count_index, count_values, taxon_pairs = [], [], []
+        for batch in batches:
+            index, taxa, has_taxon = self.bin_batch(df=batch)
+            if len(index) == 0:
+                continue
+
+            unique_index, counts = np.unique(index, return_counts=True)
+            count_index.append(unique_index)
+            count_values.append(counts)
+            taxon_pairs.append(pl.DataFrame({"index": index[has_taxon], "taxon": taxa[has_taxon]}).unique())
+
+        if count_index:
+            index, inverse = np.unique(np.concatenate(count_index), return_inverse=True)
+            counts = np.bincount(inverse, weights=np.concatenate(count_values)).astype(np.int64)
+            pairs = pl.concat(taxon_pairs).unique().sort("index")
+        else:
+            index, counts = np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+            pairs = pl.DataFrame({"index": [], "taxon": []}, schema={"index": pl.Int64, "taxon": pl.UInt64})
+
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(
+            self.partition_state_file(partition=partition),
+            count_index=index,
+            count_values=counts,
+            taxon_index=pairs["index"].to_numpy(),
+            taxon_hash=pairs["taxon"].to_numpy()
+        )
+
+        return sorted(int(m) for m in np.unique(index // self.n_cells ** 2))
+
+    def write_months(self, months: list) -> list:
+        """
+        Combines every partition's state for the months and (re)writes their NetCDF files
+        """
+        if not months:
+            print("No months changed, nothing to write.")
+            return []
+
+        n_grid = self.n_cells ** 2
+        states = []
+        for partition in self.read_state():
+            with np.load(self.partition_state_file(partition=partition)) as state:
+                states.append({key: state[key] for key in state.files})
+
+        written = []
+        for month in months:
+            counts = np.zeros(n_grid, dtype=np.int64)
+            pairs = []
+            for state in states:
+                # the state is sorted by the flat index so each month is one slice
+                lo, hi = np.searchsorted(state["count_index"], [month * n_grid, (month + 1) * n_grid])
+                np.add.at(counts, state["count_index"][lo:hi] % n_grid, state["count_values"][lo:hi])
+
+                lo, hi = np.searchsorted(state["taxon_index"], [month * n_grid, (month + 1) * n_grid])
+                pairs.append(pl.DataFrame({"cell": state["taxon_index"][lo:hi] % n_grid, "taxon": state["taxon_hash"][lo:hi]}))
+
+            cells = pl.concat(pairs).unique()["cell"].to_numpy()
+            richness = np.bincount(cells, minlength=n_grid)
+
+            output_file = self.output_dir / f"{self.FILE_PREFIX}_{1970 + month // 12}-{month % 12 + 1:02d}.nc"
+            if counts.sum() == 0:
+                output_file.unlink(missing_ok=True) # every record for the month was removed
+                continue
+
+            self.write_netcdf(output_file=output_file, month=month,
+                              counts=counts.reshape(self.n_cells, self.n_cells),
+                              richness=richness.reshape(self.n_cells, self.n_cells))
+            written.append(str(output_file))
+
+        print(f"Wrote {len(written)} monthly grid file(s) to {self.output_dir}")
+        return written
+
+    def write_netcdf(self, output_file: Path, month: int, counts: np.ndarray, richness: np.ndarray):
+        """
+        One time step CF-1.8 file. EDDGridFromNcFiles aggregates the files along time.
+        """
+        import netCDF4 # only needed for the gridded output
+
+        month_start = datetime(1970 + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        lon, lat = polar_stereographic_inverse(*np.meshgrid(self.cell_centers, self.cell_centers))
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = output_file.with_suffix(".nc.tmp")
+        with netCDF4.Dataset(tmp_file, "w", format="NETCDF4") as nc:
+            nc.Conventions = "CF-1.8, ACDD-1.3"
+            nc.title = "Monthly Arctic occurrence record counts and species richness (GBIF and OBIS)"
+            nc.institution = "NOAA PMEL"
+            nc.source = "occurrence records binned onto a polar stereographic (EPSG:3413) grid"
+            nc.history = f"{datetime.now(timezone.utc).isoformat(timespec='seconds')} created by export/polar_grid_exporter.py"
+            nc.time_coverage_start = month_start.isoformat()
+            nc.geospatial_lat_min = self.min_latitude
+            nc.geospatial_lat_max = 90.0
+
+            nc.createDimension("time", 1)
+            nc.createDimension("y", self.n_cells)
+            nc.createDimension("x", self.n_cells)
+
+            time_var = nc.createVariable("time", "f8", ("time",))
+            time_var.standard_name = "time"
+            time_var.units = "seconds since 1970-01-01T00:00:00Z"
+            time_var.axis = "T"
+            time_var[:] = [month_start.timestamp()]
+
+            for name, axis in (("y", "Y"), ("x", "X")):
+                var = nc.createVariable(name, "f8", (name,))
+                var.standard_name = f"projection_{name}_coordinate"
+                var.units = "m"
+                var.axis = axis
+                var[:] = self.cell_centers
+
+            crs = nc.createVariable("crs", "i4")
+            crs.grid_mapping_name = "polar_stereographic"
+            crs.straight_vertical_longitude_from_pole = -45.0
+            crs.standard_parallel = 70.0
+            crs.latitude_of_projection_origin = 90.0
+            crs.false_easting = 0.0
+            crs.false_northing = 0.0
+            crs.semi_major_axis = SEMI_MAJOR_AXIS
+            crs.inverse_flattening = 1 / FLATTENING
+            crs.epsg_code = f"EPSG:{POLAR_SRID}"
+
+            for name, values, standard_name, units in (("latitude", lat, "latitude", "degrees_north"), ("longitude", lon, "longitude", "degrees_east")):
+                var = nc.createVariable(name, "f4", ("y", "x"), zlib=True)
+                var.standard_name = standard_name
+                var.units = units
+                var[:] = values
+
+            # Record counts add up over time and area, distinct taxon counts don't
+            for name, values, long_name, cell_methods, comment in (
+                ("record_count", counts, "Number of occurrence records", "time: sum area: sum", None),
+                ("species_richness", richness, "Number of distinct scientificName values", None,
+                 "Distinct taxa in the cell over the month. Not additive: the richness of several cells or months is not the sum of theirs.")
+            ):
+                var = nc.createVariable(name, "i4", ("time", "y", "x"), zlib=True, complevel=4, chunksizes=(1, min(self.n_cells, 256), min(self.n_cells, 256)))
+                var.long_name = long_name
+                var.units = "1"
+                var.grid_mapping = "crs"
+                var.coordinates = "latitude longitude"
+                if cell_methods:
+                    var.cell_methods = cell_methods
+                if comment:
+                    var.comment = comment
+                var.ioos_category = "Biology"
+                var[0, :, :] = values
+
+        tmp_file.replace(output_file)
+
+    def describe_file(self, file_path: str) -> str:
+        stat = Path(file_path).stat()
+        return f"{stat.st_size}-{int(stat.st_mtime)}"
+
+    def partition_state_file(self, partition: str) -> Path:
+        return self.state_dir / f"{hashlib.sha256(partition.encode()).hexdigest()[:16]}.npz"
+
+    def read_state(self) -> dict:
+        """
+        {partition: {"fingerprint": ..., "months": [...]}} from the last run. A different
+        grid definition means none of the previous state can be reused.
+        """
+        state_file = self.state_dir / self.STATE_FILE
+        if not state_file.exists():
+            return {}
+
+        with open(state_file) as f:
+            state = json.load(f)
+        if state.get("grid") != self.grid_definition():
+            print("Grid definition changed, re-binning every partition")
+            return {}
+        return state["partitions"]
+
+    def write_state(self, state: dict):
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.state_dir / f"{self.STATE_FILE}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"grid": self.grid_definition(), "partitions": state}, f, indent=2)
+        tmp_file.replace(self.state_dir / self.STATE_FILE)
+
+    def grid_definition(self) -> dict:
+        return {"srid": POLAR_SRID, "cell_size": self.cell_size, "n_cells": self.n_cells, "min_latitude": self.min_latitude}
@@ -0,0 +1,52 @@
+import argparse
+
+from download_registry.registry import DownloadRegistry
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "List the registered GBIF downloads and OBIS snapshots or garbage collect the old ones"
+    )
+    parser.add_argument(
+        '--registry',
+        type=str,
+        required=True,
+        help=f"The registry file (<data_dir>/{DownloadRegistry.REGISTRY_FILE_NAME})."
+    )
+    parser.add_argument(
+        '--source',
+        choices=[DownloadRegistry.GBIF, DownloadRegistry.OBIS],
+        default=None,
+        help="Only this source. Required for --keep_snapshots."
+    )
+    parser.add_argument(
+        '--keep_snapshots',
+        type=int,
+        default=None,
+        help="Delete the snapshots (download days) beyond the newest this many."
+    )
+    parser.add_argument(
+        '--max_snapshot_age_days',
+        type=float,
+        default=None,
+        help="With --keep_snapshots, only delete the snapshots older than this many days."
+    )
+    parser.add_argument(
+        '--dry_run',
+        action='store_true',
+        help="Print what would be deleted without deleting it."
+    )
+
+    args = parser.parse_args()
+
+    registry = DownloadRegistry(registry_file=args.registry)
+
+    if args.keep_snapshots is None:
+        for download in registry.list_downloads(source=args.source):
+            print(f"{download['created']}  {download['source']}  {download['download_key']}  doi={download['doi']}  size={download['size']}  {download['path']}")
+            for output in download["outputs"]:
+                print(f"    {output['stage']}: {output['file']} ({output['size']:,} bytes, schema {(output['schema_fingerprint'] or '')[:12]})")
+    elif args.source is None:
+        parser.error("--keep_snapshots needs --source")
+    else:
+        registry.garbage_collect(source=args.source, keep_last=args.keep_snapshots, max_age_days=args.max_snapshot_age_days, dry_run=args.dry_run)
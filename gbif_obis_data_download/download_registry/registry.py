@@ -0,0 +1,243 @@
+import hashlib
+import json
+import shutil
+import sqlite3
+import pyarrow.parquet as pq
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+class DownloadRegistry:
+    """
+    A local SQLite record of the GBIF downloads and OBIS snapshots that were fetched and
+    the parquet files produced from them, so reruns can skip work whose inputs haven't
+    changed and old snapshots can be garbage collected.
+
+    A download is addressed by (source, download_key): the GBIF download key, or for OBIS
+    the fingerprint of the S3 snapshot's files. It records the DOI, the hash of the request
+    predicate/query, the archive's size and checksum and where it was saved. Each output
+    (stage) records its file, size, schema fingerprint and the hash of the query that made it.
+    """
+
+    GBIF = "gbif"
+    OBIS = "obis"
+
+    REGISTRY_FILE_NAME = "download_registry.sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS downloads (
+            source TEXT NOT NULL,
+            download_key TEXT NOT NULL,
+            doi TEXT,
+            predicate_hash TEXT,
+            size INTEGER,
+            checksum TEXT,
+            path TEXT,
+            created TEXT NOT NULL,
+            PRIMARY KEY (source, download_key)
+        );
+        CREATE TABLE IF NOT EXISTS outputs (
+            source TEXT NOT NULL,
+            download_key TEXT NOT NULL,
+            stage TEXT NOT NULL,
+            file TEXT NOT NULL,
+            size INTEGER,
+            schema_fingerprint TEXT,
+            query_hash TEXT,
+            created TEXT NOT NULL,
+            PRIMARY KEY (source, download_key, stage),
+            FOREIGN KEY (source, download_key) REFERENCES downloads (source, download_key) ON DELETE CASCADE
+        );
+        CREATE INDEX IF NOT EXISTS idx_downloads_predicate ON downloads (source, predicate_hash, created);
+    """
+
+    def __init__(self, registry_file: str):
+        self.registry_file = Path(registry_file)
+        self.registry_file.parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as con:
+            con.executescript(self.SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        """A connection that commits (or rolls back) and closes at the end of the with block"""
+        con = sqlite3.connect(self.registry_file)
+        con.row_factory = sqlite3.Row
+        con.execute("PRAGMA foreign_keys = ON")
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @staticmethod
+    def hash_predicate(predicate) -> str:
+        """sha256 of a predicate dict (key order independent) or of a query string"""
+        text = predicate if isinstance(predicate, str) else json.dumps(predicate, sort_keys=True)
+        return hashlib.sha256(" ".join(text.split()).encode()).hexdigest()
+
+    @staticmethod
+    def file_checksum(file_path: str, buffer_size: int = 1024 * 1024) -> str:
+        """"md5:<hex digest>" of the file (the format RangedDownloader verifies)"""
+        digest = hashlib.md5()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(buffer_size):
+                digest.update(chunk)
+        return f"md5:{digest.hexdigest()}"
+
+    @staticmethod
+    def schema_fingerprint(parquet_file: str) -> str:
+        """sha256 of the parquet file's column names and types"""
+        schema = pq.read_schema(parquet_file)
+        columns = [(field.name, str(field.type)) for field in schema]
+        return hashlib.sha256(json.dumps(columns).encode()).hexdigest()
+
+    def record_download(self, source: str, download_key: str, path: str = None, doi: str = None, predicate_hash: str = None,
+                        size: int = None, checksum: str = None):
+        """
+        Registers (or updates) a fetched download. The size and checksum are read from path
+        when they're not given and path is a file.
+        """
+        if path is not None and Path(path).is_file():
+            size = size if size is not None else Path(path).stat().st_size
+            checksum = checksum or self.file_checksum(file_path=path)
+
+        with self.connect() as con:
+            con.execute(
+                """
+                INSERT INTO downloads (source, download_key, doi, predicate_hash, size, checksum, path, created)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (source, download_key) DO UPDATE SET
+                    doi = COALESCE(excluded.doi, doi),
+                    predicate_hash = COALESCE(excluded.predicate_hash, predicate_hash),
+                    size = COALESCE(excluded.size, size),
+                    checksum = COALESCE(excluded.checksum, checksum),
+                    path = COALESCE(excluded.path, path)
+                """,
+                (source, download_key, doi, predicate_hash, size, checksum, str(path) if path else None, datetime.now().isoformat(timespec="seconds"))
+            )
+
+    def record_outputs(self, source: str, download_key: str, outputs: dict, query_hashes: dict = None):
+        """Registers the produced files, outputs is {stage: parquet file}"""
+        query_hashes = query_hashes or {}
+        created = datetime.now().isoformat(timespec="seconds")
+
+        with self.connect() as con:
+            for stage, file in outputs.items():
+                file = Path(file)
+                schema_fingerprint = self.schema_fingerprint(parquet_file=file) if file.suffix == ".parquet" else None
+                con.execute(
+                    """
+                    INSERT OR REPLACE INTO outputs (source, download_key, stage, file, size, schema_fingerprint, query_hash, created)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (source, download_key, stage, str(file), file.stat().st_size, schema_fingerprint, query_hashes.get(stage), created)
+                )
+
+    def get_download(self, source: str, download_key: str) -> dict:
+        with self.connect() as con:
+            row = con.execute("SELECT * FROM downloads WHERE source = ? AND download_key = ?", (source, download_key)).fetchone()
+        return dict(row) if row else None
+
+    def find_recent_download(self, source: str, predicate_hash: str, max_age_days: float) -> dict:
+        """The newest fetched download of the same predicate registered within max_age_days (None if there isn't one)"""
+        since = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+        with self.connect() as con:
+            row = con.execute(
+                "SELECT * FROM downloads WHERE source = ? AND predicate_hash = ? AND created >= ? AND path IS NOT NULL ORDER BY created DESC LIMIT 1",
+                (source, predicate_hash, since)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def get_outputs(self, source: str, download_key: str, stages: list = None, query_hashes: dict = None) -> dict:
+        """
+        {stage: file} of the download's registered outputs if every one of the stages (all
+        registered stages by default) is still on disk with its registered size and, when
+        query_hashes is given, was made by the same query. Otherwise None, the work has to
+        be redone.
+        """
+        with self.connect() as con:
+            rows = con.execute("SELECT * FROM outputs WHERE source = ? AND download_key = ?", (source, download_key)).fetchall()
+        registered = {row["stage"]: dict(row) for row in rows}
+
+        stages = stages or list(registered)
+        if not stages:
+            return None
+
+        outputs = {}
+        for stage in stages:
+            output = registered.get(stage)
+            if output is None or not Path(output["file"]).is_file() or Path(output["file"]).stat().st_size != output["size"]:
+                return None
+            if query_hashes is not None and output["query_hash"] != query_hashes.get(stage):
+                return None
+            outputs[stage] = output["file"]
+
+        return outputs
+
+    def list_downloads(self, source: str = None) -> list:
+        """The registered downloads (newest first) with their outputs"""
+        with self.connect() as con:
+            rows = con.execute(
+                "SELECT * FROM downloads WHERE ? IS NULL OR source = ? ORDER BY created DESC",
+                (source, source)
+            ).fetchall()
+            downloads = []
+            for row in rows:
+                outputs = con.execute("SELECT * FROM outputs WHERE source = ? AND download_key = ?", (row["source"], row["download_key"])).fetchall()
+                downloads.append({**dict(row), "outputs": [dict(output) for output in outputs]})
+        return downloads
+
+    def garbage_collect(self, source: str, keep_last: int = 3, max_age_days: float = None, dry_run: bool = False) -> list:
+        """
+        Deletes the files of the source's snapshots beyond the newest keep_last (at least the
+        newest one is always kept) that are also older than max_age_days (if given), and
+        forgets them. A snapshot is the downloads registered on the same day (e.g. the tiles
+        of one request). Files or directories a kept download still uses are left alone and
+        directories left empty are removed. Returns the collected downloads.
+        """
+        keep_last = max(1, keep_last)
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat(timespec="seconds") if max_age_days is not None else None
+
+        downloads = self.list_downloads(source=source)
+        kept_days = sorted({download["created"][:10] for download in downloads}, reverse=True)[:keep_last]
+        collected = [
+            download for download in downloads
+            if download["created"][:10] not in kept_days and (cutoff is None or download["created"] < cutoff)
+        ]
+        kept_files = {
+            Path(file).resolve()
+            for download in downloads if download not in collected
+            for file in [download["path"], *[output["file"] for output in download["outputs"]]] if file
+        }
+
+        for download in collected:
+            files = [Path(output["file"]) for output in download["outputs"]]
+            if download["path"]:
+                files.append(Path(download["path"]))
+
+            print(f"{'Would collect' if dry_run else 'Collecting'} {download['source']} {download['download_key']} ({download['created']})")
+            if dry_run:
+                continue
+
+            for file in files:
+                resolved = file.resolve()
+                if resolved in kept_files or any(resolved in kept.parents for kept in kept_files):
+                    continue
+                if file.is_dir():
+                    shutil.rmtree(file, ignore_errors=True)
+                else:
+                    file.unlink(missing_ok=True)
+                self.remove_empty_parents(file.parent)
+
+            with self.connect() as con:
+                con.execute("DELETE FROM downloads WHERE source = ? AND download_key = ?", (download["source"], download["download_key"]))
+
+        return collected
+
+    def remove_empty_parents(self, directory: Path):
+        """Removes the directory (and its parents) while they're empty, up to the registry's directory"""
+        stop_dir = self.registry_file.parent.resolve()
+        directory = directory.resolve()
+        while directory != stop_dir and stop_dir in directory.parents and directory.is_dir() and not any(directory.iterdir()):
+            directory.rmdir()
+            directory = directory.parent
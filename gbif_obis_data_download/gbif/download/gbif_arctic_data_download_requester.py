@@ -1,21 +1,118 @@
+import time
 import requests
+from download_registry.registry import DownloadRegistry
 
 class GbifArcticDataDownloadRequester:
 
     ARCTIC_POLYGON = 'POLYGON((-180 60, 180 60, 180 90, -180 90, -180 60))' # Loose lat/lon polygon coords for the Arctic
+    ARCTIC_BOUNDS = (-180, 60, 180, 90) # west, south, east, north of ARCTIC_POLYGON (split into tiles)
     DOWNLOAD_FORMAT = "DWCA" # Darwin Core Archive - only format to get DNA-derived and MOF
     VERBATIM_DNA_DER_EXT = "http://rs.gbif.org/terms/1.0/DNADerivedData" # name of extension to specify getting DNA-derived data
     VERBATIM_MOF_EXT = "http://rs.iobis.org/obis/terms/ExtendedMeasurementOrFact" # name of extension to specify getting measurement of fact
     GBIF_OCCURRENCE_REQ_URL = "https://api.gbif.org/v1/occurrence/download/request" # GBIF request url for occurrence downloads
+    # GBIF only runs a few downloads per user at a time and rejects requests beyond that with these
+    REJECTED_STATUS_CODES = (420, 429, 503)
 
-    def __init__(self, gbif_user: str, gbif_notify_email: str, gbif_pass: str):
+    def __init__(self, gbif_user: str, gbif_notify_email: str, gbif_pass: str, api_url: str = None,
+                 lon_tiles: int = 1, lat_tiles: int = 1, modified_since: str = None,
+                 registry: DownloadRegistry = None, reuse_within_days: float = None,
+                 submit_retry_seconds: float = 60, max_submit_wait_seconds: float = 18000):
+        """
+        api_url replaces https://api.gbif.org/v1 (e.g. a local stand-in server for testing).
+
+        lon_tiles x lat_tiles splits the Arctic into tiles that are requested as separate
+        downloads, so GBIF builds several smaller archives that can be fetched and parsed in
+        parallel (see GbifDownloadOrchestrator). modified_since (YYYY-MM-DD) only requests
+        the records modified since then, for incremental pulls.
+
+        With a registry, every new download key is registered with the hash of its predicate,
+        and with reuse_within_days a tile whose predicate was already downloaded within that
+        many days reuses that key instead of having GBIF build the same archive again.
+
+        GBIF only runs a few downloads per user at a time (about 3), so with more tiles
+        than that the later requests are rejected until earlier downloads finish. A rejected
+        request is retried with backoff (from submit_retry_seconds, for up to
+        max_submit_wait_seconds), so the tiles are submitted as the running downloads finish.
 
+        Raises IOError if any tile's request still fails: the other tiles' archives don't cover
+        the whole Arctic, so they mustn't be merged as if they did. The keys that were created
+        are cancelled first so GBIF stops building them.
+        """
+        self.occurrence_req_url = f"{api_url.rstrip('/')}/occurrence/download/request" if api_url else self.GBIF_OCCURRENCE_REQ_URL
         self.gbif_user = gbif_user
         self.gbif_notify_email = gbif_notify_email
         self.gbif_pass = gbif_pass
-        self.download_key = self._initiate_arctic_download()
+        self.modified_since = modified_since
+        self.registry = registry
+        self.reuse_within_days = reuse_within_days
+        self.submit_retry_seconds = submit_retry_seconds
+        self.max_submit_wait_seconds = max_submit_wait_seconds
+        self.tile_polygons = self.build_tile_polygons(lon_tiles=lon_tiles, lat_tiles=lat_tiles)
+
+        tile_keys = {}
+        for polygon in self.tile_polygons:
+            tile_keys[polygon] = self._initiate_arctic_download(geometry=polygon)
+            if tile_keys[polygon] is None:
+                # The rest of the tiles would be requested for nothing
+                break
+
+        failed_tiles = [polygon for polygon in self.tile_polygons if tile_keys.get(polygon) is None]
+        if failed_tiles:
+            created_keys = [key for key in tile_keys.values() if key is not None]
+            for key in created_keys:
+                self.cancel_download(download_key=key)
+            raise IOError(f"The download request failed or wasn't made for {len(failed_tiles)} of {len(self.tile_polygons)} tiles ({failed_tiles}). "
+                          f"The requested keys {created_keys} only cover part of the Arctic, so they were cancelled instead of merged")
+
+        self.download_keys = list(tile_keys.values())
+        self.download_key = self.download_keys[0]
+
+    def build_tile_polygons(self, lon_tiles: int, lat_tiles: int) -> list:
+        """
+        WKT polygons (counter-clockwise, as GBIF expects) of the lon_tiles x lat_tiles grid
+        over ARCTIC_BOUNDS. One tile is ARCTIC_POLYGON itself.
+        """
+        if lon_tiles * lat_tiles <= 1:
+            return [self.ARCTIC_POLYGON]
+
+        west, south, east, north = self.ARCTIC_BOUNDS
+        lon_step = (east - west) / lon_tiles
+        lat_step = (north - south) / lat_tiles
+
+        polygons = []
+        for i in range(lon_tiles):
+            for j in range(lat_tiles):
+                w, e = west + i * lon_step, west + (i + 1) * lon_step
+                s, n = south + j * lat_step, south + (j + 1) * lat_step
+                polygons.append(f"POLYGON(({w:g} {s:g}, {e:g} {s:g}, {e:g} {n:g}, {w:g} {n:g}, {w:g} {s:g}))")
+
+        return polygons
 
-    def _construct_query(self):
+    def _construct_predicate(self, geometry: str) -> dict:
+        """
+        The within predicate for the geometry, and'ed with a modified >= modified_since
+        predicate for incremental pulls
+        """
+        predicate = {
+            "type": "within",
+            "geometry": geometry
+            }
+        if self.modified_since is None:
+            return predicate
+
+        return {
+            "type": "and",
+            "predicates": [
+                predicate,
+                {
+                    "type": "greaterThanOrEquals",
+                    "key": "MODIFIED",
+                    "value": self.modified_since
+                    }
+                ]
+            }
+
+    def _construct_query(self, geometry: str = ARCTIC_POLYGON):
         """"
         Constructs the query to get the arctic data from GBIF including
         the DNA-derived and Measurment of Fact files.
@@ -27,34 +124,80 @@ class GbifArcticDataDownloadRequester:
                 ],
             "sendNotification": True,
             "format": self.DOWNLOAD_FORMAT,
-            "predicate": {
-                "type": "within",
-                "geometry": self.ARCTIC_POLYGON
-                },
+            "predicate": self._construct_predicate(geometry=geometry),
                 "verbatimExtensions": [
                     self.VERBATIM_DNA_DER_EXT,
                     self.VERBATIM_MOF_EXT
                     ]
                     }
     
-    def _initiate_arctic_download(self):
+    def _initiate_arctic_download(self, geometry: str = ARCTIC_POLYGON):
         """
-        Initiates the download of Arctic data and prints the download
-        key.
+        Initiates the download of Arctic data (in the geometry) and prints
+        the download key.
         """
-        query = self._construct_query()
+        query = self._construct_query(geometry=geometry)
+        predicate_hash = DownloadRegistry.hash_predicate(query["predicate"])
+
+        if self.registry is not None and self.reuse_within_days is not None:
+            previous = self.registry.find_recent_download(source=DownloadRegistry.GBIF, predicate_hash=predicate_hash, max_age_days=self.reuse_within_days)
+            if previous is not None:
+                print(f"Reusing download {previous['download_key']} of the same predicate from {previous['created']}")
+                return previous["download_key"]
 
-        response = requests.post(
-            self.GBIF_OCCURRENCE_REQ_URL,
-            json=query,
-            auth=(self.gbif_user, self.gbif_pass),
-            headers={'Content-Type': 'application/json'}
-        )
+        response = self._post_download_request(query=query)
 
-        if response.status_code == 201:
+        if response is None:
+            return None
+        elif response.status_code == 201:
             download_key = response.text.strip()
             print(f"Download created!: {download_key}")
             print(f"Track it as: https://www.gbif.org/occurrence/download/{download_key}")
+            if self.registry is not None:
+                self.registry.record_download(source=DownloadRegistry.GBIF, download_key=download_key, predicate_hash=predicate_hash)
             return download_key
         else:
-            print(f"Error {response.status_code}: {response.text}")
\ No newline at end of file
+            print(f"Error {response.status_code}: {response.text}")
+
+    def _post_download_request(self, query: dict) -> requests.Response:
+        """
+        POSTs the download request, retrying with backoff while GBIF rejects it for the
+        user's running downloads (or a connection error), up to max_submit_wait_seconds.
+        Returns None if it never got a response.
+        """
+        start_time = time.monotonic()
+        wait = self.submit_retry_seconds
+        while True:
+            try:
+                response = requests.post(
+                    self.occurrence_req_url,
+                    json=query,
+                    auth=(self.gbif_user, self.gbif_pass),
+                    headers={'Content-Type': 'application/json'}
+                )
+                if response.status_code not in self.REJECTED_STATUS_CODES:
+                    return response
+                reason = f"{response.status_code}: {response.text.strip()}"
+            except requests.RequestException as e:
+                response = None
+                reason = str(e)
+
+            if time.monotonic() - start_time + wait > self.max_submit_wait_seconds:
+                if response is None:
+                    print(f"Error: download request failed ({reason})")
+                return response
+
+            print(f"Download request rejected ({reason}), retrying in {wait:.0f} s once running downloads finish")
+            time.sleep(wait)
+            wait = min(wait * 2, 900)
+
+    def cancel_download(self, download_key: str):
+        """Asks GBIF to stop building (and delete) a download"""
+        try:
+            response = requests.delete(f"{self.occurrence_req_url}/{download_key}", auth=(self.gbif_user, self.gbif_pass), timeout=60)
+            if response.ok:
+                print(f"Cancelled download {download_key}")
+            else:
+                print(f"Error {response.status_code} cancelling {download_key}: {response.text}")
+        except requests.RequestException as e:
+            print(f"Error cancelling {download_key}: {e}")
@@ -3,10 +3,12 @@ import time
 from pygbif import occurrences as occ
 from gbif.download.gbif_arctic_data_download_requester import GbifArcticDataDownloadRequester
 from gbif.download.gbif_download_unzipper import GbifDownloadUnzipper
+from gbif.download.ranged_downloader import RangedDownloader
 
 class GbifDownloadManager:
 
-    def __init__(self, gbif_user: str, gbif_notify_email: str, gbif_pass: str, data_download_dir: str):
+    def __init__(self, gbif_user: str, gbif_notify_email: str, gbif_pass: str, data_download_dir: str, downloader: RangedDownloader = None):
+        self.downloader = downloader
         self.download_initiator = GbifArcticDataDownloadRequester(gbif_user=gbif_user, gbif_notify_email=gbif_notify_email, gbif_pass=gbif_pass)
         self.download_key = self.download_initiator.download_key
         self.data_download_dir = data_download_dir
@@ -38,8 +40,8 @@ class GbifDownloadManager:
                 # If sucesses, download and unzip
                 if status == "SUCCEEDED":
                     print("Download completed! Processing...")
-                    unzipper = GbifDownloadUnzipper(download_key=self.download_key, data_download_dir=self.data_download_dir)
-                    unzipper.download_and_unzip()
+                    unzipper = GbifDownloadUnzipper(download_key=self.download_key, data_download_dir=self.data_download_dir, downloader=self.downloader)
+                    return unzipper.download_and_unzip()
 
                 elif status in ["FAILED", "CANCELED", "KILLED"]:
                     print(f"Download {status.lower()}, Cannot proceed.")
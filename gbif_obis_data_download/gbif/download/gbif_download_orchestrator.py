@@ -0,0 +1,213 @@
+import asyncio
+import random
+import time
+import requests
+from datetime import datetime
+from pathlib import Path
+from gbif.download.gbif_download_unzipper import GbifDownloadUnzipper
+from gbif.download.ranged_downloader import RangedDownloader
+from gbif.parse.gbif_occurrence_parser import GbifOccurrenceParser
+from gbif.parse.gbif_shard_merger import GbifShardMerger
+from download_registry.registry import DownloadRegistry
+
+class GbifDownloadOrchestrator:
+    """
+    Tracks several GBIF download keys at once. Each key is polled on its own schedule
+    (starting at initial_poll_seconds and backing off to max_poll_seconds while its status
+    doesn't change), fetched with the RangedDownloader as soon as it SUCCEEDED and then
+    handed straight to GbifOccurrenceParser.
+
+    The blocking work (HTTP calls, the download and the parse) runs in threads so one
+    key's multi-GB download doesn't hold up the polling of the others. Parses run one
+    at a time since each already uses every core.
+
+    Several keys are taken to be the tiles of one request (see GbifArcticDataDownloadRequester's
+    lon_tiles/lat_tiles): once all of them are parsed their outputs are merged into the usual
+    dated directory, without the records duplicated on tile borders.
+
+    With a DownloadRegistry, keys that were already downloaded (and parsed) with their
+    files still on disk are skipped, and new downloads and outputs are registered. The
+    merged outputs are registered as their own entry (see merged_download_key) so the
+    registry's garbage collection reclaims them too.
+    """
+
+    GBIF_API_URL = GbifDownloadUnzipper.GBIF_API_URL
+
+    SUCCEEDED = "SUCCEEDED"
+    FAILED_STATUSES = ["FAILED", "CANCELLED", "CANCELED", "KILLED", "FILE_ERASED"]
+    RUNNING_STATUSES = ["PREPARING", "RUNNING", "SUSPENDED"]
+
+    def __init__(self, data_download_dir: str, api_url: str = GBIF_API_URL, downloader: RangedDownloader = None,
+                 initial_poll_seconds: float = 30, max_poll_seconds: float = 900, backoff_factor: float = 1.5,
+                 max_wait_seconds: float = 18000, extract: bool = False, parse: bool = True, parse_stages: list = None,
+                 merge_shards: bool = True, registry: DownloadRegistry = None):
+        """
+        With extract=False the zip is kept and parsed in place. parse_stages are the
+        GbifOccurrenceParser stages to run (defaults to all of them). merge_shards=False
+        keeps the parsed outputs of several keys apart (in data_download_dir/<key>/).
+        """
+        self.data_download_dir = Path(data_download_dir)
+        self.api_url = api_url.rstrip("/")
+        self.downloader = downloader or RangedDownloader()
+        self.initial_poll_seconds = initial_poll_seconds
+        self.max_poll_seconds = max_poll_seconds
+        self.backoff_factor = backoff_factor
+        self.max_wait_seconds = max_wait_seconds
+        self.extract = extract
+        self.parse = parse
+        self.parse_stages = parse_stages
+        self.merge_shards = merge_shards
+        self.registry = registry
+        self.merged_outputs = None
+        self._parse_lock = asyncio.Lock()
+
+    def run(self, download_keys: list) -> dict:
+        """
+        Tracks, downloads and parses every key. Returns {download_key: parser outputs
+        (or the download path if parse is False)}, None for keys that failed or timed out.
+        """
+        return asyncio.run(self.process_all(download_keys=download_keys))
+
+    async def process_all(self, download_keys: list) -> dict:
+        results = await asyncio.gather(*[self.process(download_key=key, n_keys=len(download_keys)) for key in download_keys])
+
+        if self.parse and self.merge_shards and len(download_keys) > 1:
+            if None in results:
+                print("Not merging the shards, some of the downloads failed")
+            else:
+                self.merged_outputs = await asyncio.to_thread(self.merge, download_keys=download_keys, shard_outputs=results)
+
+        return dict(zip(download_keys, results))
+
+    async def process(self, download_key: str, n_keys: int = 1):
+        registered = self.get_registered_result(download_key=download_key)
+        if registered is not None:
+            print(f"[{download_key}] Already in the download registry, skipping it")
+            return registered
+
+        status = await self.wait_for_download(download_key=download_key)
+        if status != self.SUCCEEDED:
+            return None
+
+        # Keys downloaded on the same day would share the dated zip name, so several keys get a directory each
+        data_download_dir = self.data_download_dir if n_keys == 1 else self.data_download_dir / download_key
+        unzipper = GbifDownloadUnzipper(download_key=download_key, data_download_dir=data_download_dir,
+                                        downloader=self.downloader, api_url=self.api_url)
+        download_path = await asyncio.to_thread(unzipper.download_and_unzip, extract=self.extract)
+        if download_path is None:
+            return None
+        if self.registry is not None:
+            await asyncio.to_thread(self.register_download, download_key=download_key, download_path=download_path)
+        if not self.parse:
+            return download_path
+
+        gbif_download_dir = download_path if download_path.is_dir() else download_path.parent
+        async with self._parse_lock:
+            print(f"[{download_key}] Parsing {gbif_download_dir}")
+            outputs = await asyncio.to_thread(self.parse_download, gbif_download_dir=gbif_download_dir)
+
+        if self.registry is not None:
+            self.registry.record_outputs(source=DownloadRegistry.GBIF, download_key=download_key, outputs=outputs)
+        return outputs
+
+    def merge(self, download_keys: list, shard_outputs: list) -> dict:
+        """
+        Merges the shards into the dated directory (or reuses a registered merge of the
+        same keys whose files are all still there) and registers the merged outputs
+        """
+        merged_key = self.merged_download_key(download_keys=download_keys)
+        if self.registry is not None:
+            registered = self.registry.get_outputs(source=DownloadRegistry.GBIF, download_key=merged_key)
+            if registered is not None:
+                print(f"The shards of {merged_key} are already merged, skipping it")
+                return registered
+
+        merge_dir = self.data_download_dir / datetime.now().strftime("%Y-%m-%d")
+        merger = GbifShardMerger(shard_outputs=shard_outputs, output_dir=merge_dir)
+        merged_outputs = merger.merge()
+
+        if self.registry is not None:
+            self.registry.record_download(source=DownloadRegistry.GBIF, download_key=merged_key)
+            self.registry.record_outputs(source=DownloadRegistry.GBIF, download_key=merged_key, outputs=merged_outputs)
+        return merged_outputs
+
+    @staticmethod
+    def merged_download_key(download_keys: list) -> str:
+        """The registry key of the merge of these download keys (in any order)"""
+        return f"merged-{DownloadRegistry.hash_predicate(sorted(download_keys))[:16]}"
+
+    def get_registered_result(self, download_key: str):
+        """
+        The parsed outputs (or the download path if parse is False) of an already registered
+        key whose files are all still there, otherwise None
+        """
+        if self.registry is None:
+            return None
+        if self.parse:
+            stages = self.parse_stages or list(GbifOccurrenceParser.STAGE_FILE_PREFIXES)
+            return self.registry.get_outputs(source=DownloadRegistry.GBIF, download_key=download_key, stages=stages)
+
+        download = self.registry.get_download(source=DownloadRegistry.GBIF, download_key=download_key)
+        if download is not None and download["path"] and Path(download["path"]).exists():
+            return Path(download["path"])
+        return None
+
+    def register_download(self, download_key: str, download_path: Path):
+        """Registers the fetched archive with its DOI and size from the GBIF download metadata"""
+        try:
+            meta = self.get_meta(download_key=download_key)
+        except (requests.RequestException, ValueError):
+            meta = {}
+        self.registry.record_download(source=DownloadRegistry.GBIF, download_key=download_key, path=download_path,
+                                      doi=meta.get("doi"), size=meta.get("size"))
+
+    async def wait_for_download(self, download_key: str) -> str:
+        """Polls the key until it's done with adaptive backoff. Returns the final status."""
+        start_time = time.monotonic()
+        poll_seconds = self.initial_poll_seconds
+        previous_status = None
+
+        while True:
+            try:
+                status = await asyncio.to_thread(self.get_status, download_key=download_key)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                # Transient API errors back off like an unchanged status instead of giving up
+                print(f"[{download_key}] Error checking download status: {e}")
+                status = previous_status
+
+            print(f"[{download_key}] Download status: {status} (checked at {time.strftime('%Y-%m-%d %H:%M:%S')})")
+
+            if status == self.SUCCEEDED:
+                return status
+            if status in self.FAILED_STATUSES:
+                print(f"[{download_key}] Download {status.lower()}, Cannot proceed.")
+                return status
+            if status is not None and status not in self.RUNNING_STATUSES:
+                print(f"[{download_key}] Unknown status: {status}")
+                return status
+
+            if status != previous_status:
+                # Poll quickly again after a change (e.g. PREPARING -> RUNNING), the next one may follow soon
+                poll_seconds = self.initial_poll_seconds
+            else:
+                poll_seconds = min(poll_seconds * self.backoff_factor, self.max_poll_seconds)
+            previous_status = status
+
+            elapsed = time.monotonic() - start_time
+            if elapsed + poll_seconds > self.max_wait_seconds:
+                print(f"[{download_key}] Timeout: Download not completed within {self.max_wait_seconds} seconds.")
+                return None
+
+            # A little jitter so many keys don't poll the API in lockstep
+            await asyncio.sleep(poll_seconds * random.uniform(0.9, 1.1))
+
+    def get_meta(self, download_key: str) -> dict:
+        response = requests.get(f"{self.api_url}/occurrence/download/{download_key}", timeout=self.downloader.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_status(self, download_key: str) -> str:
+        return self.get_meta(download_key=download_key)["status"]
+
+    def parse_download(self, gbif_download_dir: Path) -> dict:
+        return GbifOccurrenceParser(gbif_download_dir=str(gbif_download_dir)).run(stages=self.parse_stages)
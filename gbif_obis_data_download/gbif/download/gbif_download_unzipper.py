@@ -2,37 +2,88 @@ import requests
 import zipfile
 from datetime import datetime
 from pathlib import Path
+from gbif.download.ranged_downloader import RangedDownloader
 
 class GbifDownloadUnzipper:
 
-    def __init__(self, download_key: str, data_download_dir: str):
+    GBIF_API_URL = "https://api.gbif.org/v1"
+    PARTIAL_DIR = ".partial" # in data_download_dir, where downloads are kept (by key) until they're verified
 
+    def __init__(self, download_key: str, data_download_dir: str, downloader: RangedDownloader = None, api_url: str = GBIF_API_URL):
+        """
+        downloader sets the number of concurrent range segments, buffer size and retries
+        of the archive download. api_url can point at a local stand-in server for testing.
+        """
         self.download_key = download_key
-        self.download_url = f"https://api.gbif.org/v1/occurrence/download/request/{download_key}.zip"
+        self.api_url = api_url.rstrip("/")
+        self.download_url = f"{self.api_url}/occurrence/download/request/{download_key}.zip"
+        self.meta_url = f"{self.api_url}/occurrence/download/{download_key}"
         self.data_download_dir = data_download_dir
+        self.downloader = downloader or RangedDownloader()
 
-    def download_and_unzip(self):
+    def download_and_unzip(self, extract: bool = True, expected_checksum: str = None) -> Path:
         """
-        Downloads the GBIF zip file and unzips it to the data directory
+        Downloads the GBIF zip file and unzips it to the data directory.
+        With extract=False the zip is kept as is - GbifOccurrenceParser
+        reads the txt files straight out of it, which saves writing (and
+        re-reading) the extracted archive. Returns the zip file or the
+        directory it was extracted to.
+
+        The download is resumed if an earlier run was interrupted (on any
+        day, the partial file is named by the download key), and is checked
+        against the size GBIF reports for the download (and expected_checksum,
+        "<algorithm>:<hex digest>", if given) before it's moved into the
+        dated directory.
         """
         print(f"Downloading {self.download_key}...")
-        response = requests.get(self.download_url, stream=True)
-
-        if response.status_code == 200:
-            # Save the zip file
-            zip_path = self.create_dated_file_name()
-            with open(zip_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            print(f"Downloaded to {zip_path}")
-
-            print("Extracting")
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(f"{zip_path.parent}")
-                print(f"{zip_path.parent}/")
-                zip_path.unlink() # Deletes the file represented by the Path object
+        partial_path = self.create_partial_file_name()
+
+        if partial_path.exists():
+            # An earlier run verified it but stopped before moving it
+            print(f"{partial_path} was already downloaded and verified")
         else:
-            print(f"Error: {response.status_code}")
+            try:
+                self.downloader.download(
+                    url=self.download_url,
+                    output_file=partial_path,
+                    expected_size=self.get_download_size(),
+                    expected_checksum=expected_checksum
+                )
+            except (requests.RequestException, IOError) as e:
+                print(f"Error: {e}")
+                return None
+
+        zip_path = self.create_dated_file_name()
+        partial_path.replace(zip_path)
+        if not any(partial_path.parent.iterdir()):
+            partial_path.parent.rmdir()
+        print(f"Downloaded to {zip_path}")
+
+        if not extract:
+            return zip_path
+
+        print("Extracting")
+        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+            zip_ref.extractall(f"{zip_path.parent}")
+            print(f"{zip_path.parent}/")
+            zip_path.unlink() # Deletes the file represented by the Path object
+        return zip_path.parent
+
+    def get_download_size(self) -> int:
+        """The archive size in bytes from the GBIF download metadata (None if it isn't available)"""
+        try:
+            response = requests.get(self.meta_url, timeout=self.downloader.timeout)
+            response.raise_for_status()
+            return response.json().get("size")
+        except (requests.RequestException, ValueError) as e:
+            print(f"Could not get the download size ({e}), only the HTTP size will be checked")
+            return None
+
+    def create_partial_file_name(self) -> Path:
+        """<data_download_dir>/.partial/<download key>.zip, the RangedDownloader's .part files sit next to it"""
+        partial_dir = Path(self.data_download_dir) / self.PARTIAL_DIR
+        partial_dir.mkdir(parents=True, exist_ok=True)
+        return partial_dir / f"{self.download_key}.zip"
 
     def create_dated_file_name(self) -> str:
         """
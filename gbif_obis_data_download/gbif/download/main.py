@@ -1,7 +1,11 @@
 import argparse
 
-from gbif.download.gbif_download_manager import GbifDownloadManager
+from gbif.download.gbif_arctic_data_download_requester import GbifArcticDataDownloadRequester
+from gbif.download.gbif_download_orchestrator import GbifDownloadOrchestrator
 from gbif.download.gbif_download_unzipper import GbifDownloadUnzipper
+from gbif.download.ranged_downloader import RangedDownloader
+from download_registry.registry import DownloadRegistry
+from pathlib import Path
 
 if __name__ == "__main__":
 
@@ -10,7 +14,7 @@ if __name__ == "__main__":
         description = "GBIF login credentials to download data"
     )
     parser.add_argument(
-        '--gbif_user', 
+        '--gbif_user',
         type=str,
         help="Your GBIF user name."
     )
@@ -33,15 +37,133 @@ if __name__ == "__main__":
         help="The path to the directory you want your output data to be saved to."
     )
 
+    parser.add_argument(
+        '--keep_zip',
+        action='store_true',
+        help="Keep the download zip instead of extracting it (the parser reads the txt files straight from the zip)."
+    )
+
+    parser.add_argument(
+        '--segments',
+        type=int,
+        default=4,
+        help="Number of concurrent HTTP range requests the archive is downloaded with."
+    )
+
+    parser.add_argument(
+        '--buffer_mb',
+        type=int,
+        default=1,
+        help="Read buffer of each download stream in MB."
+    )
+
+    parser.add_argument(
+        '--download_keys',
+        nargs='+',
+        default=None,
+        help="Track, download and parse these existing download keys instead of requesting a new download "
+             "(e.g. after something happened to an earlier run)."
+    )
+
+    parser.add_argument(
+        '--api_url',
+        type=str,
+        default=GbifDownloadUnzipper.GBIF_API_URL,
+        help="The GBIF API base URL (e.g. a local stand-in server for testing)."
+    )
+
+    parser.add_argument(
+        '--skip_parse',
+        action='store_true',
+        help="Only download, don't run GbifOccurrenceParser on the downloads."
+    )
+
+    parser.add_argument(
+        '--lon_tiles',
+        type=int,
+        default=1,
+        help="Split the Arctic into this many longitude tiles, each requested, downloaded and parsed as its own archive. "
+             "GBIF only runs about 3 downloads per user at a time, so keep lon_tiles * lat_tiles to a few: "
+             "requests beyond that are retried as the running downloads finish, which can take hours."
+    )
+
+    parser.add_argument(
+        '--lat_tiles',
+        type=int,
+        default=1,
+        help="Split the Arctic into this many latitude tiles (see --lon_tiles)."
+    )
+
+    parser.add_argument(
+        '--modified_since',
+        type=str,
+        default=None,
+        help="Only request records modified since this date (YYYY-MM-DD) for an incremental pull. "
+             "The result isn't a full snapshot, so don't diff it against one."
+    )
+
+    parser.add_argument(
+        '--registry',
+        type=str,
+        default=None,
+        help="The download registry (SQLite) that lets reruns skip downloads that were already fetched and parsed. "
+             f"Defaults to <data_dir>/{DownloadRegistry.REGISTRY_FILE_NAME}."
+    )
+
+    parser.add_argument(
+        '--reuse_within_days',
+        type=float,
+        default=None,
+        help="Reuse a registered download of the same predicate from the last this many days instead of requesting a new one."
+    )
+
+    parser.add_argument(
+        '--keep_snapshots',
+        type=int,
+        default=None,
+        help="After the run, delete the registered GBIF snapshots (download days) beyond the newest this many."
+    )
+
+    parser.add_argument(
+        '--max_snapshot_age_days',
+        type=float,
+        default=None,
+        help="With --keep_snapshots, only delete the snapshots older than this many days."
+    )
+
     args = parser.parse_args()
-    
-    # Run entire Manager
-    # This initiates the download, checks the status and once it succeeds, downloads, and unzips
-    manager = GbifDownloadManager(gbif_user=args.gbif_user, 
-                                  gbif_notify_email=args.email,
-                                  gbif_pass=args.gbif_password,
-                                  data_download_dir=args.data_dir)
-
-    # Uncomment if something happens and just need to run the unzipper (add your download_key)
-    unzipper = GbifDownloadUnzipper(download_key=manager.download_key, data_download_dir=args.data_dir)
-    unzipper.download_and_unzip()
\ No newline at end of file
+
+    registry = DownloadRegistry(registry_file=args.registry or Path(args.data_dir) / DownloadRegistry.REGISTRY_FILE_NAME)
+
+    downloader = RangedDownloader(segments=args.segments, buffer_size=args.buffer_mb * 1024 * 1024)
+
+    download_keys = args.download_keys
+    if not download_keys:
+        # Initiates the download
+        requester = GbifArcticDataDownloadRequester(gbif_user=args.gbif_user,
+                                                    gbif_notify_email=args.email,
+                                                    gbif_pass=args.gbif_password,
+                                                    api_url=args.api_url,
+                                                    lon_tiles=args.lon_tiles,
+                                                    lat_tiles=args.lat_tiles,
+                                                    modified_since=args.modified_since,
+                                                    registry=registry,
+                                                    reuse_within_days=args.reuse_within_days)
+        download_keys = requester.download_keys
+
+    # Checks the status of every key, downloads each one as soon as it succeeds and parses it
+    orchestrator = GbifDownloadOrchestrator(data_download_dir=args.data_dir,
+                                            api_url=args.api_url,
+                                            downloader=downloader,
+                                            extract=not args.keep_zip,
+                                            parse=not args.skip_parse,
+                                            registry=registry)
+    results = orchestrator.run(download_keys=download_keys)
+
+    for download_key, result in results.items():
+        print(f"{download_key}: {result}")
+    if orchestrator.merged_outputs:
+        print(f"merged: {orchestrator.merged_outputs}")
+
+    if args.keep_snapshots is not None:
+        registry.garbage_collect(source=DownloadRegistry.GBIF, keep_last=args.keep_snapshots, max_age_days=args.max_snapshot_age_days)
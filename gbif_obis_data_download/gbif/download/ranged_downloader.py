@@ -0,0 +1,207 @@
+import hashlib
+import json
+import threading
+import time
+import requests
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+class RangedDownloader:
+    """
+    Downloads a (multi-GB) file as concurrent HTTP Range segments into a preallocated
+    <file>.part, then verifies it against the expected size/checksum before renaming it
+    into place.
+
+    Progress per segment is kept in <file>.part.json, so a dropped connection only retries
+    the missing bytes of that segment (with backoff) and a rerun after a crash resumes the
+    partial file instead of starting over. Servers that don't do ranges get one plain stream.
+    """
+
+    PART_SUFFIX = ".part"
+    STATE_SUFFIX = ".part.json"
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, segments: int = 4, buffer_size: int = 1024 * 1024, max_retries: int = 5,
+                 backoff_seconds: float = 2.0, timeout: int = 60, state_flush_bytes: int = 16 * 1024 * 1024):
+        """
+        segments is the number of concurrent Range requests. buffer_size is the read size of
+        each stream (and of the checksum). state_flush_bytes is how often a segment's progress
+        is saved to the state file.
+        """
+        self.segments = max(1, segments)
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+        self.state_flush_bytes = state_flush_bytes
+        self._state_lock = threading.Lock()
+
+    def download(self, url: str, output_file: str, expected_size: int = None, expected_checksum: str = None) -> Path:
+        """
+        Downloads url to output_file. expected_checksum is "<algorithm>:<hex digest>" (e.g.
+        "md5:9e10...") or a bare MD5 hex digest. Raises IOError if the file fails verification.
+        """
+        output_file = Path(output_file)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        part_file = output_file.with_name(output_file.name + self.PART_SUFFIX)
+        state_file = output_file.with_name(output_file.name + self.STATE_SUFFIX)
+
+        size, accepts_ranges = self.probe(url=url)
+        size = size or expected_size
+        if expected_size is not None and size is not None and size != expected_size:
+            raise IOError(f"{url} is {size:,} bytes, expected {expected_size:,}")
+
+        start_time = time.perf_counter()
+        if size is None or not accepts_ranges:
+            print(f"{url} doesn't support range requests, downloading as one stream")
+            resumed = 0
+            self.download_stream(url=url, part_file=part_file)
+        else:
+            state = self.load_state(state_file=state_file, part_file=part_file, url=url, size=size)
+            resumed = sum(done for _, _, done in state["segments"])
+            if resumed:
+                print(f"Resuming {part_file} ({resumed / 1e6:,.1f} of {size / 1e6:,.1f} MB already downloaded)")
+            self.download_segments(url=url, part_file=part_file, state_file=state_file, state=state)
+
+        elapsed = time.perf_counter() - start_time
+        downloaded = part_file.stat().st_size - resumed
+        print(f"Downloaded {downloaded / 1e6:,.1f} MB in {elapsed:,.1f} s ({downloaded / 1e6 / max(elapsed, 1e-9):,.1f} MB/s)")
+
+        try:
+            self.verify(part_file=part_file, expected_size=expected_size or size, expected_checksum=expected_checksum)
+        except IOError:
+            # A corrupt part file would otherwise be "resumed" (and fail) on every rerun
+            part_file.unlink(missing_ok=True)
+            state_file.unlink(missing_ok=True)
+            raise
+        part_file.replace(output_file)
+        state_file.unlink(missing_ok=True)
+        return output_file
+
+    def probe(self, url: str) -> tuple:
+        """(size or None, whether the server honours Range) from a one byte range request"""
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            if response.status_code == 206:
+                content_range = response.headers.get("Content-Range", "")
+                total = content_range.rsplit("/", 1)[-1]
+                return (int(total) if total.isdigit() else None), True
+
+            content_length = response.headers.get("Content-Length")
+            return (int(content_length) if content_length else None), False
+
+    def load_state(self, state_file: Path, part_file: Path, url: str, size: int) -> dict:
+        """
+        The saved segment progress if it belongs to this download, otherwise fresh segments
+        over a preallocated part file. Segments are [start, end (inclusive), bytes done].
+        """
+        if state_file.exists() and part_file.exists():
+            state = json.loads(state_file.read_text())
+            if state.get("size") == size and part_file.stat().st_size == size:
+                if state.get("url") != url:
+                    # GBIF redirects to signed URLs, the same size is the same archive
+                    state["url"] = url
+                return state
+
+        segment_size = -(-size // self.segments)
+        state = {
+            "url": url,
+            "size": size,
+            "segments": [[start, min(start + segment_size, size) - 1, 0] for start in range(0, size, segment_size)]
+        }
+        with open(part_file, "wb") as f:
+            f.truncate(size)
+        self.save_state(state_file=state_file, state=state)
+        return state
+
+    def save_state(self, state_file: Path, state: dict):
+        with self._state_lock:
+            tmp_file = state_file.with_suffix(".tmp")
+            tmp_file.write_text(json.dumps(state))
+            tmp_file.replace(state_file)
+
+    def download_segments(self, url: str, part_file: Path, state_file: Path, state: dict):
+        pending = [segment for segment in state["segments"] if segment[0] + segment[2] <= segment[1]]
+        if not pending:
+            return
+
+        with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            futures = [
+                executor.submit(self.download_segment, url=url, part_file=part_file, state_file=state_file, state=state, segment=segment)
+                for segment in pending
+            ]
+            for future in futures:
+                future.result()
+
+        self.save_state(state_file=state_file, state=state)
+
+    def download_segment(self, url: str, part_file: Path, state_file: Path, state: dict, segment: list):
+        """Streams one segment into its offset of the part file, retrying from the last written byte"""
+        start, end, _ = segment
+        attempt = 0
+
+        with requests.Session() as session, open(part_file, "r+b") as f:
+            while start + segment[2] <= end:
+                offset = start + segment[2]
+                try:
+                    with session.get(url, headers={"Range": f"bytes={offset}-{end}"}, stream=True, timeout=self.timeout) as response:
+                        if response.status_code != 206:
+                            raise requests.HTTPError(f"Range request for bytes {offset}-{end} returned {response.status_code}", response=response)
+
+                        f.seek(offset)
+                        unsaved = 0
+                        for chunk in response.iter_content(chunk_size=self.buffer_size):
+                            f.write(chunk)
+                            segment[2] += len(chunk)
+                            unsaved += len(chunk)
+                            if unsaved >= self.state_flush_bytes:
+                                f.flush()
+                                self.save_state(state_file=state_file, state=state)
+                                unsaved = 0
+                        f.flush()
+                        self.save_state(state_file=state_file, state=state)
+
+                    if start + segment[2] <= end:
+                        raise requests.ConnectionError(f"Connection closed at byte {start + segment[2]:,} of segment {start}-{end}")
+                    attempt = 0
+
+                except requests.RequestException as e:
+                    attempt += 1
+                    status_code = getattr(e.response, "status_code", None)
+                    if attempt > self.max_retries or (status_code is not None and status_code not in self.RETRY_STATUS_CODES):
+                        raise
+                    wait = self.backoff_seconds * 2 ** (attempt - 1)
+                    print(f"Segment {start}-{end} failed ({e}), retry {attempt}/{self.max_retries} in {wait:.0f} s")
+                    time.sleep(wait)
+
+    def download_stream(self, url: str, part_file: Path):
+        """Fallback for servers without ranges: one stream, retried from scratch"""
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                with requests.get(url, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    with open(part_file, "wb") as f:
+                        for chunk in response.iter_content(chunk_size=self.buffer_size):
+                            f.write(chunk)
+                return
+            except requests.RequestException as e:
+                if attempt > self.max_retries:
+                    raise
+                wait = self.backoff_seconds * 2 ** (attempt - 1)
+                print(f"Download failed ({e}), retry {attempt}/{self.max_retries} in {wait:.0f} s")
+                time.sleep(wait)
+
+    def verify(self, part_file: Path, expected_size: int = None, expected_checksum: str = None):
+        actual_size = part_file.stat().st_size
+        if expected_size is not None and actual_size != expected_size:
+            raise IOError(f"{part_file} is {actual_size:,} bytes, expected {expected_size:,}")
+
+        if expected_checksum:
+            algorithm, _, expected_digest = expected_checksum.rpartition(":")
+            digest = hashlib.new(algorithm or "md5")
+            with open(part_file, "rb") as f:
+                while chunk := f.read(self.buffer_size):
+                    digest.update(chunk)
+            if digest.hexdigest().lower() != expected_digest.lower():
+                raise IOError(f"{part_file} {digest.name} is {digest.hexdigest()}, expected {expected_digest}")
+            print(f"Verified {digest.name} checksum")
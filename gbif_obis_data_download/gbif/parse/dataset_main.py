@@ -0,0 +1,38 @@
+import argparse
+
+from gbif.parse.gbif_dataset_parser import GbifDatasetParser
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Flatten the dataset EML files of a GBIF download into the gbif_datasets_<date>.parquet metadata table"
+    )
+    parser.add_argument(
+        '--gbif_download_dir',
+        type=str,
+        required=True,
+        help="The dated download directory with the extracted dataset/ directory or the download zip."
+    )
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=None,
+        help="Number of processes parsing the dataset files. Defaults to the number of CPUs."
+    )
+    parser.add_argument(
+        '--load',
+        action='store_true',
+        help="Also upsert the table into the gbif_dataset database table (needs the repository root on PYTHONPATH and DATABASE_URL)."
+    )
+
+    args = parser.parse_args()
+
+    output_file = GbifDatasetParser(gbif_download_dir=args.gbif_download_dir, max_workers=args.max_workers).run()
+
+    if args.load:
+        from models import GbifDataset
+        from database import engine
+        from etl.etl_script import load_gbif_datasets
+
+        GbifDataset.__table__.create(bind=engine, checkfirst=True)
+        load_gbif_datasets(file_path=output_file)
@@ -0,0 +1,32 @@
+import argparse
+
+from gbif.parse.gbif_snapshot_differ import GbifSnapshotDiffer
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Diff a parsed GBIF snapshot against the previous one into added/changed/deleted parquet deltas"
+    )
+    parser.add_argument(
+        '--snapshot_dir',
+        type=str,
+        required=True,
+        help="The dated download directory with the new parquet files written by GbifOccurrenceParser."
+    )
+    parser.add_argument(
+        '--previous_snapshot_dir',
+        type=str,
+        default=None,
+        help="The snapshot to compare to. Defaults to the latest earlier dated directory next to snapshot_dir."
+    )
+    parser.add_argument(
+        '--buckets',
+        type=int,
+        default=64,
+        help="Number of source_id hash buckets the snapshots are compared in (more buckets, less memory)."
+    )
+
+    args = parser.parse_args()
+
+    differ = GbifSnapshotDiffer(snapshot_dir=args.snapshot_dir, previous_snapshot_dir=args.previous_snapshot_dir, n_buckets=args.buckets)
+    differ.diff()
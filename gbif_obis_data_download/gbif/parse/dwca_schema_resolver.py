@@ -0,0 +1,142 @@
+import csv
+import zipfile
+import polars as pl
+from lxml import etree
+from pathlib import Path
+
+class DwcaSchemaResolver:
+    """
+    Builds the typed read schema of a Darwin Core Archive's txt files from its meta.xml
+    (which term every column is) and the term types in dwc_term_types.csv, and casts the
+    string columns to those types leniently. Values that don't cast (a 'n/a' in depth, an
+    'unknown' in hasCoordinate) become null in the typed column and are kept in a separate
+    cast errors frame instead of failing the parse or leaving the whole column a string.
+    """
+
+    TERM_TYPES_CSV = Path(__file__).resolve().parent / "dwc_term_types.csv"
+    META_XML = "meta.xml"
+    DWCA_NAMESPACE = "{http://rs.tdwg.org/dwc/text/}"
+
+    POLARS_TYPES = {
+        "int64": pl.Int64,
+        "uint16": pl.UInt16,
+        "uint8": pl.UInt8,
+        "float64": pl.Float64,
+        "boolean": pl.Boolean,
+        "datetime": pl.Datetime("us")
+    }
+
+    BOOLEAN_VALUES = {"true": True, "false": False, "t": True, "f": False, "1": True, "0": False, "yes": True, "no": False}
+
+    # ISO 8601 forms GBIF writes, tried in order
+    DATETIME_FORMATS = ["%Y-%m-%dT%H:%M:%S%.fZ", "%Y-%m-%dT%H:%M:%S%.f", "%Y-%m-%dT%H:%MZ", "%Y-%m-%dT%H:%M", "%Y-%m-%d"]
+    DATETIME_OFFSET_FORMAT = "%Y-%m-%dT%H:%M:%S%.f%:z"
+
+    # Cast errors columns
+    FILE = "file"
+    COLUMN = "column"
+    VALUE = "value"
+
+    def __init__(self, dwca_path: str):
+        """
+        dwca_path is the extracted archive directory or the download zip
+        """
+        self.dwca_path = Path(dwca_path)
+        self.term_types = self.read_term_types()
+        self.file_terms = self.read_meta_xml()
+
+    def read_term_types(self) -> dict:
+        """{term: polars type} for the terms that aren't strings"""
+        with open(self.TERM_TYPES_CSV) as f:
+            return {row["term"]: self.POLARS_TYPES[row["type"]] for row in csv.DictReader(f)}
+
+    def read_meta_xml(self) -> dict:
+        """
+        {txt file name: [term name of each column in index order]} for the core and every
+        extension in meta.xml. Empty if the archive has no meta.xml, then the column names
+        are taken as the terms.
+        """
+        if self.dwca_path.suffix == ".zip":
+            with zipfile.ZipFile(self.dwca_path) as zip_file:
+                name = next((n for n in zip_file.namelist() if Path(n).name == self.META_XML), None)
+                meta_xml = zip_file.read(name) if name else None
+        else:
+            meta_file = next(self.dwca_path.rglob(self.META_XML), None)
+            meta_xml = meta_file.read_bytes() if meta_file else None
+
+        if meta_xml is None:
+            print(f"No {self.META_XML} found in {self.dwca_path}, typing columns by name")
+            return {}
+
+        file_terms = {}
+        root = etree.fromstring(meta_xml)
+        for section in root:
+            location = section.find(f"{self.DWCA_NAMESPACE}files/{self.DWCA_NAMESPACE}location")
+            if location is None:
+                continue
+            fields = {int(field.get("index")): field.get("term").rstrip("/").split("/")[-1]
+                      for field in section.iter(f"{self.DWCA_NAMESPACE}field") if field.get("index") is not None}
+            file_terms[Path(location.text.strip()).name] = [fields[i] for i in sorted(fields)]
+
+        return file_terms
+
+    def resolve(self, file_name: str, columns: list) -> dict:
+        """
+        {column: polars type} for the columns of the txt file that have a non-string term type.
+        The header names are matched to the meta.xml terms by position.
+        """
+        terms = self.file_terms.get(file_name)
+        if terms is None or len(terms) != len(columns):
+            terms = columns
+
+        return {column: self.term_types[term] for column, term in zip(columns, terms) if term in self.term_types}
+
+    def cast_expr(self, column: str, dtype) -> pl.Expr:
+        """Lenient (null on failure) vectorized cast of a string column"""
+        values = pl.col(column).str.strip_chars()
+
+        if dtype == pl.Boolean:
+            return values.str.to_lowercase().replace_strict(self.BOOLEAN_VALUES, default=None, return_dtype=pl.Boolean)
+
+        if isinstance(dtype, pl.Datetime):
+            with_offset = (
+                values.str.to_datetime(format=self.DATETIME_OFFSET_FORMAT, strict=False, time_unit="us")
+                .dt.convert_time_zone("UTC").dt.replace_time_zone(None)
+            )
+            return pl.coalesce([values.str.to_datetime(format=f, strict=False, time_unit="us") for f in self.DATETIME_FORMATS] + [with_offset])
+
+        if dtype.is_integer():
+            # GBIF sometimes writes whole numbers as 2019.0
+            return pl.coalesce([values.cast(dtype, strict=False), values.cast(pl.Float64, strict=False).cast(dtype, strict=False)])
+
+        return values.cast(dtype, strict=False)
+
+    def cast_lf(self, lf: pl.LazyFrame, file_name: str, id_column: str) -> tuple:
+        """
+        Returns (typed lazy frame, cast errors lazy frame). The cast errors frame has the
+        file, the id_column value, the column and the value that didn't cast.
+        """
+        columns = lf.collect_schema().names()
+        schema = self.resolve(file_name=file_name, columns=columns)
+        if not schema:
+            return lf, None
+
+        typed_lf = lf.with_columns([self.cast_expr(column, dtype).alias(column) for column, dtype in schema.items()])
+
+        errors_lf = (
+            lf.select([
+                pl.col(id_column),
+                *[
+                    pl.when((pl.col(column).str.strip_chars().str.len_chars() > 0) & self.cast_expr(column, dtype).is_null())
+                    .then(pl.col(column))
+                    .alias(column)
+                    for column, dtype in schema.items()
+                ]
+            ])
+            .unpivot(index=id_column, variable_name=self.COLUMN, value_name=self.VALUE)
+            .drop_nulls(self.VALUE)
+            .with_columns(pl.lit(file_name).alias(self.FILE))
+            .select([self.FILE, id_column, self.COLUMN, self.VALUE])
+        )
+
+        return typed_lf, errors_lf
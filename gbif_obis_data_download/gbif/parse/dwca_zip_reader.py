@@ -0,0 +1,96 @@
+import hashlib
+import shutil
+import zipfile
+import polars as pl
+import pyarrow as pa
+import pyarrow.csv as pv
+from dataclasses import dataclass
+from pathlib import Path
+from polars.io.plugins import register_io_source
+
+@dataclass(frozen=True)
+class ZipMember:
+    """A txt file inside a Darwin Core Archive zip"""
+    zip_path: Path
+    name: str
+
+    @property
+    def file_size(self) -> int:
+        """Uncompressed size in bytes"""
+        with zipfile.ZipFile(self.zip_path) as zip_file:
+            return zip_file.getinfo(self.name).file_size
+
+    @property
+    def compressed_size(self) -> int:
+        with zipfile.ZipFile(self.zip_path) as zip_file:
+            return zip_file.getinfo(self.name).compress_size
+
+def find_zip_member(zip_path: Path, file_name: str) -> ZipMember:
+    """The member whose file name (ignoring folders) is file_name, or None"""
+    with zipfile.ZipFile(zip_path) as zip_file:
+        name = next((n for n in zip_file.namelist() if Path(n).name == file_name), None)
+    return ZipMember(zip_path=Path(zip_path), name=name) if name else None
+
+def read_member_header(member: ZipMember, separator: str = "\t") -> list:
+    with zipfile.ZipFile(member.zip_path) as zip_file, zip_file.open(member.name) as f:
+        return f.readline().decode("utf-8").rstrip("\r\n").split(separator)
+
+def scan_zip_member(member: ZipMember, separator: str = "\t", block_size: int = 64 * 1024 * 1024) -> pl.LazyFrame:
+    """
+    Lazily scans a tab separated archive member straight out of the zip (nothing is
+    extracted to disk). Like the parser's scan_csv every column is a string, quotes are
+    literal characters and empty values are null. Decompression and tokenizing happen
+    in pyarrow's streaming csv reader (outside the GIL), one block at a time, so each
+    member in a combined plan is read in parallel with the others.
+    """
+    column_names = read_member_header(member=member, separator=separator)
+    schema = {name: pl.String for name in column_names}
+
+    def source(with_columns: list, predicate: pl.Expr, n_rows: int, batch_size: int):
+        convert_options = pv.ConvertOptions(
+            column_types={name: pa.string() for name in column_names},
+            include_columns=with_columns,
+            null_values=[""],
+            strings_can_be_null=True
+        )
+        rows_left = n_rows
+        with zipfile.ZipFile(member.zip_path) as zip_file, zip_file.open(member.name) as f:
+            reader = pv.open_csv(
+                f,
+                read_options=pv.ReadOptions(block_size=block_size, use_threads=True),
+                parse_options=pv.ParseOptions(delimiter=separator, quote_char=False, double_quote=False),
+                convert_options=convert_options
+            )
+            for batch in reader:
+                df = pl.from_arrow(batch)
+                if predicate is not None:
+                    df = df.filter(predicate)
+                if rows_left is not None:
+                    df = df.head(rows_left)
+                    rows_left -= df.height
+                yield df
+                if rows_left is not None and rows_left <= 0:
+                    break
+
+    return register_io_source(io_source=source, schema=schema, is_pure=True, explain_name="dwca_zip", explain_detail=f"{member.zip_path.name}:{member.name}")
+
+def cache_zip_member(member: ZipMember, cache_dir: str) -> Path:
+    """
+    Decompresses the member once into the cache directory and returns the cached txt
+    file. The cache key is the archive's path, size and modified time so a new download
+    never reuses an old member. Later runs (and scan_csv's parallel reader) use the
+    cached file instead of decompressing again.
+    """
+    stat = member.zip_path.stat()
+    key = hashlib.sha256(f"{member.zip_path.resolve()}|{stat.st_size}|{int(stat.st_mtime)}|{member.name}".encode()).hexdigest()[:16]
+    cached_file = Path(cache_dir) / key / Path(member.name).name
+
+    if not cached_file.exists():
+        cached_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cached_file.with_suffix(".tmp")
+        with zipfile.ZipFile(member.zip_path) as zip_file, zip_file.open(member.name) as src, open(tmp_file, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=16 * 1024 * 1024)
+        tmp_file.replace(cached_file)
+        print(f"Cached {member.name} from {member.zip_path.name} in {cached_file}")
+
+    return cached_file
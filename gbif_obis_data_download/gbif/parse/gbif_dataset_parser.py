@@ -1,23 +1,228 @@
+import os
+import zipfile
+import calendar
+import polars as pl
 from lxml import etree
-from collections import Counter
+from datetime import date, datetime
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from gbif.parse.dwca_zip_reader import ZipMember
 
-# class gbifDatasetParser:
+class GbifDatasetParser:
+    """
+    Flattens the dataset EML files of a GBIF download (dataset/<datasetKey>.xml) into one
+    dataset metadata table keyed by datasetKey (title, publisher, license, citation, bounding
+    box and temporal coverage), so occurrences can be joined to their dataset's metadata
+    without any XML work at query time.
 
-#     def __init__(self)
+    Every file is streamed with iterparse and each top level section is cleared once its
+    fields are read. The taxonomic coverage (never read, and it can be huge) is cleared as its
+    elements end, so it's never held whole inside its coverage section. The files are spread
+    over a process pool.
+    """
 
-dataset_xml_dir = Path("/home/mule-external/sci-dig/arctic_toolkit/gbif/2026-01-26/dataset")
+    DATASET_DIR = "dataset"
+    DATASET_KEY = "datasetKey"
+    DOI_PREFIXES = ("doi:", "https://doi.org/", "http://doi.org/", "http://dx.doi.org/", "10.")
 
+    # Parent sections that are cleared after they end (children of eml/dataset and of the GBIF additionalMetadata)
+    SECTION_PARENTS = ("dataset", "gbif")
+    # Unread (possibly huge, nested) elements inside coverage that are cleared as they end
+    TAXONOMIC_TAGS = ("taxonomicCoverage", "taxonomicClassification")
 
-def see_how_to_flatten():
-    """Get the lay of the land and see what is top level, what is nested"""
-    tag_counts = Counter()
+    SCHEMA = {
+        DATASET_KEY: pl.Utf8,
+        "title": pl.Utf8,
+        "publisher": pl.Utf8,
+        "license": pl.Utf8,
+        "licenseUrl": pl.Utf8,
+        "citation": pl.Utf8,
+        "doi": pl.Utf8,
+        "pubDate": pl.Date,
+        "language": pl.Utf8,
+        "westBoundingCoordinate": pl.Float64,
+        "eastBoundingCoordinate": pl.Float64,
+        "northBoundingCoordinate": pl.Float64,
+        "southBoundingCoordinate": pl.Float64,
+        "beginDate": pl.Date,
+        "endDate": pl.Date
+    }
 
-    for xml_file in dataset_xml_dir.glob("*.xml"):
-        tree = etree.parse(xml_file)
-        for el in tree.iter():
-            tag = el.tag.split('}')[-1]
-            tag_counts[tag] += 1
+    def __init__(self, gbif_download_dir: str, max_workers: int = None):
+        """
+        gbif_download_dir has either the extracted dataset/ directory or the download zip.
+        max_workers defaults to the number of CPUs.
+        """
+        self.gbif_download_dir = Path(gbif_download_dir)
+        self.max_workers = max_workers or os.cpu_count()
+        self.dataset_xml_files = self.find_dataset_xml_files()
 
-    for tag, count in tag_counts.most_common(50):
-        print(f"{tag}: {count}")
\ No newline at end of file
+    def find_dataset_xml_files(self) -> list:
+        """The dataset/*.xml files, or the zip members under dataset/ if the download wasn't extracted"""
+        xml_files = sorted(self.gbif_download_dir.rglob(f"{self.DATASET_DIR}/*.xml"))
+        if xml_files:
+            return xml_files
+
+        zip_path = next(self.gbif_download_dir.rglob("*.zip"), None)
+        if zip_path is None:
+            return []
+
+        with zipfile.ZipFile(zip_path) as zip_file:
+            return [ZipMember(zip_path=zip_path, name=name) for name in sorted(zip_file.namelist())
+                    if Path(name).parent.name == self.DATASET_DIR and name.endswith(".xml")]
+
+    def run(self) -> str:
+        """Parses every dataset file and writes the table to parquet. Returns the parquet file."""
+        df = self.parse()
+        output_file = self._construct_file_parquet_file_path(file_prefix="gbif_datasets")
+        df.write_parquet(output_file, compression="zstd", compression_level=3, statistics=True)
+        print(f"Wrote {df.height:,} datasets to {output_file}")
+        return output_file
+
+    def parse(self) -> pl.DataFrame:
+        print(f"Parsing {len(self.dataset_xml_files):,} dataset files with {self.max_workers} processes")
+        chunksize = max(1, len(self.dataset_xml_files) // (self.max_workers * 4))
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            records = list(executor.map(self.parse_dataset_xml, self.dataset_xml_files, chunksize=chunksize))
+
+        return pl.DataFrame([r for r in records if r is not None], schema=self.SCHEMA, orient="row")
+
+    @classmethod
+    def parse_dataset_xml(cls, xml_file) -> dict:
+        """
+        One dataset's row. xml_file is a path or a ZipMember. The datasetKey is the file
+        name (GBIF names the files by it). Files that can't be parsed are skipped (None).
+        """
+        name = xml_file.name if isinstance(xml_file, ZipMember) else str(xml_file)
+        record = {column: None for column in cls.SCHEMA}
+        record[cls.DATASET_KEY] = Path(name).stem
+        coverage = {"west": [], "east": [], "north": [], "south": [], "begin": [], "end": []}
+
+        try:
+            if isinstance(xml_file, ZipMember):
+                with zipfile.ZipFile(xml_file.zip_path) as zip_file, zip_file.open(xml_file.name) as f:
+                    cls.read_sections(source=f, record=record, coverage=coverage)
+            else:
+                cls.read_sections(source=str(xml_file), record=record, coverage=coverage)
+        except etree.XMLSyntaxError as e:
+            print(f"Skipping {name}: {e}")
+            return None
+
+        record["westBoundingCoordinate"] = min(coverage["west"], default=None)
+        record["eastBoundingCoordinate"] = max(coverage["east"], default=None)
+        record["northBoundingCoordinate"] = max(coverage["north"], default=None)
+        record["southBoundingCoordinate"] = min(coverage["south"], default=None)
+        record["beginDate"] = min(coverage["begin"], default=None)
+        record["endDate"] = max(coverage["end"], default=None)
+        record["pubDate"] = cls.parse_calendar_date(record["pubDate"])
+        return record
+
+    @classmethod
+    def read_sections(cls, source, record: dict, coverage: dict):
+        """
+        Streams the EML and fills the record (and the coverage lists) from each top level
+        section when it ends, then clears it and drops the already read siblings.
+        """
+        for _, element in etree.iterparse(source, events=("end",), recover=True, huge_tree=True, remove_comments=True):
+            parent = element.getparent()
+            tag = etree.QName(element).localname
+            if tag in cls.TAXONOMIC_TAGS:
+                # Only the previous (already cleared) taxonomic sibling is dropped, coverage's
+                # geographic and temporal siblings are read when coverage ends
+                element.clear(keep_tail=True)
+                previous = element.getprevious()
+                if previous is not None and etree.QName(previous).localname == tag:
+                    parent.remove(previous)
+                continue
+            if parent is None or etree.QName(parent).localname not in cls.SECTION_PARENTS:
+                continue
+
+            cls.read_section(section=element, tag=tag, record=record, coverage=coverage)
+
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del parent[0]
+
+    @classmethod
+    def read_section(cls, section, tag: str, record: dict, coverage: dict):
+        if tag == "title" and record["title"] is None:
+            record["title"] = cls.text(section)
+        elif tag == "publisher":
+            record["publisher"] = cls.child_text(section, "organizationName") or cls.text(section)
+        elif tag == "creator" and record["publisher"] is None:
+            # Falls back on the creating organization when there's no publisher
+            record["publisher"] = cls.child_text(section, "organizationName")
+        elif tag == "pubDate":
+            record["pubDate"] = cls.text(section)
+        elif tag == "language" and record["language"] is None:
+            record["language"] = cls.text(section)
+        elif tag == "alternateIdentifier" and record["doi"] is None:
+            identifier = cls.text(section) or ""
+            if identifier.lower().startswith(cls.DOI_PREFIXES):
+                record["doi"] = identifier
+        elif tag == "intellectualRights":
+            record["license"] = cls.child_text(section, "citetitle") or cls.text(section)
+            record["licenseUrl"] = next((el.get("url") for el in section.iter() if etree.QName(el).localname == "ulink"), None)
+        elif tag == "citation":
+            record["citation"] = cls.text(section)
+        elif tag == "coverage":
+            cls.read_coverage(section=section, coverage=coverage)
+
+    @classmethod
+    def read_coverage(cls, section, coverage: dict):
+        """Bounding coordinates and dates of every geographic and temporal coverage"""
+        for element in section.iter():
+            tag = etree.QName(element).localname
+            if tag.endswith("BoundingCoordinate"):
+                try:
+                    coverage[tag.removesuffix("BoundingCoordinate")].append(float(cls.text(element)))
+                except (TypeError, ValueError):
+                    pass
+            elif tag in ("beginDate", "endDate", "singleDateTime"):
+                calendar_date = cls.child_text(element, "calendarDate")
+                if tag in ("beginDate", "singleDateTime"):
+                    coverage["begin"].append(cls.parse_calendar_date(calendar_date))
+                if tag in ("endDate", "singleDateTime"):
+                    coverage["end"].append(cls.parse_calendar_date(calendar_date, end=True))
+
+        for key in ("begin", "end"):
+            coverage[key] = [d for d in coverage[key] if d is not None]
+
+    @staticmethod
+    def text(element) -> str:
+        """All of the element's text (including its children's), whitespace collapsed"""
+        text = " ".join("".join(element.itertext()).split())
+        return text or None
+
+    @classmethod
+    def child_text(cls, element, tag: str) -> str:
+        child = next((el for el in element.iter() if etree.QName(el).localname == tag), None)
+        return cls.text(child) if child is not None else None
+
+    @staticmethod
+    def parse_calendar_date(value: str, end: bool = False) -> date:
+        """
+        EML calendarDate (YYYY, YYYY-MM, YYYY-MM-DD, optionally with a time) to a date.
+        Partial dates are the start of the period, or the end of it when end is True.
+        """
+        if not value:
+            return None
+        value = value.strip()[:10]
+        try:
+            if len(value) == 4:
+                return date(int(value), 12, 31) if end else date(int(value), 1, 1)
+            if len(value) == 7:
+                year, month = int(value[:4]), int(value[5:7])
+                return date(year, month, calendar.monthrange(year, month)[1] if end else 1)
+            return datetime.strptime(value, "%Y-%m-%d").date()
+        except ValueError:
+            return None
+
+    def _construct_file_parquet_file_path(self, file_prefix: str) -> str:
+        """"
+        Constructs the file path to save the data to, given the
+        data directory and the file_name
+        """
+        today = datetime.now().strftime("%Y-%m-%d")
+        file_path = self.gbif_download_dir / f"{file_prefix}_{today}.parquet"
+        return str(file_path)
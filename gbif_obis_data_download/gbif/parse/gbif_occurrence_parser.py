@@ -1,10 +1,13 @@
 import polars as pl
+import polars_hash as plh
+from gbif.parse.dwca_zip_reader import ZipMember, find_zip_member, scan_zip_member, cache_zip_member
+from gbif.parse.dwca_schema_resolver import DwcaSchemaResolver
+from parquet_layout.parquet_layout_policy import ParquetLayoutPolicy, ParquetLayoutWriter
 from pathlib import Path
 from datetime import datetime
-import hashlib
+import time
 
 # TODO: Look into columns to drop (that aren't needed) - like lastParsed?
-# TODO: Finish writing the pivot_mof_measurment_df function when mof cols are correct (GBIF issue filed)
 # TODO: Load parquet file into ERDDAP and inspect.
 # TODO: Add citation column with "GBIF.org (13 November 2025) GBIF Occurrence Download https://doi.org/10.15468/dl.eta6v7"
 
@@ -28,110 +31,204 @@ class GbifOccurrenceParser:
     MEASUREMENT_TYPE = "measurementtype"
     MEASUREMENT_VALUE = "measurementvalue"
 
-    occ_non_str_schema_dtypes = { # Specified data types of columns in the occurrence records that aren't strings
-        "modified": pl.Datetime,
-        "individualCount": pl.Int64,
-        "year": pl.UInt16,
-        "month": pl.UInt8,
-        "day": pl.UInt8,
-        "decimalLatitude": pl.Float64,
-        "decimalLongitude": pl.Float64,
-        "coordinateUncertaintyInMeters": pl.Float64,
-        "coordinatePrecision": pl.Float64,
-        "dateIdentified": pl.Datetime,
-        "lastInterpreted": pl.Datetime,
-        "elevation": pl.Float64,
-        "elevationAccuracy": pl.Float64,
-        "depth": pl.Float64,
-        "distanceFromCentroidInMeters": pl.Float64,
-        # "hasCoordinate": pl.Boolean, # Did not work casting from str to boolean
-        # "hasGeospatialIssues": pl.Boolean,
-        "taxonKey": pl.Int64,
-        "acceptedTaxonKey": pl.Int64,
-        "kingdomKey": pl.Int64,
-        "phylumKey": pl.Int64, 
-        "classKey": pl.Int64,
-        "orderKey": pl.Int64,
-        "familyKey": pl.Int64, 
-        "genusKey": pl.Int64,
-        "subgenusKey": pl.Int64,
-        "speciesKey": pl.Int64,
-        "lastParsed": pl.Datetime,
-        "lastCrawled": pl.Datetime
+    OCCURRENCE_TXT = "occurrence.txt"
+    DNA_TXT = "gbif_dnaderiveddata.txt"
+    MOF_TXT = "obis_extendedmeasurementorfact.txt"
+
+    # Parser outputs (the stages run() can be limited to) and their file prefixes
+    OCCURRENCE = "occurrence"
+    DNA_DERIVED = "dna_derived"
+    MOF = "mof"
+    CAST_ERRORS = "cast_errors"
+    STAGE_FILE_PREFIXES = {
+        OCCURRENCE: "arctic_occurences",
+        DNA_DERIVED: "arctic_dna_derived",
+        MOF: "arctic_mof",
+        CAST_ERRORS: "gbif_cast_errors"
     }
 
-    def __init__(self, gbif_download_dir: str):
+    # Sinks run() writes the stages to (besides a function)
+    PARQUET_SINK = "parquet"
+    IPC_SINK = "ipc"
 
+    def __init__(self, gbif_download_dir: str, decompression_cache_dir: str = None, parquet_layout: ParquetLayoutPolicy = None):
+        """
+        gbif_download_dir has either the extracted txt files or the download zip (see
+        GbifDownloadUnzipper's extract=False). Zip members are streamed straight out of the
+        archive unless decompression_cache_dir is given, then each member is decompressed
+        there once and reused by later runs. The parquet files are written with parquet_layout
+        (the shared ParquetLayoutPolicy defaults). Nothing is parsed until run() (or a frame from
+        lazy_frames() is collected).
+        """
         self.gbif_download_dir = Path(gbif_download_dir)
+        self.decompression_cache_dir = decompression_cache_dir
+        self.parquet_layout = parquet_layout or ParquetLayoutPolicy()
+        self.parquet_writers = [] # lazy sinks' writers, closed once the combined plan has run
         self.occurrence_txt_file, self.dna_txt_file, self.mof_txt_file  = self.find_occurrence_txt_files()
-        self.output_file_name = self.gbif_download_dir / f"{self.gbif_download_dir.name}.parquet"
-        self.occurrence_df = self.transform_gbif_df()
+        # Column types come from the archive's meta.xml and the DwC term types (see dwc_term_types.csv)
+        dwca_path = self.occurrence_txt_file.zip_path if isinstance(self.occurrence_txt_file, ZipMember) else self.gbif_download_dir
+        self.schema_resolver = DwcaSchemaResolver(dwca_path=dwca_path)
+        self.stage_lfs = None # built by lazy_frames()
 
-    def transform_gbif_df(self) -> pl.DataFrame:
+    def lazy_frames(self) -> dict:
         """
-        The orchestrator function to transform the GBIF data occurrence frame to the final 
-        desired data frame. Also for dna_derived df to a parquet file and mof df to a parquet file. 
+        Builds the lazy frames of the parser outputs, {stage: lazy frame}. Nothing is read
+        until a frame is collected or sunk, and each frame only reads the txt files it needs
+        (the occurrence frame reads all three for its dna_derived and has_mof flags). The
+        extension scans are cached because they feed both the occurrence join and their own
+        output, so when stages run together each txt file is read once.
         """
+        if self.stage_lfs is not None:
+            return self.stage_lfs
 
         # 1. Load original df
         original_df = self.read_txt_file_to_df(txt_file=self.occurrence_txt_file)
 
         # Update column data types
-        # Change data types for not string columns. Was running into polars column data types inferences.
-        original_df = original_df.with_columns([
-            pl.col(col_name).cast(dtype) for col_name, dtype in self.occ_non_str_schema_dtypes.items()
-        ])
+        # Typed from meta.xml instead of polars' inference. Values that don't cast are saved to the cast errors parquet file
+        original_df, occ_cast_errors = self.schema_resolver.cast_lf(lf=original_df, file_name=self.OCCURRENCE_TXT, id_column=self.OCC_FILE_OCCURRENCE_ID)
 
         # 2. Add a data_source column with "GBIF" as value
         gbif_added_df=self.add_column_and_val_to_df(df=original_df, column_name="data_source", value="gbif")
 
         # 3. Add dna_exists by joining with dna_df and checking if occurrence_id exists in it
-        dna_df = self.read_txt_file_to_df(txt_file=self.dna_txt_file)
+        dna_df = self.read_txt_file_to_df(txt_file=self.dna_txt_file).cache()
+        dna_df, dna_cast_errors = self.schema_resolver.cast_lf(lf=dna_df, file_name=self.DNA_TXT, id_column=self.DNA_FILE_OCCURRENCE_ID)
         final_dna_df = self.add_column_and_val_to_df(df=dna_df, column_name="data_source", value="gbif")
         occ_dna_updated_df = self.add_extension_exists_bool_to_occ_df(occ_df=gbif_added_df, ext_df=dna_df, bool_col_name="dna_derived", ext_file_occurid=self.DNA_FILE_OCCURRENCE_ID)
 
         # 4. has_mof by joining with mof_df and checking if occurence_id exists
-        mof_df = self.read_txt_file_to_df(txt_file=self.mof_txt_file)
+        mof_df = self.read_txt_file_to_df(txt_file=self.mof_txt_file).cache()
+        mof_df, mof_cast_errors = self.schema_resolver.cast_lf(lf=mof_df, file_name=self.MOF_TXT, id_column=self.MOF_FILE_OCCURRENCE_ID)
         final_mof_df = self.add_column_and_val_to_df(df=mof_df, column_name="data_source", value="gbif")
         occ_mof_updated_df = self.add_extension_exists_bool_to_occ_df(occ_df=occ_dna_updated_df, ext_df=final_mof_df, bool_col_name="has_mof", ext_file_occurid=self.MOF_FILE_OCCURRENCE_ID)
 
-        # 5. Edit OCC file identifiers and save OCC to parquet file
+        # 5. Edit OCC file identifiers (occurrence stage)
         occ_source_id_col_updated = self.rename_gbif_id_to_occurrence_source_id(df=occ_mof_updated_df, col_to_rename=self.OCC_FILE_OCCURRENCE_ID, desired_col_name=self.SOURCE_ID)
-        occ_file_name = self._construct_file_parquet_file_path(file_prefix="arctic_occurences")
-        self.write_to_parquet(df=occ_source_id_col_updated, output_file_name=occ_file_name)
 
-        # 6. Edit DNA derived identifiers and save DNA derived to parquet file
+        # 6. Edit DNA derived identifiers (dna_derived stage)
         dna_source_id_hashed = self.create_hashed_source_id(df=final_dna_df, cols_to_hash=[self.DNA_FILE_OCCURRENCE_ID, self.DNA_OCCURRENCEID, self.PCR_PRIMER_FORWARD, self.PCR_PRIMER_REVERSE])
         dna_occ_source_id_col_updated = self.rename_gbif_id_to_occurrence_source_id(df=dna_source_id_hashed, col_to_rename=self.DNA_FILE_OCCURRENCE_ID, desired_col_name=self.OCCURRENCE_SOURCE_ID)
-        dna_file_name = self._construct_file_parquet_file_path(file_prefix="arctic_dna_derived")
-        self.write_to_parquet(df=dna_occ_source_id_col_updated, output_file_name=dna_file_name)
 
-        # 7.Edit MOF identifiers and save Measurement of Fact to parquet file
+        # 7.Edit MOF identifiers (mof stage)
         mof_source_id_hashed = self.create_hashed_source_id(df=final_mof_df, cols_to_hash=[self.MOF_FILE_OCCURRENCE_ID, self.MOF_OCCURENCEID, self.MEASUREMENT_TYPE, self.MEASUREMENT_VALUE])
         mof_occ_source_id_col_updated = self.rename_gbif_id_to_occurrence_source_id(df=mof_source_id_hashed, col_to_rename=self.MOF_FILE_OCCURRENCE_ID, desired_col_name=self.OCCURRENCE_SOURCE_ID)
-        mof_file_name = self._construct_file_parquet_file_path(file_prefix="arctic_mof")
-        self.write_to_parquet(df=mof_occ_source_id_col_updated, output_file_name=mof_file_name)
-      
-        return  occ_source_id_col_updated
+
+        # 8. Values that didn't cast to their column's type (cast_errors stage)
+        cast_errors = [errors.rename({id_col: "gbifid"}) for errors, id_col in ((occ_cast_errors, self.OCC_FILE_OCCURRENCE_ID), (dna_cast_errors, self.DNA_FILE_OCCURRENCE_ID), (mof_cast_errors, self.MOF_FILE_OCCURRENCE_ID)) if errors is not None]
+        cast_errors_df = pl.concat(cast_errors) if cast_errors else pl.LazyFrame(schema={
+            DwcaSchemaResolver.FILE: pl.Utf8, "gbifid": pl.Utf8, DwcaSchemaResolver.COLUMN: pl.Utf8, DwcaSchemaResolver.VALUE: pl.Utf8
+        })
+
+        self.stage_lfs = {
+            self.OCCURRENCE: occ_source_id_col_updated,
+            self.DNA_DERIVED: dna_occ_source_id_col_updated,
+            self.MOF: mof_occ_source_id_col_updated,
+            self.CAST_ERRORS: cast_errors_df
+        }
+        return self.stage_lfs
+
+    def run(self, stages: list = None, sink = PARQUET_SINK) -> dict:
+        """
+        Runs the selected stages (all of them by default) into the sink. sink is "parquet"
+        (the shared parquet layout), "ipc" (Arrow IPC files) or a function that's called with
+        (stage, lazy frame) for every stage, e.g. a handoff to the ETL's load_lazy_df_streaming.
+        The parquet and IPC stages are written in a single execution so the txt files they
+        share are read once. Returns {stage: output file} (or {stage: what the function returned}).
+        """
+        stages = stages or list(self.STAGE_FILE_PREFIXES)
+        unknown_stages = [stage for stage in stages if stage not in self.STAGE_FILE_PREFIXES]
+        if unknown_stages:
+            raise ValueError(f"Unknown stages {unknown_stages}, expected some of {list(self.STAGE_FILE_PREFIXES)}")
+        if not callable(sink) and sink not in (self.PARQUET_SINK, self.IPC_SINK):
+            raise ValueError(f"Unknown sink {sink}, expected {self.PARQUET_SINK}, {self.IPC_SINK} or a function")
+
+        start_time = time.perf_counter()
+        lazy_frames = self.lazy_frames()
+
+        if callable(sink):
+            return {stage: sink(stage, lazy_frames[stage]) for stage in stages}
+
+        outputs = {}
+        sinks = []
+        for stage in stages:
+            if sink == self.PARQUET_SINK:
+                outputs[stage] = self._construct_file_parquet_file_path(file_prefix=self.STAGE_FILE_PREFIXES[stage])
+                sinks.append(self.write_to_parquet(df=lazy_frames[stage], output_file_name=outputs[stage], lazy=True))
+            else:
+                outputs[stage] = self._construct_file_parquet_file_path(file_prefix=self.STAGE_FILE_PREFIXES[stage], extension="arrow")
+                sinks.append(self.write_to_ipc(df=lazy_frames[stage], output_file_name=outputs[stage], lazy=True))
+
+        # Run all the sinks in one execution
+        plan_time = time.perf_counter()
+        pl.collect_all(sinks, engine="streaming")
+        for writer in self.parquet_writers:
+            writer.close()
+        self.parquet_writers = []
+        end_time = time.perf_counter()
+
+        self.print_run_timings(plan_seconds=plan_time - start_time, execute_seconds=end_time - plan_time, txt_files=self.stage_txt_files(stages=stages))
+
+        return outputs
+
+    def stage_txt_files(self, stages: list) -> list:
+        """The input txt files the stages read"""
+        all_files = [self.occurrence_txt_file, self.dna_txt_file, self.mof_txt_file]
+        stage_files = {
+            self.OCCURRENCE: all_files,
+            self.DNA_DERIVED: [self.dna_txt_file],
+            self.MOF: [self.mof_txt_file],
+            self.CAST_ERRORS: all_files
+        }
+        return [f for f in all_files if any(f in stage_files[stage] for stage in stages)]
+
+    def print_run_timings(self, plan_seconds: float, execute_seconds: float, txt_files: list):
+        """
+        Prints how long the combined plan took and the size of each input txt file (the
+        uncompressed size for zip members). The MB/s is input size over the execution wall
+        time, not a measured read rate: polars doesn't report the bytes it actually read.
+        """
+        print(f"Built the combined plan in {plan_seconds:.2f} s and wrote the output files in {execute_seconds:.2f} s")
+        total_bytes = 0
+        for txt_file in txt_files:
+            if isinstance(txt_file, ZipMember):
+                name, n_bytes = txt_file.name, txt_file.file_size # uncompressed
+            else:
+                name, n_bytes = Path(txt_file).name, Path(txt_file).stat().st_size
+            total_bytes += n_bytes
+            print(f"    {name}: {n_bytes / 1e6:,.1f} MB input ({n_bytes / 1e6 / execute_seconds:,.1f} MB input/s)")
+        print(f"    Total: {total_bytes / 1e6:,.1f} MB input ({total_bytes / 1e6 / execute_seconds:,.1f} MB input/s)")
 
     def find_occurrence_txt_files(self) -> tuple:
         """
         Find the occurrenct.txt, the gbif_dnaderiveddata.txt, and 
         obis_extendedmeasurmentorfact.txt files in the specified 
-        data directory
+        data directory. If they weren't extracted, they're the
+        members of the download zip instead.
         """
-        occurrence_txt_file = next(self.gbif_download_dir.rglob("occurrence.txt"), None)
-        dna_txt_file =  next(self.gbif_download_dir.rglob("gbif_dnaderiveddata.txt"), None)
-        mof_txt_file = next(self.gbif_download_dir.rglob("obis_extendedmeasurementorfact.txt"), None)
+        occurrence_txt_file = next(self.gbif_download_dir.rglob(self.OCCURRENCE_TXT), None)
+        dna_txt_file =  next(self.gbif_download_dir.rglob(self.DNA_TXT), None)
+        mof_txt_file = next(self.gbif_download_dir.rglob(self.MOF_TXT), None)
+
+        zip_path = next(self.gbif_download_dir.rglob("*.zip"), None)
+        if occurrence_txt_file is None and zip_path is not None:
+            print(f"Reading the txt files straight from {zip_path}")
+            return tuple(find_zip_member(zip_path=zip_path, file_name=name) for name in (self.OCCURRENCE_TXT, self.DNA_TXT, self.MOF_TXT))
 
         return occurrence_txt_file, dna_txt_file, mof_txt_file
     
-    def read_txt_file_to_df(self, txt_file: str) -> pl.DataFrame:
+    def read_txt_file_to_df(self, txt_file) -> pl.DataFrame:
         """
         Uses polars to read the GBIF txt files file from GBIF
         into a data frame. Return lazy data frame. Will need to do 
         .collect() later to return whole df.
+        txt_file is a path or a ZipMember of the download zip.
         """
+        if isinstance(txt_file, ZipMember):
+            if self.decompression_cache_dir is None:
+                return scan_zip_member(member=txt_file)
+            txt_file = cache_zip_member(member=txt_file, cache_dir=self.decompression_cache_dir)
+
         df = pl.scan_csv(txt_file, 
                          separator = "\t",
                          low_memory=False, # optional performance booster use more memory for speed
@@ -186,43 +283,44 @@ class GbifOccurrenceParser:
         Creates a hash based on the specified cols to hash their values.
         For dna_derived hash will be the gbif_id and the dna sequence
         For mof hash will be the gbifid, measurementType and measurementValue
+        The md5 runs natively (multi-threaded) in the polars engine through polars-hash and gives
+        the same hex digest as hashlib.md5, so the source_ids already in the database stay valid.
         """
-        def md5_python(s: pl.Series) -> pl.Series:
-        # This function takes a Series of concatenated strings and hashes each one
-            return s.map_elements(
-                lambda val: hashlib.md5(val.encode()).hexdigest() if val is not None else None,
-                return_dtype=pl.Utf8
-            )
-
         return df.with_columns(
-            pl.concat_str(
+            plh.concat_str(
                 [pl.col(c).cast(pl.Utf8).fill_null("") for c in cols_to_hash],
                 separator="|"
             )
-            .pipe(md5_python) # Pipe the concatenated string into our hasher
+            .nchash.md5()
             .alias(self.SOURCE_ID)
         )
 
-    def _construct_file_parquet_file_path(self, file_prefix: str) -> str:
+    def _construct_file_parquet_file_path(self, file_prefix: str, extension: str = "parquet") -> str:
         """"
         Constructs the file path to svae the data to, given the
         data directory and the file_name
         """
         today = datetime.now().strftime("%Y-%m-%d")
-        file_path = self.gbif_download_dir / f"{file_prefix}_{today}.parquet"
+        file_path = self.gbif_download_dir / f"{file_prefix}_{today}.{extension}"
         return str(file_path)
     
-    def write_to_parquet(self, df: pl.DataFrame, output_file_name: str):
+    def write_to_parquet(self, df: pl.DataFrame, output_file_name: str, lazy: bool = False):
         """
-        Writes the final occurrence df into a parquet file.
-        sink_parquet streams data to disk in chunks (much more
-        memory efficent)
+        Writes the df into a parquet file with the shared parquet layout (sorted by the
+        spatial key and time, bloom filters on the ids, dictionary encoded categoricals).
+        The sorted rows are streamed to disk in row group sized batches. With lazy=True
+        the sink is returned (not run) so several sinks can run in one pl.collect_all,
+        its writer is closed after that in run.
         """
-        
-        df.sink_parquet(
-            path=output_file_name,
-            compression = "zstd",
-            compression_level=3,
-            statistics=True,
-            row_group_size=1_000_000
-        )
\ No newline at end of file
+        writer = ParquetLayoutWriter(layout=self.parquet_layout, output_file=output_file_name, schema=df.collect_schema())
+        if lazy:
+            self.parquet_writers.append(writer)
+
+        return writer.sink(lf=df, lazy=lazy)
+
+    def write_to_ipc(self, df: pl.DataFrame, output_file_name: str, lazy: bool = False):
+        """
+        Streams the df into an Arrow IPC file (quick to write and memory map, e.g. for
+        handing a stage to another process). With lazy=True the sink is returned (not run).
+        """
+        return df.sink_ipc(path=output_file_name, compression="zstd", lazy=lazy)
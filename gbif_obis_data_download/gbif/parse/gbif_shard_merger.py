@@ -0,0 +1,58 @@
+import polars as pl
+from pathlib import Path
+from parquet_layout.parquet_layout_policy import ParquetLayoutPolicy, ParquetLayoutWriter
+from gbif.parse.gbif_occurrence_parser import GbifOccurrenceParser
+
+class GbifShardMerger:
+    """
+    Merges the GbifOccurrenceParser outputs of the tiled (sharded) downloads of one
+    request into one set of stage files, as if it had been a single download.
+
+    Records on a shared tile border match both tiles' within predicates, so they're in
+    two shards: rows are deduplicated on source_id (the gbifID for occurrences, the
+    hash including it for dna_derived and mof).
+    """
+
+    SOURCE_ID = GbifOccurrenceParser.SOURCE_ID
+
+    def __init__(self, shard_outputs: list, output_dir: str, parquet_layout: ParquetLayoutPolicy = None):
+        """
+        shard_outputs are the {stage: parquet file} dicts GbifOccurrenceParser.run returned
+        for each shard. The merged files get the shards' file names in output_dir.
+        """
+        self.shard_outputs = [shard for shard in shard_outputs if shard]
+        self.output_dir = Path(output_dir)
+        self.parquet_layout = parquet_layout or ParquetLayoutPolicy()
+
+    def merge(self) -> dict:
+        """Writes the merged stages in one execution. Returns {stage: merged parquet file}."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        stages = [stage for stage in GbifOccurrenceParser.STAGE_FILE_PREFIXES if any(stage in shard for shard in self.shard_outputs)]
+        outputs = {}
+        writers = []
+        sinks = []
+        for stage in stages:
+            shard_files = [shard[stage] for shard in self.shard_outputs if stage in shard]
+            lf = self.merge_lf(shard_files=shard_files)
+
+            outputs[stage] = str(self.output_dir / Path(shard_files[0]).name)
+            writer = ParquetLayoutWriter(layout=self.parquet_layout, output_file=outputs[stage], schema=lf.collect_schema())
+            writers.append(writer)
+            sinks.append(writer.sink(lf=lf, lazy=True))
+
+        pl.collect_all(sinks, engine="streaming")
+        for writer in writers:
+            writer.close()
+
+        print(f"Merged {len(self.shard_outputs)} shards into {self.output_dir}")
+        return outputs
+
+    def merge_lf(self, shard_files: list) -> pl.LazyFrame:
+        """
+        The shards' rows without the border duplicates. The shards' column types can differ
+        (each archive's meta.xml is typed separately) so they're relaxed to a common type.
+        """
+        lf = pl.concat([pl.scan_parquet(f) for f in shard_files], how="diagonal_relaxed")
+        subset = [self.SOURCE_ID] if self.SOURCE_ID in lf.collect_schema().names() else None
+        return lf.unique(subset=subset, keep="any")
@@ -0,0 +1,183 @@
+import json
+import shutil
+import polars as pl
+import polars_hash as plh
+from datetime import datetime
+from pathlib import Path
+
+class GbifSnapshotDiffer:
+    """
+    Compares a new GBIF snapshot (the parquet files GbifOccurrenceParser writes into a dated
+    download directory) to the previous one and writes compact added/changed/deleted deltas,
+    so the alignment, ETL and ERDDAP steps only need to handle what changed.
+
+    Rows are matched by source_id and compared by a row hash. The crawl bookkeeping columns
+    (lastCrawled, lastParsed, lastInterpreted) are left out of the hash because GBIF bumps
+    them on every crawl even when nothing in the record changed.
+
+    Everything is out of core: each snapshot is reduced once to a small (source_id, row
+    hash, bucket) index sorted by bucket, the indexes are compared one hash bucket at a
+    time, and the delta rows are pulled out of the new snapshot with streaming semi-joins.
+    The index is kept with the snapshot so the next refresh reuses it as the previous one.
+    """
+
+    SOURCE_ID = "source_id"
+    ROW_HASH = "row_hash"
+    BUCKET = "bucket"
+    CHANGE = "change"
+
+    ADDED = "added"
+    CHANGED = "changed"
+    DELETED = "deleted"
+
+    # File prefixes GbifOccurrenceParser writes (the snapshot tables)
+    SNAPSHOT_TABLES = ["arctic_occurences", "arctic_dna_derived", "arctic_mof"]
+
+    # Change every crawl without the record changing
+    EXCLUDED_FROM_HASH = ["lastCrawled", "lastParsed", "lastInterpreted"]
+
+    INDEX_DIR = "snapshot_index"
+    DELTA_DIR = "delta"
+    MANIFEST_FILE = "delta_manifest.json"
+
+    def __init__(self, snapshot_dir: str, previous_snapshot_dir: str = None, n_buckets: int = 64):
+        """
+        snapshot_dir is the dated download directory with the new parquet files. The previous
+        snapshot defaults to the latest earlier dated directory next to it that has been parsed.
+        """
+        self.snapshot_dir = Path(snapshot_dir)
+        self.previous_snapshot_dir = Path(previous_snapshot_dir) if previous_snapshot_dir else self.find_previous_snapshot_dir()
+        self.n_buckets = n_buckets
+        self.delta_dir = self.snapshot_dir / self.DELTA_DIR
+
+    def find_previous_snapshot_dir(self) -> Path:
+        """The latest sibling directory (named by date) before this one with an occurrence parquet file"""
+        earlier_dirs = sorted(
+            d for d in self.snapshot_dir.parent.iterdir()
+            if d.is_dir() and d.name < self.snapshot_dir.name and self.find_snapshot_file(snapshot_dir=d, table=self.SNAPSHOT_TABLES[0]) is not None
+        )
+        return earlier_dirs[-1] if earlier_dirs else None
+
+    @staticmethod
+    def find_snapshot_file(snapshot_dir: Path, table: str) -> Path:
+        """The newest <table>_<date>.parquet file in the snapshot directory (or None)"""
+        files = sorted(Path(snapshot_dir).glob(f"{table}_????-??-??.parquet"))
+        return files[-1] if files else None
+
+    def diff(self) -> dict:
+        """
+        Writes the delta files for every snapshot table and returns (and saves) the manifest
+        with their paths and row counts. Without a previous snapshot everything is added.
+        """
+        print(f"Diffing {self.snapshot_dir} against {self.previous_snapshot_dir}")
+        self.delta_dir.mkdir(parents=True, exist_ok=True)
+
+        manifest = {
+            "snapshot_dir": str(self.snapshot_dir),
+            "previous_snapshot_dir": str(self.previous_snapshot_dir) if self.previous_snapshot_dir else None,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "tables": {}
+        }
+        for table in self.SNAPSHOT_TABLES:
+            snapshot_file = self.find_snapshot_file(snapshot_dir=self.snapshot_dir, table=table)
+            if snapshot_file is None:
+                print(f"    No {table} parquet file in {self.snapshot_dir}, skipping")
+                continue
+            manifest["tables"][table] = self.diff_table(table=table, snapshot_file=snapshot_file)
+
+        with open(self.delta_dir / self.MANIFEST_FILE, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        return manifest
+
+    def diff_table(self, table: str, snapshot_file: Path) -> dict:
+        new_index = self.build_index(snapshot_dir=self.snapshot_dir, snapshot_file=snapshot_file)
+
+        previous_file = self.find_snapshot_file(snapshot_dir=self.previous_snapshot_dir, table=table) if self.previous_snapshot_dir else None
+        previous_index = self.build_index(snapshot_dir=self.previous_snapshot_dir, snapshot_file=previous_file) if previous_file else None
+
+        changes_dir = self.delta_dir / f"{table}_changes"
+        self.write_changes(new_index=new_index, previous_index=previous_index, changes_dir=changes_dir)
+
+        # Added and changed rows are whole rows of the new snapshot, deleted ones are only their source_id
+        date = snapshot_file.stem.rsplit("_", 1)[-1]
+        changes = pl.scan_parquet(changes_dir / "*.parquet")
+        snapshot = pl.scan_parquet(snapshot_file)
+        delta_files = {change: self.delta_dir / f"{table}_{change}_{date}.parquet" for change in (self.ADDED, self.CHANGED, self.DELETED)}
+        sinks = [
+            snapshot.join(changes.filter(pl.col(self.CHANGE) == change).select(self.SOURCE_ID), on=self.SOURCE_ID, how="semi")
+            .sink_parquet(delta_files[change], compression="zstd", compression_level=3, statistics=True, lazy=True)
+            for change in (self.ADDED, self.CHANGED)
+        ]
+        sinks.append(
+            changes.filter(pl.col(self.CHANGE) == self.DELETED).select(self.SOURCE_ID)
+            .sink_parquet(delta_files[self.DELETED], compression="zstd", compression_level=3, statistics=True, lazy=True)
+        )
+        pl.collect_all(sinks, engine="streaming")
+
+        counts = dict(changes.group_by(self.CHANGE).len().collect().iter_rows())
+        shutil.rmtree(changes_dir)
+
+        print(f"    {table}: " + ", ".join(f"{counts.get(change, 0):,} {change}" for change in delta_files))
+        return {change: {"file": str(path), "rows": counts.get(change, 0)} for change, path in delta_files.items()}
+
+    def build_index(self, snapshot_dir: Path, snapshot_file: Path) -> Path:
+        """
+        Writes the (source_id, row_hash, bucket) index of a snapshot file sorted by bucket (so
+        the bucket filter skips row groups) unless it's already there, and returns its path.
+        The source_ids are made unique - a repeated dna/mof row is the same row.
+        """
+        index_file = Path(snapshot_dir) / self.INDEX_DIR / f"{snapshot_file.stem}_{self.n_buckets}.parquet"
+        if index_file.exists() and index_file.stat().st_mtime >= snapshot_file.stat().st_mtime:
+            return index_file
+
+        print(f"    Indexing {snapshot_file}")
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        snapshot = pl.scan_parquet(snapshot_file)
+        hashed_columns = [c for c in snapshot.collect_schema().names() if c not in self.EXCLUDED_FROM_HASH]
+
+        (
+            snapshot
+            .select([
+                pl.col(self.SOURCE_ID),
+                plh.concat_str([pl.col(c).cast(pl.Utf8).fill_null("\x00") for c in hashed_columns], separator="\x1f")
+                .nchash.xxhash64().alias(self.ROW_HASH),
+                (plh.col(self.SOURCE_ID).cast(pl.Utf8).nchash.xxhash64() % self.n_buckets).cast(pl.UInt16).alias(self.BUCKET)
+            ])
+            .unique(subset=[self.SOURCE_ID, self.ROW_HASH])
+            .sort(self.BUCKET)
+            .sink_parquet(index_file, compression="zstd", compression_level=3, statistics=True, row_group_size=250_000)
+        )
+        return index_file
+
+    def write_changes(self, new_index: Path, previous_index: Path, changes_dir: Path):
+        """
+        Compares the two indexes bucket by bucket and writes the (source_id, change) of every
+        row that was added, changed or deleted, one file per bucket. Rows with the same
+        source_id and hash are dropped.
+        """
+        shutil.rmtree(changes_dir, ignore_errors=True)
+        changes_dir.mkdir(parents=True)
+
+        if previous_index is None:
+            pl.scan_parquet(new_index).select([pl.col(self.SOURCE_ID), pl.lit(self.ADDED).alias(self.CHANGE)]).sink_parquet(changes_dir / "all.parquet")
+            return
+
+        for bucket in range(self.n_buckets):
+            new = pl.scan_parquet(new_index).filter(pl.col(self.BUCKET) == bucket).select(self.SOURCE_ID, self.ROW_HASH)
+            previous = pl.scan_parquet(previous_index).filter(pl.col(self.BUCKET) == bucket).select(self.SOURCE_ID, self.ROW_HASH)
+
+            (
+                new.join(previous, on=self.SOURCE_ID, how="full", coalesce=True, suffix="_previous")
+                .select([
+                    pl.col(self.SOURCE_ID),
+                    pl.when(pl.col(f"{self.ROW_HASH}_previous").is_null()).then(pl.lit(self.ADDED))
+                    .when(pl.col(self.ROW_HASH).is_null()).then(pl.lit(self.DELETED))
+                    .when(pl.col(self.ROW_HASH) != pl.col(f"{self.ROW_HASH}_previous")).then(pl.lit(self.CHANGED))
+                    .alias(self.CHANGE)
+                ])
+                .drop_nulls(self.CHANGE)
+                .unique(subset=self.SOURCE_ID)
+                .collect()
+                .write_parquet(changes_dir / f"bucket_{bucket:04d}.parquet")
+            )
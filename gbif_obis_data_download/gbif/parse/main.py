@@ -1,5 +1,91 @@
-from arctic_postgres.gbif_obis_data_download.gbif.parse.gbif_occurrence_parser import GbifOccurrenceParser
+import argparse
+import sys
+
+from gbif.parse.gbif_occurrence_parser import GbifOccurrenceParser
+
+ETL_SINK = "etl"
+GBIF_DATA_SOURCE = "gbif" # data_source of the parser's rows
 
 if __name__ == "__main__":
 
-    gbif_occ_parser = GbifOccurrenceParser(gbif_download_dir="/home/mule-external/sci-dig/arctic_toolkit/gbif/2026-01-26")
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description = "Parse a GBIF download into occurrence, dna_derived and mof outputs"
+    )
+    parser.add_argument(
+        '--gbif_download_dir',
+        type=str,
+        required=True,
+        help="The dated download directory with the extracted txt files or the download zip."
+    )
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        choices=list(GbifOccurrenceParser.STAGE_FILE_PREFIXES),
+        default=None,
+        help="Only run these outputs (e.g. --stages mof after a fix to the mof stage). Defaults to all of them."
+    )
+    parser.add_argument(
+        '--sink',
+        choices=[GbifOccurrenceParser.PARQUET_SINK, GbifOccurrenceParser.IPC_SINK, ETL_SINK],
+        default=GbifOccurrenceParser.PARQUET_SINK,
+        help="Write parquet or Arrow IPC files next to the download, or load the stages straight into "
+             "the database tables with the ETL (needs the repository root on PYTHONPATH and DATABASE_URL)."
+    )
+    parser.add_argument(
+        '--decompression_cache_dir',
+        type=str,
+        default=None,
+        help="Decompress the zip members here once and reuse them in later runs instead of streaming them out of the zip."
+    )
+
+    args = parser.parse_args()
+
+    gbif_occ_parser = GbifOccurrenceParser(gbif_download_dir=args.gbif_download_dir, decompression_cache_dir=args.decompression_cache_dir)
+
+    if args.sink == ETL_SINK:
+        from datetime import datetime
+        from etl.etl_script import (analyze_tables, delete_source_rows, load_lazy_df_streaming, load_parquet_streaming,
+                                    pivot_and_load_mof_wide, publish_load_manifest)
+        from models import create_tables, MOF_WIDE_TABLE_NAME
+
+        # Only creates the missing tables, a rerun of some stages never touches the rest of the database
+        create_tables()
+        stages = [stage for stage in (args.stages or GbifOccurrenceParser.STAGE_FILE_PREFIXES) if stage != GbifOccurrenceParser.CAST_ERRORS]
+        if GbifOccurrenceParser.OCCURRENCE in stages:
+            # dna_derived and mof rows reference the occurrence rows, so they're reloaded with them
+            stages += [GbifOccurrenceParser.DNA_DERIVED, GbifOccurrenceParser.MOF]
+        # Occurrence is loaded before the extensions and their GBIF rows are deleted the other way round
+        stages = [stage for stage in GbifOccurrenceParser.STAGE_FILE_PREFIXES if stage in stages]
+        reload_mof = GbifOccurrenceParser.MOF in stages
+        # mof_wide references occurrence and is pivoted from mof, so it's rebuilt whenever mof is reloaded
+        delete_tables = ([MOF_WIDE_TABLE_NAME] if reload_mof else []) + list(reversed(stages))
+        delete_source_rows(table_names=delete_tables, data_source=GBIF_DATA_SOURCE)
+
+        # The loads are fingerprinted with the load time, a rerun of the same download still flags ERDDAP
+        loaded = datetime.now().isoformat(timespec="seconds")
+        loaded_tables = {}
+        try:
+            streamed_rows = gbif_occ_parser.run(
+                stages=[stage for stage in stages if stage != GbifOccurrenceParser.MOF],
+                sink=lambda stage, lf: load_lazy_df_streaming(lazy_df=lf, table_name=stage, source_name=f"{args.gbif_download_dir} ({stage})", abort_on_error=True)
+            )
+            for stage, rows in streamed_rows.items():
+                loaded_tables[stage] = [{"file": args.gbif_download_dir, "rows": rows, "loaded": loaded}]
+
+            if reload_mof:
+                # Written to parquet first, mof_wide is pivoted from the file
+                mof_file = gbif_occ_parser.run(stages=[GbifOccurrenceParser.MOF])[GbifOccurrenceParser.MOF]
+                rows = load_parquet_streaming(file_path=mof_file, table_name=GbifOccurrenceParser.MOF, abort_on_error=True)
+                loaded_tables[GbifOccurrenceParser.MOF] = [{"file": mof_file, "rows": rows, "loaded": loaded}]
+                pivot_and_load_mof_wide(mof_parquet_files={GBIF_DATA_SOURCE: mof_file}, abort_on_error=True)
+        except IOError as e:
+            print(f"Error: {e}")
+            print(f"The GBIF rows of {delete_tables} are only partly loaded, rerun with the same --stages to reload them")
+            sys.exit(1)
+
+        analyze_tables()
+        publish_load_manifest(loaded_tables=loaded_tables)
+    else:
+        outputs = gbif_occ_parser.run(stages=args.stages, sink=args.sink)
+        for stage, output_file in outputs.items():
+            print(f"{stage}: {output_file}")
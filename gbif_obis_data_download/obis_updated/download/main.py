@@ -1,5 +1,7 @@
 import argparse
-from arctic_postgres.gbif_obis_data_download.obis_updated.download.obis_arctic_downloader import ObisArcticDownloader
+from pathlib import Path
+from obis_updated.download.obis_arctic_downloader import ObisArcticDownloader
+from download_registry.registry import DownloadRegistry
 
 
 if __name__ == "__main__":
@@ -15,12 +17,54 @@ if __name__ == "__main__":
         help="path to data directory to save files to."
     )
 
+    parser.add_argument(
+        '-r',
+        '--registry',
+        type=str,
+        default=None,
+        help=f"download registry (SQLite) that skips the queries whose OBIS snapshot is unchanged, defaults to <data_dir>/{DownloadRegistry.REGISTRY_FILE_NAME}"
+    )
+    parser.add_argument(
+        '-k',
+        '--keep_snapshots',
+        type=int,
+        default=None,
+        help="after the run, delete the registered OBIS snapshots beyond the newest this many"
+    )
+
+    parser.add_argument(
+        '-s',
+        '--source_path',
+        type=str,
+        default=ObisArcticDownloader.AWS_S3_PATH,
+        help="OBIS parquet files to extract from, e.g. a local directory of OBIS shaped files (/path/*.parquet)"
+    )
+    parser.add_argument(
+        '--three_scans',
+        action='store_true',
+        help="scan the source once per output instead of once into a local staging file"
+    )
+    parser.add_argument(
+        '--region_polygon',
+        type=str,
+        default=ObisArcticDownloader.ARCTIC_POLYGON,
+        help="WKT polygon (lon/lat) of the region to extract, the Arctic by default"
+    )
+    parser.add_argument(
+        '--keep_staging',
+        action='store_true',
+        help="keep the staging file of the Arctic records after the outputs are made"
+    )
+
     args = parser.parse_args()
     print(f"args.data_dir = {args.data_dir}")
 
-    arctic_downloader = ObisArcticDownloader(data_dir=args.data_dir)
+    registry = DownloadRegistry(registry_file=args.registry or Path(args.data_dir) / DownloadRegistry.REGISTRY_FILE_NAME)
+    arctic_downloader = ObisArcticDownloader(data_dir=args.data_dir, registry=registry, source_path=args.source_path, single_scan=not args.three_scans,
+                                             region_polygon=args.region_polygon)
 
     # Get occurences, dna_derived, and mof parquet files
-    arctic_downloader.get_obis_arctic_occurrences()
-    arctic_downloader.get_obis_dna_derived()
-    arctic_downloader.get_obis_mof()
\ No newline at end of file
+    arctic_downloader.get_all(keep_staging=args.keep_staging)
+
+    if args.keep_snapshots is not None:
+        registry.garbage_collect(source=DownloadRegistry.OBIS, keep_last=args.keep_snapshots)
\ No newline at end of file
@@ -1,4 +1,9 @@
 import duckdb
+import hashlib
+import json
+import re
+from parquet_layout.parquet_layout_policy import ParquetLayoutPolicy
+from download_registry.registry import DownloadRegistry
 from pathlib import Path
 from datetime import datetime
 
@@ -9,29 +14,205 @@ class ObisArcticDownloader:
     MOF_EXTENSION = "http://rs.iobis.org/obis/terms/ExtendedMeasurementOrFact"
     AWS_S3_PATH = "s3://obis-open-data/occurrence/*.parquet"
 
-    def __init__(self, data_dir: str):
-        
+    # OBIS interpreted columns the occurrence file is sorted on (see ParquetLayoutPolicy)
+    OCCURRENCE_LAYOUT_COLUMNS = ["decimalLatitude", "decimalLongitude", "date_year", "date_start"]
+    EXTENSION_LAYOUT_COLUMNS = ["occurrence_source_id"]
+
+    # The interpreted coordinates the region's bounding box is checked on before ST_Within
+    LATITUDE_COLUMN = "interpreted.decimalLatitude"
+    LONGITUDE_COLUMN = "interpreted.decimalLongitude"
+
+    def __init__(self, data_dir: str, parquet_layout: ParquetLayoutPolicy = None, registry: DownloadRegistry = None,
+                 source_path: str = AWS_S3_PATH, single_scan: bool = True, region_polygon: str = ARCTIC_POLYGON):
+        """
+        source_path is the OBIS parquet files (the S3 bucket, or a local directory of
+        OBIS shaped parquet files for testing). With single_scan the Arctic records
+        (with their extensions) are copied out of the source once into a local staging
+        parquet file and the occurrence, dna_derived and mof files are all made from it,
+        instead of each scanning the whole global source.
+
+        region_polygon is the WKT polygon (lon/lat) the records are kept within, the Arctic
+        by default.
+        """
         self.data_dir = Path(data_dir) # The directory to save the data to.
+        self.parquet_layout = parquet_layout or ParquetLayoutPolicy() # Shared with the GBIF parser
+        self.registry = registry # Skips the COPYs whose snapshot and query are unchanged since the last run
+        self.source_path = source_path
+        self.single_scan = single_scan
+        self.region_polygon = region_polygon
+        # Named after what it's staged from, so a kept staging file of another source or region is never reused
+        self.staging_hash = DownloadRegistry.hash_predicate(f"{self.source_path} {self.region_polygon}")[:16]
+        self.staging_file = self._construct_file_parquet_file_path(file_prefix=f"obis_arctic_staging_{self.staging_hash}")
+        self.snapshot_key = None
 
-    def _query_obis_aws(self, query: str):
+    def _query_obis_aws(self, query: str, file_path: str = None, stage: str = None) -> str:
         """
-        Executes a query to Obis's AWS
+        Executes a query to Obis's AWS. If the query COPYs to file_path, the file
+        is rewritten with the parquet layout's encodings afterwards (DuckDB can't
+        put bloom filters or dictionary encoding on specific columns).
+
+        With a registry and a stage, a COPY of the same query over the same S3
+        snapshot whose file is still there isn't run again, that file is returned
+        instead. Returns the file written (or reused).
         """
         # connect to DuckDB
         con = duckdb.connect()
         print("Setting up DuckDB extensions...")
         
-        con.execute("INSTALL httpfs; LOAD httpfs;")
+        if self.source_path.startswith("s3://"):
+            con.execute("INSTALL httpfs; LOAD httpfs;")
+
+            # Configure AWS access (no credentials needed for public data)
+            con.execute("SET s3_region='us-east-1';")
+            con.execute("SET s3_url_style='path';")
         con.execute("INSTALL spatial; LOAD spatial")
 
-        # Configure AWS access (no credentials needed for public data)
-        con.execute("SET s3_region='us-east-1';")
-        con.execute("SET s3_url_style='path';")
+        if self.registry is not None and stage is not None:
+            snapshot_key = self._get_snapshot_key(con=con)
+            # The file and staging paths have today's date, the query is the same without them.
+            # The staging query isn't in query, so the region is hashed with it
+            query = query.replace(str(file_path), "").replace(self.staging_file, "")
+            query_hashes = {stage: DownloadRegistry.hash_predicate(query + self.region_polygon)}
+            registered = self.registry.get_outputs(source=DownloadRegistry.OBIS, download_key=snapshot_key, stages=[stage], query_hashes=query_hashes)
+            if registered is not None:
+                print(f"The OBIS snapshot hasn't changed, reusing {registered[stage]}")
+                return registered[stage]
+
+        if self.single_scan and not self._is_staging_current(con=con):
+            self._stage_arctic_records(con=con)
 
-        print("Querying OBIS Arctic data from AWS...")
+        print("Querying OBIS Arctic data from AWS..." if not self.single_scan else f"Querying OBIS Arctic data from {self.staging_file}...")
 
         con.execute(query)
 
+        if file_path is not None:
+            print(f"Applying the parquet layout to {file_path}")
+            self.parquet_layout.rewrite_parquet(parquet_file=file_path)
+
+        if self.registry is not None and stage is not None:
+            self.registry.record_download(source=DownloadRegistry.OBIS, download_key=snapshot_key,
+                                          predicate_hash=DownloadRegistry.hash_predicate(self.region_polygon))
+            self.registry.record_outputs(source=DownloadRegistry.OBIS, download_key=snapshot_key, outputs={stage: file_path}, query_hashes=query_hashes)
+
+        return file_path
+
+    def _get_snapshot_key(self, con: duckdb.DuckDBPyConnection) -> str:
+        """
+        Content address of the current OBIS S3 snapshot: a hash of its files' names and row
+        counts from their parquet footers (only the footers are read, not the data)
+        """
+        if self.snapshot_key is None:
+            files = con.execute(f"SELECT file_name, num_rows FROM parquet_file_metadata('{self.source_path}') ORDER BY file_name").fetchall()
+            self.snapshot_key = hashlib.sha256(json.dumps(files).encode()).hexdigest()[:32]
+        return self.snapshot_key
+
+    def _arctic_records_sql(self) -> str:
+        """
+        The FROM of the Arctic records (all the OBIS columns, extensions included): the
+        staging file in single scan mode, otherwise the source filtered to the polygon
+        """
+        if self.single_scan:
+            return f"read_parquet('{self.staging_file}')"
+
+        return f"({self._source_region_sql()})"
+
+    def _source_region_sql(self) -> str:
+        """
+        The source records within the region polygon. ST_Within can't be pushed down to the
+        parquet statistics, so the region's bounding box goes first as plain coordinate ranges
+        that DuckDB checks against each row group's min/max and skips the row groups outside
+        it. ST_Within then refines what's left to the exact polygon.
+        """
+        return f"""
+            SELECT * FROM read_parquet('{self.source_path}',
+                union_by_name=True,
+                hive_partitioning=false)
+            WHERE {self._region_bbox_sql()}
+            AND ST_Within(
+                geometry,
+                ST_GeomFromText('{self.region_polygon}')
+                )
+            """
+
+    def _region_bbox_sql(self) -> str:
+        """
+        The bounding box of region_polygon as BETWEEN predicates (inclusive, so a superset
+        of ST_Within). The longitude one is left out when the box spans every longitude.
+        """
+        west, south, east, north = self.get_polygon_bounds(polygon=self.region_polygon)
+        predicates = [f"{self.LATITUDE_COLUMN} BETWEEN {south!r} AND {north!r}"]
+        if west > -180 or east < 180:
+            predicates.append(f"{self.LONGITUDE_COLUMN} BETWEEN {west!r} AND {east!r}")
+        return " AND ".join(predicates)
+
+    @staticmethod
+    def get_polygon_bounds(polygon: str) -> tuple:
+        """(west, south, east, north) of a WKT (MULTI)POLYGON's lon/lat coordinates"""
+        numbers = [float(n) for n in re.findall(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?", polygon)]
+        if not numbers or len(numbers) % 2:
+            raise ValueError(f"Can't read the coordinates of {polygon}")
+        lons, lats = numbers[0::2], numbers[1::2]
+        return min(lons), min(lats), max(lons), max(lats)
+
+    def _stage_arctic_records(self, con: duckdb.DuckDBPyConnection):
+        """
+        The one scan of the source in single scan mode: copies the Arctic records as they
+        are (extensions struct and geometry included) into the local staging file
+        """
+        print(f"Staging the OBIS Arctic records from {self.source_path} in {self.staging_file}...")
+        self.remove_staging_file()
+
+        # Written under a temporary name and renamed, so a crash never leaves a partial staging file
+        tmp_file = f"{self.staging_file}.tmp"
+        con.execute(f"""
+            COPY (
+                {self._source_region_sql()}
+            ) TO '{tmp_file}' ({self.parquet_layout.duckdb_copy_options()});
+        """)
+        Path(tmp_file).replace(self.staging_file)
+        Path(self._staging_info_file()).write_text(json.dumps(self._staging_info(con=con)))
+
+    def _staging_info_file(self) -> str:
+        return f"{self.staging_file}.json"
+
+    def _staging_info(self, con: duckdb.DuckDBPyConnection) -> dict:
+        """
+        What the staging file is made from. The snapshot is only checked with a registry,
+        where stale rows would otherwise be registered under the new snapshot.
+        """
+        return {
+            "source_path": self.source_path,
+            "region_polygon": self.region_polygon,
+            "snapshot_key": self._get_snapshot_key(con=con) if self.registry is not None else None
+        }
+
+    def _is_staging_current(self, con: duckdb.DuckDBPyConnection) -> bool:
+        """Whether the staging file is there and was staged from the same source, region (and snapshot)"""
+        info_file = Path(self._staging_info_file())
+        if not Path(self.staging_file).exists() or not info_file.exists():
+            return False
+        return json.loads(info_file.read_text()) == self._staging_info(con=con)
+
+    def remove_staging_file(self):
+        Path(self.staging_file).unlink(missing_ok=True)
+        Path(self._staging_info_file()).unlink(missing_ok=True)
+
+    def get_all(self, keep_staging: bool = False) -> dict:
+        """
+        Gets the occurrence, dna_derived and mof files (from one scan of the source in
+        single scan mode). The staging file is removed afterwards unless keep_staging.
+        Returns {stage: parquet file}.
+        """
+        try:
+            return {
+                "occurrence": self.get_obis_arctic_occurrences(),
+                "dna_derived": self.get_obis_dna_derived(),
+                "mof": self.get_obis_mof()
+            }
+        finally:
+            if not keep_staging:
+                self.remove_staging_file()
+
     def _construct_file_parquet_file_path(self, file_prefix: str) -> str:
         """"
         Constructs the file path to svae the data to, given the
@@ -50,6 +231,7 @@ class ObisArcticDownloader:
 
         occurrence_query = f"""
         COPY (
+            SELECT * FROM (
             SELECT _id AS source_id,
                 dataset_id,
                 interpreted.*,
@@ -72,18 +254,14 @@ class ObisArcticDownloader:
                         THEN TRUE
                         ELSE FALSE
                 END AS has_mof
-            FROM read_parquet('{self.AWS_S3_PATH}',
-                union_by_name=True,
-                hive_partitioning=false)
-            WHERE ST_Within(
-                geometry,
-                ST_GeomFromText('{self.ARCTIC_POLYGON}')
-                )
-            ) TO '{file_path}' (FORMAT PARQUET);
+            FROM {self._arctic_records_sql()}
+            ) AS arctic_occurrences
+            {self.parquet_layout.order_by_sql(columns=self.OCCURRENCE_LAYOUT_COLUMNS)}
+            ) TO '{file_path}' ({self.parquet_layout.duckdb_copy_options()});
         """
 
         # Execute query
-        self._query_obis_aws(query=occurrence_query)
+        return self._query_obis_aws(query=occurrence_query, file_path=file_path, stage="occurrence")
 
     def get_obis_dna_derived(self):
         """
@@ -102,19 +280,16 @@ class ObisArcticDownloader:
                 FROM (
                     SELECT 
                         UNNEST(extensions['{self.DNA_DERIVED_EXTENSION}'], recursive := true)
-                    FROM read_parquet('{self.AWS_S3_PATH}')
-                    WHERE ST_Within(
-                        geometry,
-                        ST_GeomFromText('{self.ARCTIC_POLYGON}')
-                    )
-                    AND extensions['{self.DNA_DERIVED_EXTENSION}'] IS NOT NULL
+                    FROM {self._arctic_records_sql()}
+                    WHERE extensions['{self.DNA_DERIVED_EXTENSION}'] IS NOT NULL
                     AND len(extensions['{self.DNA_DERIVED_EXTENSION}']) > 0
                 )
-            ) TO '{file_path}' (FORMAT PARQUET);
+                {self.parquet_layout.order_by_sql(columns=self.EXTENSION_LAYOUT_COLUMNS)}
+            ) TO '{file_path}' ({self.parquet_layout.duckdb_copy_options()});
         """
         
         # Execute query
-        self._query_obis_aws(query=dna_query)
+        return self._query_obis_aws(query=dna_query, file_path=file_path, stage="dna_derived")
 
     def get_obis_mof(self):
         """
@@ -133,15 +308,12 @@ class ObisArcticDownloader:
                 FROM (
                     SELECT 
                         UNNEST(extensions['{self.MOF_EXTENSION}'], recursive := true)
-                    FROM read_parquet('{self.AWS_S3_PATH}')
-                    WHERE ST_Within(
-                        geometry,
-                        ST_GeomFromText('{self.ARCTIC_POLYGON}')
-                    )
-                    AND extensions['{self.MOF_EXTENSION}'] IS NOT NULL
+                    FROM {self._arctic_records_sql()}
+                    WHERE extensions['{self.MOF_EXTENSION}'] IS NOT NULL
                     AND len(extensions['{self.MOF_EXTENSION}']) > 0
                 )
-            ) TO '{file_path}' (FORMAT PARQUET);
+                {self.parquet_layout.order_by_sql(columns=self.EXTENSION_LAYOUT_COLUMNS)}
+            ) TO '{file_path}' ({self.parquet_layout.duckdb_copy_options()});
         """
         
-        self._query_obis_aws(query=mof_query)
+        return self._query_obis_aws(query=mof_query, file_path=file_path, stage="mof")
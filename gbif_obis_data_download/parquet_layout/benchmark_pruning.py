@@ -0,0 +1,138 @@
+import argparse
+import statistics
+import time
+import duckdb
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq
+from pathlib import Path
+
+from parquet_layout.parquet_layout_policy import ParquetLayoutPolicy, ParquetLayoutWriter
+
+# Measures how much the shared parquet layout lets readers skip compared to the old parser output
+# (unsorted, 1,000,000 row groups): the share of row groups whose min/max stats can match spatial
+# (bbox), time (year) and id (source_id) filters, and DuckDB's time to run each filter.
+
+LATITUDE = ParquetLayoutPolicy.LATITUDE
+LONGITUDE = ParquetLayoutPolicy.LONGITUDE
+SOURCE_ID = ParquetLayoutPolicy.SOURCE_ID
+YEAR = "year"
+
+def write_baseline(lf: pl.LazyFrame, output_file: Path):
+    """The layout GbifOccurrenceParser wrote before the layout policy"""
+    lf.sink_parquet(output_file, compression="zstd", compression_level=3, statistics=True, row_group_size=1_000_000)
+
+def write_layout(lf: pl.LazyFrame, output_file: Path, layout: ParquetLayoutPolicy):
+    ParquetLayoutWriter(layout=layout, output_file=output_file, schema=lf.collect_schema()).sink(lf=lf, lazy=False)
+
+def sample_queries(lf: pl.LazyFrame, n_queries: int, seed: int = 0) -> list:
+    """
+    Filters around sampled records: a 1 x 2 degree bbox, a year and a source_id.
+    Returns [(kind, {column: (low, high)}, duckdb where clause)]
+    """
+    sample = (
+        lf.select([SOURCE_ID, LATITUDE, LONGITUDE, YEAR])
+        .drop_nulls()
+        .collect(engine="streaming")
+        .sample(n=n_queries, seed=seed, with_replacement=True)
+    )
+
+    queries = []
+    for source_id, lat, lon, year in sample.iter_rows():
+        lat, lon, year = float(lat), float(lon), int(year)
+        queries.append(("bbox", {LATITUDE: (lat - 0.5, lat + 0.5), LONGITUDE: (lon - 1, lon + 1)},
+                        f'"{LATITUDE}" BETWEEN {lat - 0.5} AND {lat + 0.5} AND "{LONGITUDE}" BETWEEN {lon - 1} AND {lon + 1}'))
+        queries.append(("year", {YEAR: (year, year)}, f'"{YEAR}" = {year}'))
+        queries.append(("source_id", {SOURCE_ID: (source_id, source_id)}, f"{SOURCE_ID} = '{source_id}'"))
+
+    return queries
+
+def row_group_stats(parquet_file: Path, columns: list) -> list:
+    """[{column: (min, max)}] per row group (None when there are no stats)"""
+    metadata = pq.ParquetFile(parquet_file).metadata
+    column_index = {metadata.schema.column(i).name: i for i in range(metadata.num_columns)}
+
+    row_groups = []
+    for rg in range(metadata.num_row_groups):
+        stats = {}
+        for column in columns:
+            column_stats = metadata.row_group(rg).column(column_index[column]).statistics
+            stats[column] = (column_stats.min, column_stats.max) if column_stats is not None and column_stats.has_min_max else None
+        row_groups.append(stats)
+
+    return row_groups
+
+def matching_share(row_groups: list, ranges: dict) -> float:
+    """Share of row groups the min/max stats can't rule out"""
+    def can_match(stats: dict) -> bool:
+        return all(
+            stats[column] is None or (stats[column][0] <= high and stats[column][1] >= low)
+            for column, (low, high) in ranges.items()
+        )
+    return sum(can_match(stats) for stats in row_groups) / len(row_groups)
+
+def time_query(con: duckdb.DuckDBPyConnection, parquet_file: Path, where: str, runs: int) -> float:
+    """Median seconds to count the matching rows"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        con.execute(f"SELECT count(*) FROM read_parquet('{parquet_file}') WHERE {where}").fetchone()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Benchmark row group pruning of the old parser parquet layout vs the shared ParquetLayoutPolicy"
+    )
+    parser.add_argument(
+        '-i',
+        '--input_file',
+        type=str,
+        required=True,
+        help="An occurrence parquet file (e.g. arctic_occurences_<date>.parquet from GbifOccurrenceParser)."
+    )
+    parser.add_argument(
+        '-o',
+        '--output_dir',
+        type=str,
+        required=True,
+        help="directory the two layouts of the file are written to"
+    )
+    parser.add_argument(
+        '-q',
+        '--queries',
+        type=int,
+        default=20,
+        help="number of sampled records each filter type is built around"
+    )
+    parser.add_argument(
+        '-r',
+        '--runs',
+        type=int,
+        default=3,
+        help="DuckDB runs per query (the median is reported)"
+    )
+
+    args = parser.parse_args()
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    lf = pl.scan_parquet(args.input_file)
+
+    files = {"baseline": output_dir / "baseline.parquet", "layout": output_dir / "layout.parquet"}
+    write_baseline(lf=lf, output_file=files["baseline"])
+    write_layout(lf=lf, output_file=files["layout"], layout=ParquetLayoutPolicy())
+
+    queries = sample_queries(lf=lf, n_queries=args.queries)
+    con = duckdb.connect()
+
+    print(f"{'layout':<10}{'filter':<11}{'row groups':>11}{'can match':>11}{'duckdb ms':>11}{'MB':>9}")
+    for name, parquet_file in files.items():
+        row_groups = row_group_stats(parquet_file=parquet_file, columns=[LATITUDE, LONGITUDE, YEAR, SOURCE_ID])
+        size_mb = parquet_file.stat().st_size / 1e6
+        for kind in ("bbox", "year", "source_id"):
+            kind_queries = [q for q in queries if q[0] == kind]
+            share = np.mean([matching_share(row_groups=row_groups, ranges=ranges) for _, ranges, _ in kind_queries])
+            seconds = np.mean([time_query(con=con, parquet_file=parquet_file, where=where, runs=args.runs) for _, _, where in kind_queries])
+            print(f"{name:<10}{kind:<11}{len(row_groups):>11}{share:>10.1%}{seconds * 1000:>11.1f}{size_mb:>9.1f}")
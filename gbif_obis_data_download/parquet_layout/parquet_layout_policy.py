@@ -0,0 +1,207 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import polars as pl
+from pathlib import Path
+
+class ParquetLayoutPolicy:
+    """
+    The parquet layout shared by the GBIF parser, the OBIS downloader and the GeoParquet
+    exporter so readers (DuckDB, ERDDAP, polars) can skip row groups when filtering on
+    space, time or ID:
+
+    - Rows are sorted by a coarse Z-order (Morton) cell, then time, then the full-resolution
+      Morton key, so each row group covers a small area and a narrow time range and its
+      lat/lon/year min/max stats are tight. Extension tables (no coordinates) are sorted
+      by occurrence_source_id instead.
+    - source_id/occurrence_source_id get bloom filters (their min/max stats can't prune
+      unsorted random ids).
+    - Only the categorical columns are dictionary encoded, the rest are written plain
+      instead of building (and abandoning) a dictionary per column chunk.
+    - Smaller row groups than the old 1,000,000 rows and the page index so pages can be
+      skipped too.
+    """
+
+    SOURCE_ID = "source_id"
+    OCCURRENCE_SOURCE_ID = "occurrence_source_id"
+    LATITUDE = "decimalLatitude"
+    LONGITUDE = "decimalLongitude"
+
+    # Time columns sorted on after the coarse spatial cell (the first ones present are used).
+    # GBIF/harmonized have year and month, OBIS interpreted has date_year and date_start.
+    TIME_COLUMNS = ["year", "month", "date_year", "date_start", "time"]
+
+    BLOOM_FILTER_COLUMNS = [SOURCE_ID, OCCURRENCE_SOURCE_ID]
+
+    # Low cardinality string columns (GBIF, OBIS and harmonized names)
+    DICTIONARY_COLUMNS = [
+        "data_source", "basisOfRecord", "occurrenceStatus", "taxonRank", "kingdom", "phylum",
+        "class", "order", "family", "genus", "countryCode", "publishingCountry", "datasetKey",
+        "dataset_id", "license", "institutionCode", "collectionCode", "datasetName", "protocol",
+        "establishmentMeans", "sex", "lifeStage", "samplingProtocol", "measurementType",
+        "measurementUnit", "target_gene", "pcr_primer_name_forward", "pcr_primer_name_reverse",
+        "pcrprimerforward", "pcrprimerreverse", "measurementtype", "measurementunit"
+    ]
+
+    def __init__(self, row_group_size: int = 122_880, data_page_size: int = 1024 * 1024, compression: str = "zstd",
+                 compression_level: int = 3, spatial_key_bits: int = 16, coarse_spatial_key_bits: int = 6, bloom_filter_fpp: float = 0.01):
+        """
+        coarse_spatial_key_bits sets the size of the spatial cell rows are grouped by before
+        time (6 bits per axis is about 5.6 x 2.8 degrees).
+        """
+        self.row_group_size = row_group_size
+        self.data_page_size = data_page_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.spatial_key_bits = spatial_key_bits
+        self.coarse_spatial_key_bits = coarse_spatial_key_bits
+        self.bloom_filter_fpp = bloom_filter_fpp
+
+    def spatial_key_expr(self, lat_col: str, lon_col: str, bits: int = None) -> pl.Expr:
+        """
+        Z-order (Morton) key interleaving the quantized longitude and latitude bits
+        so that rows close in space are close in the sort order.
+        """
+        bits = bits or self.spatial_key_bits
+        max_val = (1 << bits) - 1
+        x = ((pl.col(lon_col).cast(pl.Float64) + 180.0) / 360.0 * max_val).round().clip(0, max_val).cast(pl.Int64)
+        y = ((pl.col(lat_col).cast(pl.Float64) + 90.0) / 180.0 * max_val).round().clip(0, max_val).cast(pl.Int64)
+
+        return self._spread_bits(x) | (self._spread_bits(y) * 2)
+
+    def _spread_bits(self, expr: pl.Expr) -> pl.Expr:
+        """
+        Spreads the lower 16 bits of an integer so there is a zero bit between each
+        (multiplication used as a left shift).
+        """
+        expr = (expr | (expr * 256)) & 0x00FF00FF
+        expr = (expr | (expr * 16)) & 0x0F0F0F0F
+        expr = (expr | (expr * 4)) & 0x33333333
+        expr = (expr | (expr * 2)) & 0x55555555
+        return expr
+
+    def spatial_key_sql(self, lat_col: str, lon_col: str, bits: int = None) -> str:
+        """The same Morton key as spatial_key_expr as a DuckDB SQL expression"""
+        bits = bits or self.spatial_key_bits
+        max_val = (1 << bits) - 1
+
+        def quantized(col: str, offset: float, extent: float) -> str:
+            return f"CAST(least(greatest(round((CAST(\"{col}\" AS DOUBLE) + {offset}) / {extent} * {max_val}), 0), {max_val}) AS BIGINT)"
+
+        def spread(value: str) -> str:
+            for shift, mask in [(8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)]:
+                value = f"(({value}) | (({value}) << {shift})) & {mask}"
+            return value
+
+        return f"(({spread(quantized(lon_col, 180.0, 360.0))}) | (({spread(quantized(lat_col, 90.0, 180.0))}) << 1))"
+
+    def sort_columns(self, columns: list) -> tuple:
+        """
+        (has coordinates, time columns) the sort is built from for a table with these columns
+        """
+        has_coordinates = self.LATITUDE in columns and self.LONGITUDE in columns
+        return has_coordinates, [c for c in self.TIME_COLUMNS if c in columns][:2]
+
+    def sort_exprs(self, columns: list) -> list:
+        """The polars sort keys for a table with these columns (empty if there's nothing to sort on)"""
+        has_coordinates, time_columns = self.sort_columns(columns=columns)
+        if has_coordinates:
+            return [
+                self.spatial_key_expr(lat_col=self.LATITUDE, lon_col=self.LONGITUDE, bits=self.coarse_spatial_key_bits),
+                *[pl.col(c) for c in time_columns],
+                self.spatial_key_expr(lat_col=self.LATITUDE, lon_col=self.LONGITUDE)
+            ]
+        if self.OCCURRENCE_SOURCE_ID in columns:
+            return [pl.col(self.OCCURRENCE_SOURCE_ID)]
+        return [pl.col(c) for c in time_columns]
+
+    def sort_lf(self, lf: pl.LazyFrame) -> pl.LazyFrame:
+        sort_exprs = self.sort_exprs(columns=lf.collect_schema().names())
+        return lf.sort(sort_exprs, nulls_last=True) if sort_exprs else lf
+
+    def order_by_sql(self, columns: list) -> str:
+        """The DuckDB ORDER BY clause for a table with these columns (empty if there's nothing to sort on)"""
+        has_coordinates, time_columns = self.sort_columns(columns=columns)
+        if has_coordinates:
+            keys = [
+                self.spatial_key_sql(lat_col=self.LATITUDE, lon_col=self.LONGITUDE, bits=self.coarse_spatial_key_bits),
+                *[f'"{c}"' for c in time_columns],
+                self.spatial_key_sql(lat_col=self.LATITUDE, lon_col=self.LONGITUDE)
+            ]
+        elif self.OCCURRENCE_SOURCE_ID in columns:
+            keys = [self.OCCURRENCE_SOURCE_ID]
+        else:
+            keys = [f'"{c}"' for c in time_columns]
+
+        return f"ORDER BY {', '.join(f'{k} NULLS LAST' for k in keys)}" if keys else ""
+
+    def duckdb_copy_options(self) -> str:
+        """The options for DuckDB's COPY ... TO 'file.parquet' (...)"""
+        return f"FORMAT PARQUET, COMPRESSION {self.compression}, COMPRESSION_LEVEL {self.compression_level}, ROW_GROUP_SIZE {self.row_group_size}"
+
+    def writer_options(self, columns: list) -> dict:
+        """Keyword arguments for pyarrow's write_table/ParquetWriter"""
+        return {
+            "compression": self.compression,
+            "compression_level": self.compression_level,
+            "data_page_size": self.data_page_size,
+            "use_dictionary": [c for c in self.DICTIONARY_COLUMNS if c in columns],
+            "bloom_filter_options": {c: {"ndv": self.row_group_size, "fpp": self.bloom_filter_fpp} for c in self.BLOOM_FILTER_COLUMNS if c in columns},
+            "write_statistics": True,
+            "write_page_index": True
+        }
+
+    def write_table(self, table: pa.Table, output_file: Path):
+        pq.write_table(table, output_file, row_group_size=self.row_group_size, **self.writer_options(columns=table.schema.names))
+
+    def rewrite_parquet(self, parquet_file: Path):
+        """
+        Rewrites a parquet file (e.g. written by DuckDB's COPY, which can't set bloom filters
+        or dictionary encoding per column) in place with this layout's encodings. The row
+        order and the file's key-value metadata (like GeoParquet's geo) are kept.
+        """
+        parquet_file = Path(parquet_file)
+        tmp_file = parquet_file.with_suffix(".layout.tmp")
+
+        source = pq.ParquetFile(parquet_file)
+        with pq.ParquetWriter(tmp_file, source.schema_arrow, **self.writer_options(columns=source.schema_arrow.names)) as writer:
+            for batch in source.iter_batches(batch_size=self.row_group_size):
+                writer.write_table(pa.Table.from_batches([batch]), row_group_size=self.row_group_size)
+
+        tmp_file.replace(parquet_file)
+
+
+class ParquetLayoutWriter:
+    """
+    A streaming parquet writer with the layout's encodings for polars' sink_batches, so a
+    sorted lazy frame can be written as one of several sinks in a pl.collect_all. Call
+    close() after the plan has run.
+    """
+
+    def __init__(self, layout: ParquetLayoutPolicy, output_file: str, schema: pl.Schema):
+        self.layout = layout
+        self.output_file = Path(output_file)
+        self.schema = schema
+        self.writer = None
+        self.arrow_schema = None
+
+    def __call__(self, df: pl.DataFrame):
+        table = df.to_arrow()
+        if self.writer is None:
+            self.arrow_schema = table.schema
+            self.writer = pq.ParquetWriter(self.output_file, self.arrow_schema, **self.layout.writer_options(columns=self.arrow_schema.names))
+        self.writer.write_table(table.cast(self.arrow_schema), row_group_size=self.layout.row_group_size)
+
+    def sink(self, lf: pl.LazyFrame, lazy: bool = True):
+        """Sorts the lazy frame by the layout and sinks it into this writer"""
+        sink = self.layout.sort_lf(lf=lf).sink_batches(self, chunk_size=self.layout.row_group_size, lazy=True)
+        if lazy:
+            return sink
+        sink.collect(engine="streaming")
+        self.close()
+
+    def close(self):
+        if self.writer is None:
+            # Nothing was written, still leave a (empty) file with the schema
+            self.layout.write_table(table=pl.DataFrame(schema=self.schema).to_arrow(), output_file=self.output_file)
+        else:
+            self.writer.close()
@@ -1,6 +1,10 @@
 from models.dna_derived import DnaDerived
 from models.mof import MeasurementOfFact
 from models.occurrence import Occurrence
+from models.gbif_dataset import GbifDataset
+from models.dimensions import DIMENSION_COLUMNS, DIMENSION_TABLES, DIMENSION_VIEWS, dimension_key_column
+from models.erddap_views import ERDDAP_VIEWS
+from models.mof_wide import build_mof_wide_table, MOF_WIDE_TABLE_NAME
 
 from database import Base, engine
 
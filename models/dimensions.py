@@ -0,0 +1,85 @@
+from sqlalchemy import Table, Column, Integer, Text, Identity, select, event, DDL
+from sqlalchemy.dialects import postgresql
+from models.mof import MeasurementOfFact
+from models.occurrence import Occurrence
+from database import Base
+
+# Dictionary encoded (dimension) tables for high repetition categorical columns. The fact
+# tables store an integer <column>_key and the v_<table> views join the dimensions back so
+# they present the original string columns.
+
+# fact table: columns that are dictionary encoded
+DIMENSION_COLUMNS = {
+   'occurrence': ['basisOfRecord', 'country', 'institutionCode', 'license'],
+   'mof': ['measurementType', 'measurementUnit', 'datasetkey']
+}
+
+def dimension_key_column(column_name: str) -> str:
+   """measurementType -> measurementType_key"""
+   return f'{column_name}_key'
+
+def dimension_table_name(table_name: str, column_name: str) -> str:
+   """(mof, measurementType) -> dim_mof_measurementtype"""
+   return f'dim_{table_name}_{column_name.lower()}'
+
+def build_dimension_table(table_name: str, column_name: str) -> Table:
+   return Table(
+      dimension_table_name(table_name, column_name),
+      Base.metadata,
+      Column('key', Integer, Identity(), primary_key=True),
+      Column('value', Text, nullable=False, unique=True),
+      comment=f'Distinct values of {table_name}.{column_name}'
+   )
+
+# {(fact table, column): dimension Table}
+DIMENSION_TABLES = {
+   (table_name, column_name): build_dimension_table(table_name, column_name)
+   for table_name, column_names in DIMENSION_COLUMNS.items()
+   for column_name in column_names
+}
+
+def expand_dimension_columns(fact_table: Table, columns: list) -> list:
+   """
+   Replaces the <column>_key columns of the fact table with the dimension value
+   labeled as the original column name (keeping the column order)
+   """
+   key_to_dimension = {
+      dimension_key_column(column_name): (column_name, DIMENSION_TABLES[(fact_table.name, column_name)])
+      for column_name in DIMENSION_COLUMNS.get(fact_table.name, [])
+   }
+
+   expanded_columns = []
+   for column in columns:
+      if column.table is fact_table and column.name in key_to_dimension:
+         column_name, dimension_table = key_to_dimension[column.name]
+         expanded_columns.append(dimension_table.c.value.label(column_name))
+      else:
+         expanded_columns.append(column)
+
+   return expanded_columns
+
+def join_dimensions(from_clause, fact_table: Table):
+   """Left joins every dimension of the fact table onto the from clause"""
+   for column_name in DIMENSION_COLUMNS.get(fact_table.name, []):
+      dimension_table = DIMENSION_TABLES[(fact_table.name, column_name)]
+      from_clause = from_clause.outerjoin(dimension_table, fact_table.c[dimension_key_column(column_name)] == dimension_table.c.key)
+
+   return from_clause
+
+def expanded_select(fact_table: Table):
+   """The fact table with its original string columns"""
+   return select(*expand_dimension_columns(fact_table, list(fact_table.c))).select_from(join_dimensions(fact_table, fact_table))
+
+# view name: select statement
+DIMENSION_VIEWS = {
+   'v_occurrence': expanded_select(Occurrence.__table__),
+   'v_mof': expanded_select(MeasurementOfFact.__table__)
+}
+
+def compile_view_select(stmt) -> str:
+   # DDL does %-style substitution so escape any literal percent signs
+   return str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})).replace('%', '%%')
+
+for view_name, view_select in DIMENSION_VIEWS.items():
+   event.listen(Base.metadata, 'after_create', DDL(f'CREATE OR REPLACE VIEW {view_name} AS {compile_view_select(view_select)}'))
+   event.listen(Base.metadata, 'before_drop', DDL(f'DROP VIEW IF EXISTS {view_name}'))
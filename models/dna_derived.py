@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, BigInteger, String, Float, Text, PrimaryKeyConstraint, ForeignKeyConstraint
+from sqlalchemy import Integer, BigInteger, String, Float, Text, PrimaryKeyConstraint, ForeignKeyConstraint, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from typing import Optional
 from database import Base
@@ -148,6 +148,8 @@ class DnaDerived(Base):
          ['occurrence.data_source', 'occurrence.source_id'],
          name='fk_dna_occurrrence'
       ),
+      # Join to occurrence in the ERDDAP view
+      Index('idx_dna_derived_occurrence', 'data_source', 'occurrence_source_id'),
       )
    
    # Add relationship so we can do things like DnaDerived.occurrence for querying
@@ -0,0 +1,59 @@
+from sqlalchemy import select, func, event, DDL, ARRAY, Text
+from models.dimensions import expand_dimension_columns, join_dimensions, compile_view_select
+from models.dna_derived import DnaDerived
+from models.mof import MeasurementOfFact
+from models.occurrence import Occurrence
+from database import Base
+
+# ERDDAP facing views for EDDTableFromDatabase. ERDDAP turns user constraints into plain
+# range predicates on latitude, longitude, time and depth, so each view exposes those
+# names over the indexed occurrence columns (erddap_time and erddap_depth are generated
+# columns on occurrence). The views are plain (not materialized) so Postgres inlines them
+# and the predicates reach the occurrence indexes. Dictionary encoded columns are joined
+# back to their string values (see models/dimensions.py).
+
+# Occurrence columns ERDDAP can't use or that are exposed under their ERDDAP name (depth is
+# in erddap_depth, which falls back on minimumDepthInMeters, and would otherwise be relabeled depth_1)
+OCCURRENCE_EXCLUDED_COLUMNS = ['location', 'location_polar', 'geometry', 'decimalLatitude', 'decimalLongitude', 'erddap_time', 'erddap_depth', 'depth']
+
+def erddap_coordinate_columns() -> list:
+   """The latitude, longitude, time and depth columns named the way ERDDAP expects them"""
+   return [
+      Occurrence.decimalLatitude.label('latitude'),
+      Occurrence.decimalLongitude.label('longitude'),
+      Occurrence.erddap_time.label('time'),
+      Occurrence.erddap_depth.label('depth')
+   ]
+
+def erddap_array_columns(columns: list) -> list:
+   """ERDDAP can't read arrays (OBIS flags, areas, ...) so they're exposed as comma separated strings"""
+   return [func.array_to_string(c, ',', type_=Text).label(c.name) if isinstance(c.type, ARRAY) else c for c in columns]
+
+def erddap_occurrence_select():
+   occurrence_table = Occurrence.__table__
+   occurrence_columns = erddap_array_columns([c for c in occurrence_table.c if c.name not in OCCURRENCE_EXCLUDED_COLUMNS])
+   return (
+      select(*erddap_coordinate_columns(), *expand_dimension_columns(occurrence_table, occurrence_columns))
+      .select_from(join_dimensions(occurrence_table, occurrence_table))
+   )
+
+def erddap_extension_select(ext_model):
+   """dna_derived and mof only have coordinates/time through the occurrence they belong to"""
+   ext_table = ext_model.__table__
+   ext_join = ext_table.join(Occurrence.__table__, (ext_model.data_source == Occurrence.data_source) & (ext_model.occurrence_source_id == Occurrence.source_id))
+   return (
+      select(*erddap_coordinate_columns(), *expand_dimension_columns(ext_table, list(ext_table.c)))
+      .select_from(join_dimensions(ext_join, ext_table))
+   )
+
+# view name: select statement. Also used to build the ERDDAP dataset variables.
+ERDDAP_VIEWS = {
+   'erddap_occurrence': erddap_occurrence_select(),
+   'erddap_dna_derived': erddap_extension_select(DnaDerived),
+   'erddap_mof': erddap_extension_select(MeasurementOfFact)
+}
+
+# Create the views after the tables and drop them before the tables so create_all/drop_all handle them
+for view_name, view_select in ERDDAP_VIEWS.items():
+   event.listen(Base.metadata, 'after_create', DDL(f'CREATE OR REPLACE VIEW {view_name} AS {compile_view_select(view_select)}'))
+   event.listen(Base.metadata, 'before_drop', DDL(f'DROP VIEW IF EXISTS {view_name}'))
@@ -0,0 +1,26 @@
+from sqlalchemy import String, Double, Date, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from datetime import date
+from typing import Optional
+from database import Base
+
+class GbifDataset(Base):
+   """The flattened GBIF dataset EML metadata (see gbif/parse/gbif_dataset_parser.py), joined on occurrence.datasetKey"""
+   __tablename__ = 'gbif_dataset'
+
+   datasetKey: Mapped[str] = mapped_column(String(36), primary_key=True)
+
+   title: Mapped[Optional[str]] = mapped_column(Text)
+   publisher: Mapped[Optional[str]] = mapped_column(Text)
+   license: Mapped[Optional[str]] = mapped_column(Text)
+   licenseUrl: Mapped[Optional[str]] = mapped_column(Text)
+   citation: Mapped[Optional[str]] = mapped_column(Text)
+   doi: Mapped[Optional[str]] = mapped_column(Text)
+   pubDate: Mapped[Optional[date]] = mapped_column(Date)
+   language: Mapped[Optional[str]] = mapped_column(String(32))
+   westBoundingCoordinate: Mapped[Optional[float]] = mapped_column(Double)
+   eastBoundingCoordinate: Mapped[Optional[float]] = mapped_column(Double)
+   northBoundingCoordinate: Mapped[Optional[float]] = mapped_column(Double)
+   southBoundingCoordinate: Mapped[Optional[float]] = mapped_column(Double)
+   beginDate: Mapped[Optional[date]] = mapped_column(Date, comment="Start of the dataset's temporal coverage")
+   endDate: Mapped[Optional[date]] = mapped_column(Date, comment="End of the dataset's temporal coverage")
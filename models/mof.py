@@ -1,5 +1,5 @@
 from typing import Optional
-from sqlalchemy import Integer, String, Text, PrimaryKeyConstraint, ForeignKeyConstraint
+from sqlalchemy import Integer, String, Text, Double, PrimaryKeyConstraint, ForeignKeyConstraint, ForeignKey, Index
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 from database import Base
 
@@ -12,15 +12,18 @@ class MeasurementOfFact(Base):
 
    occurrence_source_id: Mapped[str] = mapped_column(String(50), index=True)
    
-   datasetkey: Mapped[Optional[str]] = mapped_column(String(36))
+   datasetkey_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_mof_datasetkey.key'), comment="datasetkey, dictionary encoded (see models/dimensions.py)")
    measurementID: Mapped[Optional[str]] = mapped_column(Text)
    occurrenceID: Mapped[Optional[str]] = mapped_column(Text, comment="From GBIF, the univerisal Darwin Core identifier created by the data producer. May be aligned with the id field below from Obis?")
-   measurementType: Mapped[Optional[str]] = mapped_column(String(100), index=True)
+   measurementType_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_mof_measurementtype.key'), index=True, comment="measurementType, dictionary encoded (see models/dimensions.py)")
    measurementtypeid: Mapped[Optional[str]] = mapped_column(Text)
    measurementValue: Mapped[Optional[str]] = mapped_column(Text)
+   measurementValueNumeric: Mapped[Optional[float]] = mapped_column(Double, index=True, comment="measurementValue parsed to a number by the ETL (null if not numeric)")
+   measurementUnitCanonical: Mapped[Optional[str]] = mapped_column(String(64), comment="measurementUnit normalized through etl/unit_conversions.csv")
+   measurementValueCanonical: Mapped[Optional[float]] = mapped_column(Double, comment="measurementValueNumeric converted to measurementUnitCanonical")
    measurementvalueid: Mapped[Optional[str]] = mapped_column(Text)
    measurementAccuracy: Mapped[Optional[str]] = mapped_column(Text)
-   measurementUnit: Mapped[Optional[str]] = mapped_column(String(64), index=True)
+   measurementUnit_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_mof_measurementunit.key'), index=True, comment="measurementUnit, dictionary encoded (see models/dimensions.py)")
    measurementunitid: Mapped[Optional[str]] = mapped_column(Text)
    measurementDeterminedDate: Mapped[Optional[str]] = mapped_column(String(64))
    measurementDeterminedBy: Mapped[Optional[str]] = mapped_column(Text)
@@ -39,6 +42,10 @@ class MeasurementOfFact(Base):
          ['occurrence.data_source', 'occurrence.source_id'],
          name='fk_mof_occurrrence'
       ),
+      # Join to occurrence in the ERDDAP view
+      Index('idx_mof_occurrence', 'data_source', 'occurrence_source_id'),
+      # Range filters like "temperature between 0 and 4 degC"
+      Index('idx_mof_type_canonical_value', 'measurementType_key', 'measurementUnitCanonical', 'measurementValueCanonical'),
       )
    
    # Add relationship so we can do things like MeasurementOfFocat.occurrence for querying
@@ -0,0 +1,30 @@
+from sqlalchemy import Table, Column, String, Double, PrimaryKeyConstraint, ForeignKeyConstraint, event, DDL
+from database import Base
+
+# The wide measurement-or-fact table (see etl/mof_pivoter.py). Its value columns depend on
+# the top measurementType/measurementUnit pairs of each load, so the table is built at load
+# time instead of being a declarative model.
+
+MOF_WIDE_TABLE_NAME = 'mof_wide'
+
+def build_mof_wide_table(value_columns: list) -> Table:
+   """One double precision column per pivoted measurementType/measurementUnit pair"""
+   if MOF_WIDE_TABLE_NAME in Base.metadata.tables:
+      Base.metadata.remove(Base.metadata.tables[MOF_WIDE_TABLE_NAME])
+
+   return Table(
+      MOF_WIDE_TABLE_NAME,
+      Base.metadata,
+      Column('data_source', String(4), nullable=False),
+      Column('occurrence_source_id', String(50), nullable=False),
+      *[Column(column_name, Double) for column_name in value_columns],
+      PrimaryKeyConstraint('data_source', 'occurrence_source_id', name='mof_wide_pkey'),
+      ForeignKeyConstraint(
+         ['data_source', 'occurrence_source_id'],
+         ['occurrence.data_source', 'occurrence.source_id'],
+         name='fk_mof_wide_occurrence'
+      )
+   )
+
+# A new process doesn't know the columns of the last wide table, so drop it by name before the other tables
+event.listen(Base.metadata, 'before_drop', DDL(f'DROP TABLE IF EXISTS {MOF_WIDE_TABLE_NAME}'))
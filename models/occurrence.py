@@ -1,6 +1,7 @@
-from sqlalchemy import Integer, String, Float, DateTime, Text, PrimaryKeyConstraint, BigInteger, Index
+from sqlalchemy import Integer, String, Float, Double, DateTime, Text, PrimaryKeyConstraint, BigInteger, Index, Computed, ForeignKey, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
-from geoalchemy2 import Geography
+from sqlalchemy.dialects.postgresql import ARRAY
+from geoalchemy2 import Geography, Geometry
 from datetime import datetime
 from typing import Optional
 from database import Base
@@ -15,13 +16,14 @@ class Occurrence(Base):
 
    # spatial
    location: Mapped[Optional[Geography]] = mapped_column(Geography(geometry_type='POINT', srid=4326, use_typmod=True)) # index automatically created for geography
+   location_polar: Mapped[Optional[Geometry]] = mapped_column(Geometry(geometry_type='POINT', srid=3413), comment="location in EPSG:3413 (NSIDC polar stereographic north) for planar Arctic region/radius queries") # GiST index automatically created for geometry
    decimalLatitude: Mapped[Optional[float]] = mapped_column(Float)
    decimalLongitude: Mapped[Optional[float]] = mapped_column(Float)
 
    accessRights: Mapped[Optional[str]] = mapped_column(Text)
    bibliographicCitation: Mapped[Optional[str]] = mapped_column(Text)
    language: Mapped[Optional[str]] = mapped_column(Text)
-   license: Mapped[Optional[str]] = mapped_column(Text)
+   license_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_occurrence_license.key'), comment="license, dictionary encoded (see models/dimensions.py)")
    modified: Mapped[Optional[datetime]] = mapped_column(DateTime)
    publisher: Mapped[Optional[str]] = mapped_column(Text)
    references: Mapped[Optional[str]] = mapped_column(Text)
@@ -30,11 +32,11 @@ class Occurrence(Base):
    institutionID: Mapped[Optional[str]] = mapped_column(Text)
    collectionID: Mapped[Optional[str]] = mapped_column(Text)
    datasetID: Mapped[Optional[str]] = mapped_column(Text)
-   institutionCode: Mapped[Optional[str]] = mapped_column(String(100))
+   institutionCode_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_occurrence_institutioncode.key'), comment="institutionCode, dictionary encoded (see models/dimensions.py)")
    collectionCode: Mapped[Optional[str]] = mapped_column(String(100))
    datasetName: Mapped[Optional[str]] = mapped_column(Text)
    ownerInstitutionCode: Mapped[Optional[str]] = mapped_column(Text)
-   basisOfRecord: Mapped[Optional[str]] = mapped_column(Text)
+   basisOfRecord_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_occurrence_basisofrecord.key'), index=True, comment="basisOfRecord, dictionary encoded (see models/dimensions.py)")
    informationWithheld: Mapped[Optional[str]] = mapped_column(Text)
    dataGeneralizations: Mapped[Optional[str]] = mapped_column(Text)
    dynamicProperties: Mapped[Optional[str]] = mapped_column(Text)
@@ -208,8 +210,8 @@ class Occurrence(Base):
    taxonomicIssue: Mapped[Optional[str]] = mapped_column(Text)
    nonTaxonomicIssue: Mapped[Optional[str]] = mapped_column(Text)
    mediaType: Mapped[Optional[str]] = mapped_column(Text)
-   hasCoordinate: Mapped[Optional[str]] = mapped_column(Text)
-   hasGeospatialIssues: Mapped[Optional[str]] = mapped_column(Text)
+   hasCoordinate: Mapped[Optional[int]] = mapped_column(Integer) # boolean
+   hasGeospatialIssues: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    taxonKey: Mapped[Optional[int]] = mapped_column(Integer)
    acceptedTaxonKey: Mapped[Optional[int]] = mapped_column(Integer)
    kingdomKey: Mapped[Optional[int]] = mapped_column(Integer)
@@ -232,10 +234,10 @@ class Occurrence(Base):
    lastParsed: Mapped[Optional[datetime]] = mapped_column(DateTime)
    lastCrawled: Mapped[Optional[datetime]] = mapped_column(DateTime)
    isInvasive: Mapped[Optional[str]] = mapped_column(Text)
-   repatriated: Mapped[Optional[str]] = mapped_column(Text)
+   repatriated: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    relativeOrganismQuantity: Mapped[Optional[str]] = mapped_column(Text)
    projectId: Mapped[Optional[str]] = mapped_column(Text)
-   isSequenced: Mapped[Optional[str]] = mapped_column(Text)
+   isSequenced: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    gbifRegion: Mapped[Optional[str]] = mapped_column(Text)
    publishedByGbifRegion: Mapped[Optional[str]] = mapped_column(Text)
    level0Gid: Mapped[Optional[str]] = mapped_column(Text)
@@ -251,12 +253,12 @@ class Occurrence(Base):
    has_mof: Mapped[Optional[int]] = mapped_column(Integer)
    dataset_id: Mapped[Optional[str]] = mapped_column(Text)
    aphiaid: Mapped[Optional[int]] = mapped_column(Integer)
-   areas: Mapped[Optional[str]] = mapped_column(String)
+   areas: Mapped[Optional[list[int]]] = mapped_column(ARRAY(Integer)) # OBIS area ids
    associatedMedia: Mapped[Optional[str]] = mapped_column(Text)
    bathymetry: Mapped[Optional[str]] = mapped_column(String)
    brackish: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    classid: Mapped[Optional[str]] = mapped_column(String)
-   country: Mapped[Optional[str]] = mapped_column(Text)
+   country_key: Mapped[Optional[int]] = mapped_column(Integer, ForeignKey('dim_occurrence_country.key'), comment="country, dictionary encoded (see models/dimensions.py)")
    date_end: Mapped[Optional[int]] = mapped_column(BigInteger)
    date_mid: Mapped[Optional[int]] = mapped_column(BigInteger)
    date_start: Mapped[Optional[int]] = mapped_column(BigInteger)
@@ -345,17 +347,36 @@ class Occurrence(Base):
    verbatimLatitude: Mapped[Optional[str]] = mapped_column(Text)
    verbatimLongitude: Mapped[Optional[str]] = mapped_column(Text)
    wrims: Mapped[Optional[int]] = mapped_column(Integer) # boolean
-   missing: Mapped[Optional[str]] = mapped_column(Text)
-   invalid: Mapped[Optional[str]] = mapped_column(Text)
-   flags: Mapped[Optional[str]] = mapped_column(Text)
+   missing: Mapped[Optional[list[str]]] = mapped_column(ARRAY(Text)) # OBIS quality control
+   invalid: Mapped[Optional[list[str]]] = mapped_column(ARRAY(Text))
+   flags: Mapped[Optional[list[str]]] = mapped_column(ARRAY(Text))
    dropped: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    absence: Mapped[Optional[int]] = mapped_column(Integer) # boolean
    geometry: Mapped[Optional[str]] = mapped_column(String)
 
+   # ERDDAP - generated by Postgres (never loaded by the ETL) so ERDDAP's numeric time/depth constraints can use an index
+   erddap_time: Mapped[Optional[float]] = mapped_column(Double, Computed('EXTRACT(EPOCH FROM "startEventDate")', persisted=True), comment="startEventDate as seconds since 1970-01-01T00:00:00Z for ERDDAP")
+   erddap_depth: Mapped[Optional[float]] = mapped_column(Double, Computed('COALESCE("depth", "minimumDepthInMeters")', persisted=True), comment="depth (GBIF) or minimumDepthInMeters (OBIS) for ERDDAP")
+
    __table_args__ = (
       PrimaryKeyConstraint('data_source', 'source_id', name='occurrence_pkey'),
       Index('idx_occurrence_min_depth', 'minimumDepthInMeters'),
       Index('idx_occurrence_max_depth', 'maximumDepthInMeters'),
       Index('idx_occurrence_time_start', 'startEventDate'),
-      Index('idx_occurrence_time_end', 'endEventDate')
+      Index('idx_occurrence_time_end', 'endEventDate'),
+      # Joins to the GBIF dataset metadata (gbif_dataset)
+      Index('idx_occurrence_dataset_key', 'datasetKey'),
+      # ERDDAP constraints come in as range predicates on time, latitude, longitude and depth
+      Index('idx_occurrence_erddap_time_lat_lon', 'erddap_time', 'decimalLatitude', 'decimalLongitude'),
+      Index('idx_occurrence_erddap_lat_lon_time', 'decimalLatitude', 'decimalLongitude', 'erddap_time'),
+      Index('idx_occurrence_erddap_source_time', 'data_source', 'erddap_time'),
+      Index('idx_occurrence_erddap_depth', 'erddap_depth'),
+      # OBIS quality control arrays. GIN answers containment (flags @> '{ON_LAND}') but not its negation
+      Index('idx_occurrence_flags', 'flags', postgresql_using='gin'),
+      Index('idx_occurrence_missing', 'missing', postgresql_using='gin'),
+      Index('idx_occurrence_invalid', 'invalid', postgresql_using='gin'),
+      Index('idx_occurrence_areas', 'areas', postgresql_using='gin'),
+      # The usual exclusion, NOT (flags @> '{ON_LAND}'), gets a partial index of its own (the rows
+      # without flags, e.g. all of GBIF, are in it too) so time constrained queries skip the land records
+      Index('idx_occurrence_erddap_time_not_on_land', 'erddap_time', postgresql_where=text("flags IS NULL OR NOT (flags @> '{ON_LAND}')"))
       )
\ No newline at end of file
@@ -0,0 +1,51 @@
+import polars as pl
+from sqlalchemy import select, func
+from database import engine
+from models import Occurrence
+from etl.polar_projection import POLAR_SRID, polar_scale_factor
+
+class OccurrenceQuery:
+    """
+    Region and radius filters on occurrence using the EPSG:3413 location_polar column.
+    Planar math on the projected points (and its GiST index) instead of the spheroidal
+    math of the geography location column, and boxes that don't break down near the
+    pole or across the antimeridian.
+    """
+
+    def __init__(self, engine=engine):
+        self.engine = engine
+
+    def region_filter(self, xmin: float, ymin: float, xmax: float, ymax: float):
+        """Occurrences inside a box in EPSG:3413 meters"""
+        return Occurrence.location_polar.ST_Intersects(func.ST_MakeEnvelope(xmin, ymin, xmax, ymax, POLAR_SRID))
+
+    def polygon_filter(self, polygon_wkt: str, srid: int = 4326):
+        """Occurrences inside a polygon (lon/lat WKT by default), transformed once to EPSG:3413"""
+        polygon = func.ST_GeomFromText(polygon_wkt, srid)
+        if srid != POLAR_SRID:
+            polygon = func.ST_Transform(polygon, POLAR_SRID)
+        return Occurrence.location_polar.ST_Intersects(polygon)
+
+    def radius_filter(self, lon: float, lat: float, radius_m: float):
+        """
+        Occurrences within radius_m meters of a lon/lat point. The radius is scaled by the
+        projection's scale factor at the point so it's in ground meters.
+        """
+        center = func.ST_Transform(func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326), POLAR_SRID)
+        return func.ST_DWithin(Occurrence.location_polar, center, radius_m * polar_scale_factor(lat=lat))
+
+    def select(self, *filters, columns: list = None, limit: int = None):
+        """Select statement for the occurrence columns (all but the geometries by default) matching every filter"""
+        if columns is None:
+            columns = [c for c in Occurrence.__table__.c if c.name not in ('location', 'location_polar', 'geometry')]
+
+        stmt = select(*columns).where(*filters)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return stmt
+
+    def fetch(self, *filters, columns: list = None, limit: int = None) -> pl.DataFrame:
+        """Runs the query and returns the matching occurrences"""
+        stmt = self.select(*filters, columns=columns, limit=limit)
+        with self.engine.connect() as conn:
+            return pl.read_database(query=stmt, connection=conn)
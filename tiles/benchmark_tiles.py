@@ -0,0 +1,62 @@
+import argparse
+import math
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from tiles.occurrence_tile_server import OccurrenceTileServer
+
+def arctic_tiles(z: int, n_tiles: int, min_latitude: float = 60.0, seed: int = 0) -> list:
+    """Random z/x/y tiles poleward of min_latitude (the same tiles for the same seed)"""
+    n = 2 ** z
+    max_y = int((1 - math.asinh(math.tan(math.radians(min_latitude))) / math.pi) / 2 * n) # tile row of min_latitude
+    all_tiles = [(z, x, y) for x in range(n) for y in range(0, max_y + 1)]
+
+    rng = random.Random(seed)
+    return rng.sample(all_tiles, min(n_tiles, len(all_tiles)))
+
+def run_pass(tile_server: OccurrenceTileServer, tiles: list, filters: dict, workers: int) -> dict:
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda t: tile_server.get_tile(*t, filters=filters), tiles))
+    elapsed = time.time() - start_time
+
+    return {
+        "tiles": len(tiles),
+        "seconds": elapsed,
+        "tiles_per_second": len(tiles) / elapsed if elapsed else float("inf"),
+        "cache_hits": sum(cached for _, cached in results),
+        "mean_kb": sum(len(tile) for tile, _ in results) / max(len(results), 1) / 1024
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Benchmark occurrence vector tiles per second (cold and cached) against the PostGIS database in DATABASE_URL"
+    )
+    parser.add_argument('-z', '--zooms', type=int, nargs='+', default=[2, 4, 6, 8, 10], help="zoom levels to benchmark")
+    parser.add_argument('-n', '--n_tiles', type=int, default=50, help="number of Arctic tiles per zoom level")
+    parser.add_argument('-w', '--workers', type=int, default=4, help="concurrent tile requests (the engine's pool size is the real limit)")
+    parser.add_argument('--data_source', type=str, default=None, help="optional data_source filter (gbif or obis)")
+
+    args = parser.parse_args()
+    load_dotenv()
+
+    from database import engine
+
+    cache_dir = tempfile.mkdtemp(prefix="tile_benchmark_")
+    tile_server = OccurrenceTileServer(engine=engine, cache_dir=cache_dir)
+    filters = {"data_source": args.data_source}
+
+    try:
+        print(f"{'zoom':>4} {'pass':>6} {'tiles':>6} {'seconds':>8} {'tiles/s':>9} {'hits':>5} {'mean KB':>8}")
+        for z in args.zooms:
+            tiles = arctic_tiles(z=z, n_tiles=args.n_tiles)
+            for pass_name in ("cold", "cached"):
+                result = run_pass(tile_server=tile_server, tiles=tiles, filters=filters, workers=args.workers)
+                print(f"{z:>4} {pass_name:>6} {result['tiles']:>6} {result['seconds']:>8.2f} {result['tiles_per_second']:>9.1f} {result['cache_hits']:>5} {result['mean_kb']:>8.1f}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
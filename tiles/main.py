@@ -0,0 +1,38 @@
+import argparse
+import os
+from dotenv import load_dotenv
+
+from tiles.occurrence_tile_server import OccurrenceTileServer
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description = "Serve occurrence vector tiles (MVT) from the PostGIS database with an on-disk tile cache"
+    )
+    parser.add_argument('--host', type=str, default="localhost", help="host to serve on")
+    parser.add_argument('-p', '--port', type=int, default=8081, help="port to serve on")
+    parser.add_argument(
+        '-c',
+        '--cache_dir',
+        type=str,
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tile_cache'),
+        help="directory the tiles are cached in. Defaults to tiles/tile_cache"
+    )
+    parser.add_argument(
+        '-m',
+        '--manifest_dir',
+        type=str,
+        default=None,
+        help="ETL load manifest directory (LOAD_MANIFEST_DIR) so each load gets a fresh cache. Defaults to etl/load_manifests"
+    )
+
+    args = parser.parse_args()
+
+    # DATABASE_URL comes from the .env file
+    load_dotenv()
+    from database import engine
+
+    manifest_dir = args.manifest_dir or os.getenv('LOAD_MANIFEST_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'etl', 'load_manifests'))
+
+    tile_server = OccurrenceTileServer(engine=engine, cache_dir=args.cache_dir, manifest_dir=manifest_dir)
+    tile_server.serve(host=args.host, port=args.port)
@@ -0,0 +1,196 @@
+import hashlib
+import json
+import math
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from sqlalchemy import text
+from erddap.erddap_flag_publisher import ErddapFlagPublisher
+
+class OccurrenceTileServer:
+    """
+    Builds Mapbox Vector Tiles (web mercator z/x/y) of occurrence.location with PostGIS
+    (ST_AsMVT). At low zooms the points are aggregated into grid cells with a count so a
+    tile never carries millions of points. Tiles are cached on disk keyed by the load
+    version (from the ETL load manifest), a hash of the filters and z/x/y, so a new load
+    never serves stale tiles and nothing has to be purged by hand.
+    """
+
+    LAYER_NAME = "occurrence"
+    EXTENT = 4096 # tile coordinate space
+    BUFFER = 64
+    MAX_LATITUDE = 85.0511287798 # web mercator limit
+    MAX_ZOOM = 22
+
+    # filter name: how it's applied (every value is a bind parameter)
+    FILTERS = {
+        "data_source": 'data_source = :data_source',
+        "scientificName": '"scientificName" = :scientificName',
+        "start": '"startEventDate" >= CAST(:start AS timestamp)',
+        "end": '"startEventDate" <= CAST(:end AS timestamp)'
+    }
+
+    def __init__(self, engine, cache_dir: str, manifest_dir: str = None, aggregate_max_zoom: int = 8, grid_cells: int = 128):
+        """
+        aggregate_max_zoom is the last zoom where points are aggregated into
+        grid_cells x grid_cells cells per tile. Above it every point is drawn.
+        """
+        self.engine = engine
+        self.cache_dir = Path(cache_dir)
+        self.manifest_dir = Path(manifest_dir) if manifest_dir else None
+        self.aggregate_max_zoom = aggregate_max_zoom
+        self.grid_cells = grid_cells
+
+    def get_tile(self, z: int, x: int, y: int, filters: dict = None) -> tuple:
+        """
+        Returns (tile bytes, True if it came from the cache)
+        """
+        self.validate_tile(z=z, x=x, y=y)
+        filters = self.clean_filters(filters=filters)
+        cache_file = self.cache_path(z=z, x=x, y=y, filters=filters)
+        if cache_file.exists():
+            return cache_file.read_bytes(), True
+
+        tile = self.render_tile(z=z, x=x, y=y, filters=filters)
+
+        # Write then rename so concurrent requests never read a half written tile
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{datetime.now().timestamp()}.tmp")
+        tmp_file.write_bytes(tile)
+        tmp_file.replace(cache_file)
+
+        return tile, False
+
+    def validate_tile(self, z: int, x: int, y: int):
+        """Raises ValueError if z/x/y isn't a web mercator tile"""
+        if not 0 <= z <= self.MAX_ZOOM:
+            raise ValueError(f"z must be between 0 and {self.MAX_ZOOM}, got {z}")
+        n = 2 ** z
+        if not (0 <= x < n and 0 <= y < n):
+            raise ValueError(f"x and y must be between 0 and {n - 1} at zoom {z}, got x={x}, y={y}")
+
+    def clean_filters(self, filters: dict = None) -> dict:
+        """Only the known, non-empty filters"""
+        return {k: v for k, v in (filters or {}).items() if k in self.FILTERS and v not in (None, "")}
+
+    def load_version(self) -> str:
+        """
+        Fingerprint of the latest load manifest (see erddap/erddap_flag_publisher.py) so a
+        new ETL load starts a new cache
+        """
+        if self.manifest_dir is None:
+            return "unversioned"
+
+        latest_file = self.manifest_dir / ErddapFlagPublisher.LATEST_MANIFEST_FILE
+        if not latest_file.exists():
+            return "unversioned"
+
+        with open(latest_file) as f:
+            datasets = json.load(f).get("datasets", {})
+        return hashlib.sha256(json.dumps({k: v["fingerprint"] for k, v in datasets.items()}, sort_keys=True).encode()).hexdigest()[:16]
+
+    def filter_hash(self, filters: dict) -> str:
+        return hashlib.sha256(json.dumps(filters, sort_keys=True).encode()).hexdigest()[:16]
+
+    def cache_path(self, z: int, x: int, y: int, filters: dict) -> Path:
+        return self.cache_dir / self.load_version() / self.filter_hash(filters) / str(z) / str(x) / f"{y}.mvt"
+
+    def tile_bounds(self, z: int, x: int, y: int) -> tuple:
+        """(west, south, east, north) of the tile in degrees"""
+        n = 2 ** z
+        west = x / n * 360 - 180
+        east = (x + 1) / n * 360 - 180
+        north = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+        south = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+        return west, south, east, north
+
+    def build_tile_sql(self, z: int, filters: dict) -> str:
+        """
+        The tile bounds are applied to decimalLatitude/decimalLongitude so the
+        (decimalLatitude, decimalLongitude, erddap_time) index does the spatial filtering
+        """
+        where = ['"decimalLatitude" BETWEEN :south AND :north', '"decimalLongitude" BETWEEN :west AND :east', 'location IS NOT NULL']
+        where += [self.FILTERS[name] for name in filters]
+
+        points_sql = f"""
+            SELECT ST_Transform(location::geometry, 3857) AS geom, source_id, data_source, "scientificName", erddap_time
+            FROM occurrence
+            WHERE {' AND '.join(where)}
+        """
+
+        if z <= self.aggregate_max_zoom:
+            # count points per grid cell (snapped to the nearest grid node, which is the center of the cell around it)
+            features_sql = f"""
+                SELECT ST_AsMVTGeom(cell, ST_TileEnvelope(:z, :x, :y), {self.EXTENT}, {self.BUFFER}, true) AS geom,
+                       count
+                FROM (
+                    SELECT ST_SnapToGrid(geom, :cell_size) AS cell, count(*) AS count
+                    FROM ({points_sql}) points
+                    GROUP BY cell
+                ) cells
+            """
+        else:
+            features_sql = f"""
+                SELECT ST_AsMVTGeom(geom, ST_TileEnvelope(:z, :x, :y), {self.EXTENT}, {self.BUFFER}, true) AS geom,
+                       source_id, data_source, "scientificName", erddap_time AS time
+                FROM ({points_sql}) points
+            """
+
+        return f"SELECT ST_AsMVT(features, '{self.LAYER_NAME}', {self.EXTENT}, 'geom') FROM ({features_sql}) features WHERE geom IS NOT NULL"
+
+    def render_tile(self, z: int, x: int, y: int, filters: dict) -> bytes:
+        west, south, east, north = self.tile_bounds(z=z, x=x, y=y)
+        cell_size = 2 * math.pi * 6378137 / (2 ** z) / self.grid_cells # web mercator meters
+
+        params = {"z": z, "x": x, "y": y, "west": west, "south": south, "east": east, "north": north,
+                  "cell_size": cell_size, **filters}
+
+        with self.engine.connect() as conn:
+            tile = conn.execute(text(self.build_tile_sql(z=z, filters=filters)), params).scalar()
+
+        return bytes(tile) if tile is not None else b""
+
+    def serve(self, host: str = "localhost", port: int = 8081):
+        """
+        Serves /tiles/{z}/{x}/{y}.mvt?data_source=obis&scientificName=...&start=2000-01-01&end=2020-12-31
+        """
+        tile_server = self
+
+        class TileRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                if len(parts) != 4 or parts[0] != "tiles" or not parts[3].endswith(".mvt"):
+                    self.send_error(404, "Expected /tiles/{z}/{x}/{y}.mvt")
+                    return
+
+                try:
+                    z, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-len(".mvt")])
+                except ValueError:
+                    self.send_error(400, "z, x and y must be integers")
+                    return
+
+                try:
+                    tile_server.validate_tile(z=z, x=x, y=y)
+                except ValueError as e:
+                    self.send_error(400, str(e))
+                    return
+
+                filters = {k: v[0] for k, v in parse_qs(url.query).items()}
+                try:
+                    tile, cached = tile_server.get_tile(z=z, x=x, y=y, filters=filters)
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+                self.send_header("Content-Length", str(len(tile)))
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.send_header("X-Tile-Cache", "HIT" if cached else "MISS")
+                self.end_headers()
+                self.wfile.write(tile)
+
+        print(f"Serving occurrence tiles at http://{host}:{port}/tiles/{{z}}/{{x}}/{{y}}.mvt")
+        ThreadingHTTPServer((host, port), TileRequestHandler).serve_forever()